@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+BACKEND_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# git-service.py isn't an importable module name, so it is loaded from its path, the way the Zappa handler does.
+LOAD_SERVICE = """
+import importlib.util, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('git_service', 'git-service.py')
+service = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(service)
+imported = time.perf_counter()
+response = service.app.test_client().get('/')
+responded = time.perf_counter()
+print(f'import_ms={(imported - started) * 1000:.1f} first_response_ms={(responded - started) * 1000:.1f} '
+      f'status={response.status_code}')
+"""
+
+
+def import_profile(top=15):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', LOAD_SERVICE], cwd=BACKEND_DIRECTORY,
+                            capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        imports.append((int(cumulative_us), int(self_us), name))
+    return result.stdout.strip(), sorted(imports, reverse=True)[:top]
+
+
+def main():
+    runs = int(os.environ.get('COLD_START_RUNS', 5))
+    for run in range(runs):
+        timing, imports = import_profile()
+        print(f'run {run + 1}: {timing}')
+    print(f"\n{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+    for cumulative_us, self_us, name in imports:
+        print(f'{cumulative_us / 1000:>16.1f} {self_us / 1000:>10.1f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
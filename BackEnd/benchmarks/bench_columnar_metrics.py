@@ -0,0 +1,52 @@
+import os
+import time
+
+from bench_filter_memory import stored_pull_request_templates
+from columnar import accumulate_pull_request_columns
+from models import PullRequestMetrics
+from utils import accumulate_pull_request_metrics, pull_request_metrics_response, batched, METRIC_ATTRIBUTES
+
+BATCH_SIZE = 1000
+
+
+def projected_items(count):
+    # Items as a projected DynamoDB read returns them: only the metric attributes, numbers as Decimal.
+    top_level = {attribute.split('.')[0] for attribute in METRIC_ATTRIBUTES}
+    templates = [{name: value for name, value in item.items() if name in top_level}
+                 for item in stored_pull_request_templates(200)]
+    return [templates[index % len(templates)] for index in range(count)]
+
+
+def row_path(items):
+    metrics = PullRequestMetrics()
+    for pull_request in items:
+        accumulate_pull_request_metrics(metrics, pull_request)
+    return pull_request_metrics_response(metrics)
+
+
+def columnar_path(items):
+    metrics = PullRequestMetrics()
+    for batch in batched(items, BATCH_SIZE):
+        accumulate_pull_request_columns(metrics, batch)
+    return pull_request_metrics_response(metrics)
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    result = function(items)
+    return result, time.perf_counter() - start
+
+
+def main():
+    sizes = [int(size) for size in os.environ.get('COLUMNAR_SIZES', '100000,500000').split(',')]
+    print(f"{'PRs':>8} {'row path (s)':>13} {'columnar (s)':>13} {'speedup':>8}")
+    for size in sizes:
+        items = projected_items(size)
+        rows, row_time = timed(row_path, items)
+        columns, columnar_time = timed(columnar_path, items)
+        assert rows == columns, (rows, columns)
+        print(f"{size:>8} {row_time:>13.2f} {columnar_time:>13.2f} {row_time / columnar_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
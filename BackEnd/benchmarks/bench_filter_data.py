@@ -0,0 +1,88 @@
+import logging
+import os
+import resource
+import statistics
+import time
+
+from bench_filter_memory import stored_pull_request_templates
+from fake_dynamodb import FakeDynamoDB, stored_form
+from fixtures import timestamp
+from replay import load_service, use_dynamodb
+from db_client import bump_data_generation, update_rollups
+from utils import accumulate_rollup
+
+PROJECTS = ('synthetic',)
+REPOSITORIES = ('repo0', 'repo1', 'repo2', 'repo3')
+AUTHOR_COUNT = 50
+YEAR_SECONDS = 365 * 86400
+
+# The read paths /filterData takes: rollups alone, rollups with the partial days at either end read through an
+# index, an index query with a filter, and a full scan with a filter.
+SCENARIOS = [
+    ('everything (rollups)', {}),
+    ('project, whole days (rollups)', {'project': 'synthetic', 'from_date': '2024-03-01T00:00:00Z',
+                                       'to_date': '2024-05-31T23:59:59Z'}),
+    ('repository, partial days', {'repository': 'repo1', 'from_date': '2024-03-01T12:00:00Z',
+                                  'to_date': '2024-05-31T12:00:00Z'}),
+    ('author + mergeable (index)', {'author': 'user7', 'mergeable_state': 'CONFLICTING'}),
+    ('mergeable (full scan)', {'mergeable_state': 'CONFLICTING'})
+]
+
+
+def populate(dynamodb, size):
+    # Stored pull request items cloned from mapped synthetic ones and spread over a year, and the rollups that
+    # ingestion would have written for them.
+    templates = [stored_form(item) for item in stored_pull_request_templates(200)]
+    items = []
+    rollups = {}
+    for index in range(size):
+        item = dict(templates[index % len(templates)], id=f'PR_{index}', pr_id=f'PR_{index}',
+                    project=PROJECTS[index % len(PROJECTS)], repository=REPOSITORIES[index % len(REPOSITORIES)],
+                    author=f'user{index % AUTHOR_COUNT}',
+                    createdAt=timestamp(index * YEAR_SECONDS // size))
+        accumulate_rollup(rollups, item)
+        items.append(item)
+    dynamodb.Table('pull-requests').load(items)
+    update_rollups(rollups, dynamodb)
+    return len(rollups)
+
+
+def latency(client, dynamodb, criteria, repeat):
+    # Each cold request runs against a new data generation, so it misses the filter cache; the warm one hits it.
+    cold = []
+    for _ in range(repeat):
+        bump_data_generation(dynamodb)
+        started = time.perf_counter()
+        response = client.post('/filterData', json=criteria)
+        cold.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    client.post('/filterData', json=criteria)
+    warm = time.perf_counter() - started
+    return statistics.median(cold), warm, response.get_json()['pull_request_count']
+
+
+def main():
+    sizes = [int(size) for size in os.environ.get('FILTER_DATA_SIZES', '1000,100000,1000000').split(',')]
+    repeat = int(os.environ.get('FILTER_DATA_REPEAT', 3))
+    service = load_service(FakeDynamoDB())
+    logging.getLogger().setLevel(logging.WARNING)
+    client = service.app.test_client()
+
+    print(f"{'PRs':>8} {'scenario':<31} {'matched':>8} {'cold (ms)':>10} {'warm (ms)':>10}")
+    for size in sizes:
+        dynamodb = FakeDynamoDB()
+        started = time.perf_counter()
+        rollup_count = populate(dynamodb, size)
+        use_dynamodb(service, dynamodb)
+        # The new table starts again at generation 0, which the previous size's cached results are keyed on.
+        service.filter_cache.cache.clear()
+        for name, criteria in SCENARIOS:
+            cold, warm, matched = latency(client, dynamodb, criteria, repeat)
+            print(f"{size:>8} {name:<31} {matched:>8} {cold * 1000:>10.1f} {warm * 1000:>10.2f}")
+        print(f"{size:>8} {rollup_count} rollups, populated and measured in {time.perf_counter() - started:.0f}s, "
+              f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+        del dynamodb
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import copy
+import os
+import time
+import tracemalloc
+
+from fixtures import synthetic_response
+from db_client import iterate_filtered_records
+from models import PullRequestMetrics
+from utils import (
+    map_github_response_to_repository,
+    accumulate_pull_request_metrics,
+    pull_request_metrics_response,
+    METRIC_ATTRIBUTES
+)
+
+PAGE_SIZE = 100
+
+
+class CapturingWriter:
+    def __init__(self):
+        self.items = []
+
+    def put(self, table_name, item):
+        if table_name == 'pull-requests':
+            self.items.append(item)
+
+
+def stored_pull_request_templates(count=20):
+    # Full pull-requests items, as create_pull_request writes them, to be cloned into a synthetic table.
+    writer = CapturingWriter()
+    map_github_response_to_repository(synthetic_response(count, comment_count=10, review_count=4), 'synthetic',
+                                      'synthetic', None, writer=writer)
+    return writer.items
+
+
+class SyntheticPullRequestTable:
+    # Generates items page by page like a DynamoDB scan, honouring ProjectionExpression on top-level attributes.
+    def __init__(self, item_count):
+        self.item_count = item_count
+        self.templates = stored_pull_request_templates()
+
+    def scan(self, ExclusiveStartKey=None, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        start = ExclusiveStartKey['index'] if ExclusiveStartKey else 0
+        end = min(start + PAGE_SIZE, self.item_count)
+        projected = None
+        if ProjectionExpression:
+            projected = {ExpressionAttributeNames[path.strip().split('.')[0]]
+                         for path in ProjectionExpression.split(',')}
+        items = []
+        for index in range(start, end):
+            item = copy.deepcopy(self.templates[index % len(self.templates)])
+            item['id'] = f'PR_{index}'
+            if projected is not None:
+                item = {name: value for name, value in item.items() if name in projected}
+            items.append(item)
+        results = {'Items': items}
+        if end < self.item_count:
+            results['LastEvaluatedKey'] = {'index': end}
+        return results
+
+
+class SyntheticClient:
+    def __init__(self, item_count):
+        self.table = SyntheticPullRequestTable(item_count)
+
+    def Table(self, table_name):
+        return self.table
+
+
+def materialized(client):
+    # The previous implementation: every page collected into one list before aggregating.
+    table = client.Table('pull-requests')
+    results = table.scan()
+    data = results.get('Items', [])
+    while 'LastEvaluatedKey' in results:
+        results = table.scan(ExclusiveStartKey=results['LastEvaluatedKey'])
+        data.extend(results.get('Items', []))
+    metrics = PullRequestMetrics()
+    for pull_request in data:
+        accumulate_pull_request_metrics(metrics, pull_request)
+    return pull_request_metrics_response(metrics)
+
+
+def streaming(client):
+    metrics = PullRequestMetrics()
+    for pull_request in iterate_filtered_records(None, client, 'pull-requests', METRIC_ATTRIBUTES):
+        accumulate_pull_request_metrics(metrics, pull_request)
+    return pull_request_metrics_response(metrics)
+
+
+def measure(function, client):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(client)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def main():
+    sizes = [int(size) for size in os.environ.get('FILTER_MEMORY_SIZES', '1000,5000,20000').split(',')]
+    print(f"{'PRs':>8} {'materialized peak (MB)':>23} {'streaming peak (MB)':>20} {'materialized (s)':>17} "
+          f"{'streaming (s)':>14}")
+    for size in sizes:
+        client = SyntheticClient(size)
+        before, before_peak, before_time = measure(materialized, client)
+        after, after_peak, after_time = measure(streaming, client)
+        assert before == after
+        print(f"{size:>8} {before_peak / 2 ** 20:>23.1f} {after_peak / 2 ** 20:>20.2f} {before_time:>17.2f} "
+              f"{after_time:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import logging
+import os
+import resource
+import time
+
+from fake_dynamodb import FakeDynamoDB
+from fake_github import RecordedFixtures, SyntheticFixtures, start_server
+from replay import load_service, run_cron_job, track_repositories
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    # REPLAY_FIXTURES replays recorded pages (see replay.py record); otherwise every repository gets
+    # REPLAY_PULL_REQUESTS synthetic pull requests.
+    page_size = int(os.environ.get('PULL_REQUEST_PAGE_SIZE', 25))
+    if os.environ.get('REPLAY_FIXTURES'):
+        fixtures = RecordedFixtures(os.environ['REPLAY_FIXTURES'])
+        repositories = fixtures.repositories()
+        expected_pull_requests = None
+    else:
+        pull_request_count = int(os.environ.get('REPLAY_PULL_REQUESTS', 500))
+        fixtures = SyntheticFixtures(pull_request_count, int(os.environ.get('REPLAY_COMMENTS', 20)),
+                                     int(os.environ.get('REPLAY_REVIEWS', 4)))
+        repositories = [('replay', f'repo{index}') for index in range(int(os.environ.get('REPLAY_REPOSITORIES', 4)))]
+        expected_pull_requests = pull_request_count * len(repositories)
+    url, server = start_server(fixtures, float(os.environ.get('REPLAY_GITHUB_LATENCY', 0)),
+                               repositories=repositories, page_size=page_size)
+
+    dynamodb = FakeDynamoDB()
+    # Enough pages per run for the backfill to finish in one run.
+    service = load_service(dynamodb, url, PULL_REQUEST_PAGE_SIZE=page_size,
+                           MAX_PAGES_PER_RUN=os.environ.get('MAX_PAGES_PER_RUN', 1000000), JOB_POLL_INTERVAL=0.05)
+    logging.getLogger().setLevel(logging.WARNING)
+    track_repositories(dynamodb, repositories)
+    print(f"{len(repositories)} repositories, {service.JOB_WORKERS} workers, page size {page_size}, "
+          f"peak RSS before the first run {peak_rss_mib():.0f} MiB")
+
+    print(f"{'run':>11} {'status':>9} {'PRs':>7} {'seconds':>8} {'PRs/s':>8} {'writes':>8} {'writes/s':>9} "
+          f"{'requests':>9} {'peak RSS (MiB)':>15}")
+    for run in ('backfill', 'incremental'):
+        pull_requests_before = dynamodb.writes.get('pull-requests', 0)
+        writes_before = dynamodb.write_count()
+        requests_before = service.github_scheduler.budget()['requests_made']
+        started = time.perf_counter()
+        status = run_cron_job(service)
+        elapsed = time.perf_counter() - started
+        pull_requests = dynamodb.writes.get('pull-requests', 0) - pull_requests_before
+        writes = dynamodb.write_count() - writes_before
+        requests_made = service.github_scheduler.budget()['requests_made'] - requests_before
+        print(f"{run:>11} {status['status']:>9} {pull_requests:>7} {elapsed:>8.2f} {pull_requests / elapsed:>8.0f} "
+              f"{writes:>8} {writes / elapsed:>9.0f} {requests_made:>9} {peak_rss_mib():>15.0f}")
+        if run == 'backfill' and expected_pull_requests is not None:
+            assert pull_requests == expected_pull_requests, (pull_requests, expected_pull_requests)
+    print(f"connections: {service.github_scheduler.connection_stats()}")
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import time
+import tracemalloc
+
+from boto3.dynamodb.types import TypeSerializer
+
+from fixtures import synthetic_comment, synthetic_response
+from db_client import serialize_item
+from models import Comment
+from utils import map_github_response_to_repository
+
+COMMENT_COUNT = 100000
+
+# Comment as it was before __slots__: the same __init__, with the attributes in a per-instance __dict__.
+DictComment = type('DictComment', (), {'__init__': Comment.__init__})
+
+
+class CapturingWriter:
+    def __init__(self):
+        self.items = []
+
+    def put(self, table_name, item):
+        self.items.append(item)
+
+
+def comment_memory(model):
+    nodes = [synthetic_comment(f'comment{index}', index, 'author')['node'] for index in range(COMMENT_COUNT)]
+    tracemalloc.start()
+    comments = [model(node['id'], node['body'], node['createdAt'], node['author']['login'], node.get('replyTo', {}),
+                      'pull-request', 'synthetic', 'synthetic') for node in nodes]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del comments
+    return size
+
+
+def serialization_rate(serialize, items, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            serialize(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(items) / best
+
+
+def main():
+    slotted = comment_memory(Comment)
+    unslotted = comment_memory(DictComment)
+    print(f"Memory per {COMMENT_COUNT:,} comments: {unslotted / 2 ** 20:.1f} MiB with __dict__, "
+          f"{slotted / 2 ** 20:.1f} MiB with __slots__")
+
+    writer = CapturingWriter()
+    map_github_response_to_repository(synthetic_response(500, comment_count=20, review_count=4), 'synthetic',
+                                      'synthetic', None, writer=writer)
+    type_serializer = TypeSerializer()
+    boto3_rate = serialization_rate(lambda item: {name: type_serializer.serialize(value)
+                                                  for name, value in item.items()}, writer.items)
+    single_pass_rate = serialization_rate(serialize_item, writer.items)
+    print(f"Serialization of {len(writer.items):,} pull request and comment items: "
+          f"{boto3_rate:,.0f} items/s with TypeSerializer, {single_pass_rate:,.0f} items/s single pass")
+
+
+if __name__ == '__main__':
+    main()
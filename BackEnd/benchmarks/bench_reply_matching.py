@@ -0,0 +1,50 @@
+import time
+
+from fixtures import synthetic_response, NullWriter
+from utils import map_github_response_to_repository, map_comments, map_reviews, computeClosureTime
+
+
+def quadratic_reply_time(all_comments):
+    # The pre-index implementation, kept as the reference the new one is compared against.
+    time_taken_to_reply = 0
+    comment_reply_count = 0
+    for comment in all_comments:
+        if comment.reply_to_comment_id is not None and comment.reply_to_comment_id.get('id', None) is not None:
+            comment_reply_count += 1
+            for other_comment in all_comments:
+                if other_comment.comment_id == comment.reply_to_comment_id.get('id', None):
+                    time_taken_to_reply += \
+                        computeClosureTime(other_comment.created_date_time, comment.created_date_time)['total_seconds']
+                    break
+    return time_taken_to_reply, comment_reply_count
+
+
+def best_of(function, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f"{'comments/PR':>12} {'mapping (ms)':>14} {'quadratic reply (ms)':>21}")
+    for comment_count in (10, 20, 40, 80, 160):
+        response = synthetic_response(1, comment_count=comment_count, review_count=10)
+        node = response['data']['repository']['pullRequests']['edges'][0]['node']
+        writer = NullWriter()
+
+        mapping = best_of(lambda: map_github_response_to_repository(response, 'synthetic', 'synthetic', None,
+                                                                    writer=writer))
+
+        comments = map_comments(node['comments']['edges'], node['id'], 'synthetic', 'synthetic', None, writer)
+        for review in map_reviews(node['reviews']['edges'], node['id'], 'synthetic', 'synthetic', None, writer):
+            comments.extend(review.comments)
+        quadratic = best_of(lambda: quadratic_reply_time(comments))
+
+        print(f"{len(comments):>12} {mapping * 1000:>14.2f} {quadratic * 1000:>21.2f}")
+
+
+if __name__ == '__main__':
+    main()
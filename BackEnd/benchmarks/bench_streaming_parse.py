@@ -0,0 +1,35 @@
+import io
+import json
+import time
+import tracemalloc
+
+from fixtures import synthetic_response
+from github_client import parse_streamed_body
+
+EDGES_PATH = 'data.repository.pullRequests.edges.item'
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    # The raw body is created before tracing starts, so both columns cover parsing only.
+    print(f"{'PRs/page':>9} {'body (KiB)':>11} {'json.loads peak (KiB)':>22} {'streamed peak (KiB)':>20} "
+          f"{'json.loads (ms)':>16} {'streamed (ms)':>14}")
+    for pull_request_count in (25, 50, 100):
+        body = json.dumps(synthetic_response(pull_request_count, comment_count=20, review_count=4)).encode()
+        loaded, loaded_peak = measure(lambda: json.loads(body))
+        streamed, streamed_peak = measure(lambda: parse_streamed_body(io.BytesIO(body), EDGES_PATH, lambda edge: None))
+        print(f"{pull_request_count:>9} {len(body) // 1024:>11} {loaded_peak // 1024:>22} {streamed_peak // 1024:>20} "
+              f"{loaded * 1000:>16.1f} {streamed * 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import random
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from fixtures import GITHUB_DATE_FORMAT, timestamp
+from utils import parse_github_timestamp
+
+TIMESTAMP_COUNT = 1000000
+# Within a pull request every reply is paired with the comment it answers, so the same few dozen timestamps come
+# up again and again; across pull requests they rarely repeat.
+TIMESTAMPS_PER_PULL_REQUEST = 25
+USES_PER_PULL_REQUEST = 100
+
+
+def pull_request_stream():
+    timestamps = []
+    created = 0
+    while len(timestamps) < TIMESTAMP_COUNT:
+        created += 3600
+        distinct = [timestamp(created + random.randint(0, 3000)) for _ in range(TIMESTAMPS_PER_PULL_REQUEST)]
+        timestamps.extend(random.choice(distinct) for _ in range(USES_PER_PULL_REQUEST))
+    return timestamps[:TIMESTAMP_COUNT]
+
+
+def uniform_stream():
+    return [timestamp(random.randint(0, 90 * 24 * 3600)) for _ in range(TIMESTAMP_COUNT)]
+
+
+def timed(function, timestamps):
+    start = time.perf_counter()
+    function(timestamps)
+    return time.perf_counter() - start
+
+
+def strptime_durations(timestamps):
+    # The previous implementation: datetime objects, and a Decimal made from the float seconds of every duration.
+    total = 0
+    for start, end in zip(timestamps[::2], timestamps[1::2]):
+        difference = datetime.strptime(end, GITHUB_DATE_FORMAT) - datetime.strptime(start, GITHUB_DATE_FORMAT)
+        total += Decimal(str(difference.total_seconds()))
+    return total
+
+
+def uncached_durations(timestamps):
+    parse = parse_github_timestamp.__wrapped__
+    total = 0
+    for start, end in zip(timestamps[::2], timestamps[1::2]):
+        total += parse(end) - parse(start)
+    return total
+
+
+def cached_durations(timestamps):
+    total = 0
+    for start, end in zip(timestamps[::2], timestamps[1::2]):
+        total += parse_github_timestamp(end) - parse_github_timestamp(start)
+    return total
+
+
+def main():
+    random.seed(1)
+    for stream_name, stream in (('grouped by pull request', pull_request_stream),
+                                ('uniformly random', uniform_stream)):
+        timestamps = stream()
+        assert strptime_durations(timestamps[:1000]) == uncached_durations(timestamps[:1000])
+        print(f"{TIMESTAMP_COUNT:,} timestamps {stream_name}, as {TIMESTAMP_COUNT // 2:,} durations")
+        for name, function in (('strptime + Decimal', strptime_durations),
+                               ('fromisoformat, int seconds', uncached_durations),
+                               ('memoized, int seconds', cached_durations)):
+            parse_github_timestamp.cache_clear()
+            elapsed = timed(function, timestamps)
+            print(f"{name:>28}: {elapsed:6.2f} s, {TIMESTAMP_COUNT / elapsed / 1e6:5.2f} M timestamps/s")
+        print(f"{'memoization':>28}: {parse_github_timestamp.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,513 @@
+import copy
+import re
+import threading
+from bisect import bisect_left, bisect_right
+
+from boto3.dynamodb.conditions import AttributeBase, ConditionBase
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+import fixtures  # noqa: F401 (puts BackEnd on the path)
+from db_client import serialize_item
+
+# DynamoDB ends a scan or query page at 1 MB read; a full pull request item is about 1 KB.
+PAGE_ITEMS = 1000
+MAX_BATCH_WRITE_ITEMS = 25
+MAX_BATCH_GET_KEYS = 100
+MAX_TRANSACT_ITEMS = 100
+
+deserializer = TypeDeserializer()
+
+
+def client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+def stored_form(item):
+    # Items come back from DynamoDB with every number as Decimal; a round trip through the attribute value format
+    # gives a stored item the same types, and rejects floats the way boto3 does.
+    return {name: deserializer.deserialize(value) for name, value in serialize_item(item).items()}
+
+
+def resolve_path(item, path):
+    value = item
+    for name in path.split('.'):
+        if not isinstance(value, dict) or name not in value:
+            return None, False
+        value = value[name]
+    return value, True
+
+
+def compare(operator, left, right):
+    try:
+        if operator == '=':
+            return left == right
+        if operator == '<>':
+            return left != right
+        if operator == '<':
+            return left < right
+        if operator == '<=':
+            return left <= right
+        if operator == '>':
+            return left > right
+        if operator == '>=':
+            return left >= right
+    except TypeError:
+        # Values of different types never compare in DynamoDB.
+        return False
+    raise ValueError(f"Unsupported comparison {operator}")
+
+
+def evaluate_condition(condition, item):
+    # boto3 Key and Attr conditions, as the service builds them for KeyConditionExpression and FilterExpression.
+    expression = condition.get_expression()
+    operator = expression['operator']
+    if operator == 'AND':
+        return all(evaluate_condition(value, item) for value in expression['values'])
+    if operator == 'OR':
+        return any(evaluate_condition(value, item) for value in expression['values'])
+    if operator == 'NOT':
+        return not evaluate_condition(expression['values'][0], item)
+
+    if operator in ('attribute_exists', 'attribute_not_exists'):
+        exists = resolve_path(item, expression['values'][0].name)[1]
+        return exists if operator == 'attribute_exists' else not exists
+
+    operands = []
+    for value in expression['values']:
+        if isinstance(value, AttributeBase):
+            value, exists = resolve_path(item, value.name)
+            if not exists:
+                return False
+        elif isinstance(value, ConditionBase):
+            raise ValueError(f"Unsupported nested condition {value.get_expression()['operator']}")
+        operands.append(value)
+    if operator == 'BETWEEN':
+        return compare('>=', operands[0], operands[1]) and compare('<=', operands[0], operands[2])
+    if operator == 'IN':
+        return operands[0] in operands[1]
+    if operator == 'begins_with':
+        return isinstance(operands[0], str) and operands[0].startswith(operands[1])
+    if operator == 'contains':
+        return operands[1] in operands[0]
+    return compare(operator, operands[0], operands[1])
+
+
+TOKEN = re.compile(r'\s*(<>|<=|>=|[=<>(),]|[#:]?[A-Za-z_][\w.#]*)')
+
+
+class ExpressionParser:
+    # The string condition expressions the service writes by hand: comparisons, attribute_exists and
+    # attribute_not_exists, combined with AND, OR, NOT and parentheses.
+    def __init__(self, expression, names, values):
+        self.tokens = TOKEN.findall(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and token != expected:
+            raise ValueError(f"Expected {expected} at {token}")
+        self.position += 1
+        return token
+
+    def path(self, token):
+        return '.'.join(self.names.get(name, name) for name in token.split('.'))
+
+    def operand(self, item):
+        token = self.take()
+        if token.startswith(':'):
+            return self.values[token], True
+        return resolve_path(item, self.path(token))
+
+    def evaluate(self, item):
+        result = self.disjunction(item)
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected {self.peek()}")
+        return result
+
+    def disjunction(self, item):
+        result = self.conjunction(item)
+        while self.peek() == 'OR':
+            self.take()
+            result = self.conjunction(item) or result
+        return result
+
+    def conjunction(self, item):
+        result = self.negation(item)
+        while self.peek() == 'AND':
+            self.take()
+            result = self.negation(item) and result
+        return result
+
+    def negation(self, item):
+        if self.peek() == 'NOT':
+            self.take()
+            return not self.negation(item)
+        if self.peek() == '(':
+            self.take()
+            result = self.disjunction(item)
+            self.take(')')
+            return result
+        if self.peek() in ('attribute_exists', 'attribute_not_exists'):
+            function = self.take()
+            self.take('(')
+            exists = resolve_path(item, self.path(self.take()))[1]
+            self.take(')')
+            return exists if function == 'attribute_exists' else not exists
+        left, left_exists = self.operand(item)
+        operator = self.take()
+        right, right_exists = self.operand(item)
+        return left_exists and right_exists and compare(operator, left, right)
+
+
+UPDATE_CLAUSE = re.compile(r'\b(SET|ADD|REMOVE)\b')
+
+
+def update_target(item, path):
+    # The map that holds the last name of path, and that name. As in DynamoDB, every map along the path must exist.
+    *parents, name = path.split('.')
+    for parent in parents:
+        item = item.get(parent)
+        if not isinstance(item, dict):
+            raise client_error('ValidationException',
+                               'The document path provided in the update expression is invalid for update',
+                               'UpdateItem')
+    return item, name
+
+
+def apply_update(item, expression, names, values):
+    # SET path = :value, ADD path :number and REMOVE path, which is all the service's update expressions use.
+    # Returns the attributes SET or ADD changed, for ReturnValues='UPDATED_NEW'.
+    names = names or {}
+    values = values or {}
+    updated = {}
+    parts = UPDATE_CLAUSE.split(expression)
+    for action, clauses in zip(parts[1::2], parts[2::2]):
+        for clause in clauses.split(','):
+            clause = clause.strip()
+            if action == 'REMOVE':
+                target, name = update_target(item, resolve_names(clause, names))
+                target.pop(name, None)
+            elif action == 'SET':
+                path, value = (part.strip() for part in clause.split('='))
+                target, name = update_target(item, resolve_names(path, names))
+                target[name] = updated[name] = copy.deepcopy(values[value])
+            else:
+                path, value = clause.split()
+                target, name = update_target(item, resolve_names(path, names))
+                target[name] = updated[name] = target.get(name, 0) + values[value]
+    return updated
+
+
+def resolve_names(path, names):
+    return '.'.join(names.get(name, name) for name in path.split('.'))
+
+
+def project(item, projection, names):
+    # ProjectionExpression paths such as '#p0.#p1' keep the nested attributes they name.
+    if not projection:
+        return dict(item)
+    projected = {}
+    for path in projection.split(','):
+        path = [names.get(name, name) for name in path.strip().split('.')]
+        value, exists = resolve_path(item, '.'.join(path))
+        if not exists:
+            continue
+        target = projected
+        for name in path[:-1]:
+            target = target.setdefault(name, {})
+        target[path[-1]] = value
+    return projected
+
+
+class FakeIndex:
+    # A global secondary index named '<partition>-<sort>-index': items with both attributes, grouped by partition
+    # value and ordered by sort value.
+    def __init__(self, index_name, items):
+        self.partition_key, self.sort_key = index_name[:-len('-index')].split('-')
+        partitions = {}
+        for item in items:
+            if self.partition_key in item and self.sort_key in item:
+                partitions.setdefault(item[self.partition_key], []).append(item)
+        self.partitions = {}
+        for partition, partition_items in partitions.items():
+            partition_items.sort(key=lambda item: item[self.sort_key])
+            self.partitions[partition] = ([item[self.sort_key] for item in partition_items], partition_items)
+
+    def key_conditions(self, key_condition):
+        expression = key_condition.get_expression()
+        if expression['operator'] == 'AND':
+            return [condition for value in expression['values'] for condition in self.key_conditions(value)]
+        return [(expression['operator'], expression['values'][0].name, expression['values'][1:])]
+
+    def candidates(self, key_condition, start_key):
+        # The partition's items between the sort key bounds, as the positions start and end in its list.
+        partition = low = high = None
+        for operator, name, values in self.key_conditions(key_condition):
+            if name == self.partition_key:
+                partition = values[0]
+            elif operator == 'BETWEEN':
+                low, high = values
+            elif operator in ('>', '>='):
+                low = values[0]
+            elif operator in ('<', '<='):
+                high = values[0]
+        sort_values, items = self.partitions.get(partition, ([], []))
+        start = bisect_left(sort_values, low) if low is not None else 0
+        end = bisect_right(sort_values, high) if high is not None else len(items)
+        if start_key is not None:
+            start = bisect_left(sort_values, start_key[self.sort_key])
+            while items[start]['id'] != start_key['id']:
+                start += 1
+            start += 1
+        return items, start, end
+
+
+class FakeTable:
+    def __init__(self, name, database):
+        self.name = name
+        self.database = database
+        self.lock = database.lock
+        self.items = {}
+        # Scan order, and each key's place in it, so a page resumes from its LastEvaluatedKey directly.
+        self.order = []
+        self.positions = {}
+        self.indexes = {}
+
+    def store(self, item):
+        key = item['id']
+        if key not in self.items:
+            self.positions[key] = len(self.order)
+            self.order.append(key)
+        self.items[key] = item
+        self.indexes = {}
+        self.database.writes[self.name] = self.database.writes.get(self.name, 0) + 1
+
+    def load(self, items):
+        # Seeds items already in stored form, without the per-item conversion or write accounting of put_item.
+        with self.lock:
+            for item in items:
+                if item['id'] not in self.items:
+                    self.positions[item['id']] = len(self.order)
+                    self.order.append(item['id'])
+                self.items[item['id']] = item
+            self.indexes = {}
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        with self.lock:
+            item = self.items.get(Key['id'])
+            if item is None:
+                return {}
+            return {'Item': copy.deepcopy(project(item, ProjectionExpression, ExpressionAttributeNames or {}))}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                 **kwargs):
+        item = stored_form(Item)
+        with self.lock:
+            if ConditionExpression is not None:
+                self.check(ConditionExpression, self.items.get(item['id'], {}), ExpressionAttributeNames,
+                           ExpressionAttributeValues, 'PutItem')
+            self.store(item)
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    **kwargs):
+        with self.lock:
+            if ConditionExpression is not None:
+                self.check(ConditionExpression, self.items.get(Key['id'], {}), ExpressionAttributeNames,
+                           stored_form(ExpressionAttributeValues or {}), 'DeleteItem')
+            if self.items.pop(Key['id'], None) is not None:
+                self.order.remove(Key['id'])
+                self.positions = {key: position for position, key in enumerate(self.order)}
+                self.indexes = {}
+                self.database.writes[self.name] = self.database.writes.get(self.name, 0) + 1
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        values = stored_form(ExpressionAttributeValues or {})
+        with self.lock:
+            current = self.items.get(Key['id'], {})
+            if ConditionExpression is not None:
+                self.check(ConditionExpression, current, ExpressionAttributeNames, values, 'UpdateItem')
+            item = copy.deepcopy(current) or dict(Key)
+            updated = apply_update(item, UpdateExpression, ExpressionAttributeNames, values)
+            self.store(item)
+        return {'Attributes': copy.deepcopy(updated)} if ReturnValues == 'UPDATED_NEW' else {}
+
+    def check(self, expression, item, names, values, operation):
+        if not isinstance(expression, str):
+            passed = evaluate_condition(expression, item)
+        else:
+            passed = ExpressionParser(expression, names, values).evaluate(item)
+        if not passed:
+            raise client_error('ConditionalCheckFailedException', 'The conditional request failed', operation)
+
+    def page(self, items, start, end, matches, projection, names):
+        results = []
+        position = start
+        while position < end and position - start < PAGE_ITEMS:
+            item = items[position]
+            position += 1
+            if matches(item):
+                results.append(project(item, projection, names))
+        return results, position
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+             ExclusiveStartKey=None, **kwargs):
+        with self.lock:
+            start = self.positions[ExclusiveStartKey['id']] + 1 if ExclusiveStartKey else 0
+            keys = self.order[start:start + PAGE_ITEMS]
+            items = [self.items[key] for key in keys]
+        matches = (lambda item: evaluate_condition(FilterExpression, item)) if FilterExpression is not None \
+            else (lambda item: True)
+        results, _ = self.page(items, 0, len(items), matches, ProjectionExpression, ExpressionAttributeNames or {})
+        response = {'Items': results, 'Count': len(results), 'ScannedCount': len(items)}
+        if start + len(keys) < len(self.order):
+            response['LastEvaluatedKey'] = {'id': keys[-1]}
+        return response
+
+    def query(self, KeyConditionExpression, IndexName=None, FilterExpression=None, ProjectionExpression=None,
+              ExpressionAttributeNames=None, ExclusiveStartKey=None, **kwargs):
+        if IndexName is None:
+            raise ValueError("Only index queries are supported, the tables are keyed by id alone")
+        with self.lock:
+            if IndexName not in self.indexes:
+                self.indexes[IndexName] = FakeIndex(IndexName, self.items.values())
+            index = self.indexes[IndexName]
+        items, start, end = index.candidates(KeyConditionExpression, ExclusiveStartKey)
+
+        def matches(item):
+            return evaluate_condition(KeyConditionExpression, item) and \
+                (FilterExpression is None or evaluate_condition(FilterExpression, item))
+        results, position = self.page(items, start, end, matches, ProjectionExpression, ExpressionAttributeNames or {})
+        response = {'Items': results, 'Count': len(results), 'ScannedCount': position - start}
+        if position < end:
+            last = items[position - 1]
+            response['LastEvaluatedKey'] = {'id': last['id'], index.partition_key: last[index.partition_key],
+                                            index.sort_key: last[index.sort_key]}
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return FakeBatchWriter(self)
+
+
+class FakeBatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+
+class FakeLowLevelClient:
+    # The parts of client.meta.client the service calls, taking and returning attribute values.
+    def __init__(self, database):
+        self.database = database
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        if sum(len(requests) for requests in RequestItems.values()) > MAX_BATCH_WRITE_ITEMS:
+            raise client_error('ValidationException', 'Too many items requested for the BatchWriteItem call',
+                               'BatchWriteItem')
+        self.database.batch_write_requests += 1
+        for table_name, requests in RequestItems.items():
+            table = self.database.Table(table_name)
+            with table.lock:
+                for request in requests:
+                    item = request['PutRequest']['Item']
+                    table.store({name: deserializer.deserialize(value) for name, value in item.items()})
+        return {'UnprocessedItems': {}}
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        # Every condition is checked before anything is written, under the lock all tables share, so a transaction
+        # lands whole or not at all.
+        if len(TransactItems) > MAX_TRANSACT_ITEMS:
+            raise client_error('ValidationException', 'Member must have length less than or equal to 100',
+                               'TransactWriteItems')
+        actions = []
+        with self.database.lock:
+            reasons = []
+            for action in TransactItems:
+                (kind, request), = action.items()
+                table = self.database.Table(request['TableName'])
+                key = deserializer.deserialize((request.get('Key') or request.get('Item'))['id'])
+                if any(table is other and key == other_key for _, _, other, other_key in actions):
+                    raise client_error('ValidationException', 'Transaction request cannot include multiple '
+                                       'operations on one item', 'TransactWriteItems')
+                actions.append((kind, request, table, key))
+                values = {name: deserializer.deserialize(value)
+                          for name, value in (request.get('ExpressionAttributeValues') or {}).items()}
+                condition = request.get('ConditionExpression')
+                passed = condition is None or ExpressionParser(condition, request.get('ExpressionAttributeNames'),
+                                                               values).evaluate(table.items.get(key, {}))
+                reasons.append({'Code': 'None' if passed else 'ConditionalCheckFailed'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise ClientError({'Error': {'Code': 'TransactionCanceledException',
+                                             'Message': 'Transaction cancelled'},
+                                   'CancellationReasons': reasons}, 'TransactWriteItems')
+            for kind, request, table, key in actions:
+                if kind == 'Put':
+                    table.store({name: deserializer.deserialize(value) for name, value in request['Item'].items()})
+                elif kind == 'Update':
+                    values = {name: deserializer.deserialize(value)
+                              for name, value in (request.get('ExpressionAttributeValues') or {}).items()}
+                    item = copy.deepcopy(table.items.get(key, {})) or {'id': key}
+                    apply_update(item, request['UpdateExpression'], request.get('ExpressionAttributeNames'), values)
+                    table.store(item)
+                elif kind == 'Delete':
+                    table.delete_item(Key={'id': key})
+            self.database.transact_write_requests += 1
+        return {}
+
+
+class FakeMeta:
+    def __init__(self, database):
+        self.client = FakeLowLevelClient(database)
+
+
+class FakeDynamoDB:
+    # In-memory stand-in for the boto3 DynamoDB resource, covering the calls db_client and the service make on it.
+    # Every table is keyed by 'id'. Items are held in stored form and returned without the wire encoding, so reads
+    # here are cheaper than against DynamoDB, where each page is also serialized and deserialized.
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.writes = {}
+        self.batch_write_requests = 0
+        self.transact_write_requests = 0
+        self.meta = FakeMeta(self)
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                self.tables[name] = FakeTable(name, self)
+            return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            if len(request['Keys']) > MAX_BATCH_GET_KEYS:
+                raise client_error('ValidationException', 'Too many items requested for the BatchGetItem call',
+                                   'BatchGetItem')
+            table = self.Table(table_name)
+            names = request.get('ExpressionAttributeNames') or {}
+            with table.lock:
+                responses[table_name] = [copy.deepcopy(project(table.items[key['id']],
+                                                               request.get('ProjectionExpression'), names))
+                                         for key in request['Keys'] if key['id'] in table.items]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def write_count(self):
+        with self.lock:
+            return sum(self.writes.values())
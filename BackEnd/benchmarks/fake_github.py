@@ -0,0 +1,202 @@
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fixtures import synthetic_pull_request
+
+
+class SyntheticFixtures:
+    # pull_request_count synthetic pull requests in every repository asked for, newest first like the
+    # UPDATED_AT DESC order of PULL_REQUESTS_QUERY. A cursor names the last pull request of its page, so any page
+    # can be produced without the ones before it.
+    def __init__(self, pull_request_count, comment_count=20, review_count=4):
+        self.pull_request_count = pull_request_count
+        self.comment_count = comment_count
+        self.review_count = review_count
+
+    def pull_request(self, owner, name, number):
+        return synthetic_pull_request(number, self.comment_count, self.review_count, id_prefix=f'{owner}/{name}/')
+
+    def page(self, owner, name, first, cursor):
+        top = self.pull_request_count - 1 if cursor is None else int(cursor[len('cursor'):]) - 1
+        numbers = range(top, max(top - first, -1), -1)
+        edges = [self.pull_request(owner, name, number) for number in numbers]
+        return {
+            'name': name,
+            'pullRequests': {
+                'pageInfo': {'endCursor': edges[-1]['cursor'] if edges else None,
+                             'hasNextPage': bool(edges) and numbers[-1] > 0,
+                             'hasPreviousPage': cursor is not None},
+                'totalCount': self.pull_request_count,
+                'edges': edges
+            }
+        }
+
+    def single(self, owner, name, number):
+        node = self.pull_request(owner, name, number)['node'] if 0 <= number < self.pull_request_count else None
+        return {'name': name, 'pullRequests': {'totalCount': self.pull_request_count}, 'pullRequest': node}
+
+
+class RecordedFixtures:
+    # Response bodies saved by replay.record_repository, as <directory>/<owner>/<name>/<page>.json. Pages are served
+    # as recorded, whatever page size is asked for.
+    def __init__(self, directory):
+        self.bodies = {}
+        for owner in sorted(os.listdir(directory)):
+            for name in sorted(os.listdir(os.path.join(directory, owner))):
+                repository_directory = os.path.join(directory, owner, name)
+                cursor = None
+                for page_file in sorted(os.listdir(repository_directory)):
+                    with open(os.path.join(repository_directory, page_file)) as page:
+                        body = json.load(page)
+                    self.bodies[(owner, name, cursor)] = body
+                    cursor = body['data']['repository']['pullRequests']['pageInfo']['endCursor']
+
+    def repositories(self):
+        return sorted({(owner, name) for owner, name, _ in self.bodies})
+
+    def page(self, owner, name, first, cursor):
+        body = self.bodies.get((owner, name, cursor))
+        return body['data']['repository'] if body else None
+
+    def single(self, owner, name, number):
+        for (body_owner, body_name, _), body in self.bodies.items():
+            repository = body['data']['repository']
+            for edge in repository['pullRequests']['edges']:
+                if (body_owner, body_name) == (owner, name) and edge['node'].get('number') == number:
+                    return {'name': name, 'pullRequests': {'totalCount': repository['pullRequests']['totalCount']},
+                            'pullRequest': edge['node']}
+        return None
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, so the service's pooled sessions keep their connections alive as they do against GitHub.
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        failure = self.server.next_failure()
+        if failure is not None:
+            status, headers, body = failure
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, str(value))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        body, compressed = self.server.respond(request.get('query', ''), request.get('variables') or {})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if compressed is not None and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = compressed
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    # Answers PULL_REQUESTS_QUERY and PULL_REQUEST_QUERY from fixtures. Encoded pages are kept, so after
+    # prerender the time spent here is sending bytes, not building them. latency is added before every response
+    # to stand in for GitHub's own time to resolve the query.
+    daemon_threads = True
+
+    def __init__(self, fixtures, latency=0.0, compress=True, address=('127.0.0.1', 0)):
+        super().__init__(address, FakeGitHubHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.compress = compress
+        reset_at = datetime.now(timezone.utc) + timedelta(hours=1)
+        self.rate_limit = {'cost': 1, 'remaining': 5000, 'resetAt': reset_at.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        self.pages = {}
+        self.failures = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def fail_next(self, status, headers=None, body=''):
+        # Answers the next request with status, headers and body instead of the fixtures, to script GitHub's
+        # throttling (403 and 429, with or without Retry-After or X-RateLimit-*) and server errors.
+        with self.lock:
+            self.failures.append((status, headers or {}, body.encode() if isinstance(body, str) else body))
+
+    def next_failure(self):
+        with self.lock:
+            self.requests += 1
+            return self.failures.pop(0) if self.failures else None
+
+    def encode(self, repository):
+        if repository is None:
+            body = {'data': {'rateLimit': self.rate_limit, 'repository': None},
+                    'errors': [{'type': 'NOT_FOUND', 'message': 'Could not resolve to a Repository'}]}
+        else:
+            body = {'data': {'rateLimit': self.rate_limit, 'repository': repository}}
+        raw = json.dumps(body).encode()
+        return raw, gzip.compress(raw, compresslevel=6) if self.compress else None
+
+    def page(self, owner, name, first, cursor):
+        key = (owner, name, first, cursor)
+        with self.lock:
+            if key in self.pages:
+                return self.pages[key]
+        encoded = self.encode(self.fixtures.page(owner, name, first, cursor))
+        with self.lock:
+            self.pages[key] = encoded
+        return encoded
+
+    def respond(self, query, variables):
+        if 'pullRequest(number:' in query:
+            return self.encode(self.fixtures.single(variables['owner'], variables['name'], variables['number']))
+        return self.page(variables['owner'], variables['name'], variables['pullRequestCount'],
+                         variables.get('cursor'))
+
+    def prerender(self, repositories, page_size):
+        for owner, name in repositories:
+            cursor = None
+            while True:
+                self.page(owner, name, page_size, cursor)
+                repository = self.fixtures.page(owner, name, page_size, cursor)
+                page_info = (repository or {}).get('pullRequests', {}).get('pageInfo', {})
+                if not page_info.get('hasNextPage'):
+                    break
+                cursor = page_info['endCursor']
+
+
+def serve(connection, fixtures, latency, compress, repositories, page_size, port):
+    server = FakeGitHubServer(fixtures, latency, compress, ('127.0.0.1', port))
+    server.prerender(repositories, page_size)
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(fixtures, latency=0.0, compress=True, repositories=(), page_size=25, port=0):
+    # In a process of its own, so building and sending pages neither holds the service's GIL nor counts toward
+    # its RSS. Returns once the pages of repositories are rendered.
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve, daemon=True,
+                                      args=(child_connection, fixtures, latency, compress, repositories, page_size,
+                                            port))
+    process.start()
+    return f'http://127.0.0.1:{parent_connection.recv()}/graphql', process
+
+
+if __name__ == '__main__':
+    # Stands in for GitHub for a locally run service: GITHUB_GRAPHQL_URL=http://127.0.0.1:<port>/graphql
+    server = FakeGitHubServer(SyntheticFixtures(int(os.environ.get('REPLAY_PULL_REQUESTS', 500)),
+                                                int(os.environ.get('REPLAY_COMMENTS', 20)),
+                                                int(os.environ.get('REPLAY_REVIEWS', 4))),
+                              float(os.environ.get('REPLAY_GITHUB_LATENCY', 0)),
+                              address=('127.0.0.1', int(sys.argv[1]) if sys.argv[1:] else 8765))
+    print(f'Serving synthetic pull requests at http://127.0.0.1:{server.server_address[1]}/graphql')
+    server.serve_forever()
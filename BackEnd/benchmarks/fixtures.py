@@ -0,0 +1,97 @@
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+# Benchmarks run from BackEnd/benchmarks but import the service modules from BackEnd.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GITHUB_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+START_TIME = datetime(2024, 1, 1)
+
+
+def timestamp(seconds):
+    return (START_TIME + timedelta(seconds=seconds)).strftime(GITHUB_DATE_FORMAT)
+
+
+def synthetic_comment(comment_id, created_seconds, author, reply_to=None):
+    node = {
+        'id': comment_id,
+        'createdAt': timestamp(created_seconds),
+        'body': f'Comment {comment_id}',
+        'author': {'login': author}
+    }
+    if reply_to is not None:
+        node['replyTo'] = {'id': reply_to}
+    return {'node': node}
+
+
+def synthetic_pull_request(number, comment_count=20, review_count=4, seed=None, id_prefix=''):
+    # A pull request with comment_count issue comments and review_count reviews, each review holding
+    # comment_count comments where every other comment replies to an earlier one. id_prefix keeps the ids of
+    # several synthetic repositories apart.
+    rng = random.Random(seed if seed is not None else number)
+    pr_id = f'{id_prefix}PR_{number}'
+    created = number * 3600
+    comments = [synthetic_comment(f'{pr_id}_C{index}', created + index * 60, f'user{rng.randrange(50)}')
+                for index in range(comment_count)]
+    reviews = []
+    for review_index in range(review_count):
+        review_comments = []
+        for index in range(comment_count):
+            comment_id = f'{pr_id}_R{review_index}_{index}'
+            reply_to = review_comments[rng.randrange(len(review_comments))]['node']['id'] \
+                if index % 2 and review_comments else None
+            review_comments.append(synthetic_comment(comment_id, created + (review_index + 1) * 7200 + index * 90,
+                                                     f'user{rng.randrange(50)}', reply_to))
+        reviews.append({'node': {'state': 'COMMENTED', 'author': {'login': f'user{rng.randrange(50)}'},
+                                 'comments': {'edges': review_comments}}})
+
+    state = rng.choice(['OPEN', 'CLOSED', 'MERGED'])
+    closed = state != 'OPEN'
+    concluded = timestamp(created + rng.randrange(3600, 30 * 86400)) if closed else None
+    return {
+        'cursor': f'cursor{number}',
+        'node': {
+            'id': pr_id,
+            'state': state,
+            'number': number,
+            'title': f'Pull request {number}',
+            'author': {'login': f'user{rng.randrange(50)}'},
+            'createdAt': timestamp(created),
+            'updatedAt': timestamp(created + 86400),
+            'mergedAt': concluded if state == 'MERGED' else None,
+            'closedAt': concluded,
+            'closed': closed,
+            'mergeable': rng.choice(['MERGEABLE', 'CONFLICTING', 'UNKNOWN']),
+            'totalCommentsCount': comment_count * (review_count + 1),
+            'comments': {'edges': comments},
+            'reviews': {'edges': reviews}
+        }
+    }
+
+
+def synthetic_response(pull_request_count, comment_count=20, review_count=4, start=0, has_next_page=False,
+                       total_count=None):
+    edges = [synthetic_pull_request(number, comment_count, review_count)
+             for number in range(start, start + pull_request_count)]
+    return {'data': {
+        'rateLimit': {'cost': 1, 'remaining': 5000, 'resetAt': timestamp(3600)},
+        'repository': {
+            'name': 'synthetic',
+            'pullRequests': {
+                'pageInfo': {'endCursor': edges[-1]['cursor'] if edges else None, 'hasNextPage': has_next_page,
+                             'hasPreviousPage': start > 0},
+                'totalCount': total_count if total_count is not None else pull_request_count,
+                'edges': edges
+            }
+        }
+    }}
+
+
+class NullWriter:
+    def __init__(self):
+        self.count = 0
+
+    def put(self, table_name, item):
+        self.count += 1
@@ -0,0 +1,89 @@
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import fixtures  # noqa: F401 (puts BackEnd on the path)
+from db_client import create_tracked_repository, seed_tracked_repositories
+from fake_dynamodb import FakeDynamoDB
+from github_client import GitHubScheduler
+
+SERVICE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'git-service.py')
+GITHUB_URL = 'https://api.github.com/graphql'
+FINISHED_STATUSES = ('succeeded', 'partial', 'failed')
+
+
+def use_dynamodb(service, dynamodb):
+    # get_client is looked up at call time, so every route and worker of the service uses the stand-in.
+    service.get_client = lambda: dynamodb
+
+
+def load_service(dynamodb, github_url=GITHUB_URL, **environment):
+    # The service reads its configuration from the environment at import, so it is set before loading.
+    # git-service.py isn't an importable module name and is loaded from its path, the way the Zappa handler does.
+    os.environ.update({name: str(value) for name, value in environment.items()})
+    os.environ['GITHUB_GRAPHQL_URL'] = github_url
+    spec = importlib.util.spec_from_file_location('git_service', SERVICE_PATH)
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    use_dynamodb(service, dynamodb)
+    # The fake endpoint takes any token, so Secrets Manager is never called.
+    service.get_secret = lambda: 'replay'
+    return service
+
+
+def track_repositories(dynamodb, repositories):
+    # Seeded with nothing, since the fake GitHub doesn't serve the service's default repositories.
+    seed_tracked_repositories({}, dynamodb)
+    for project, repository in repositories:
+        create_tracked_repository(project, repository, dynamodb)
+
+
+def run_cron_job(service, timeout=3600, poll_interval=0.05):
+    # Queues a run through /runCronJob and polls /jobs/<job_id> until the workers have finished it.
+    client = service.app.test_client()
+    job_id = client.post('/runCronJob').get_json()['job_id']
+    deadline = time.monotonic() + timeout
+    while True:
+        status = client.get(f'/jobs/{job_id}').get_json()
+        if status['status'] in FINISHED_STATUSES:
+            return status
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Ingestion run {job_id} still {status['status']} after {timeout}s")
+        time.sleep(poll_interval)
+
+
+def record_repository(owner, name, directory, token, page_size=25, max_pages=None):
+    # Saves a live repository's PULL_REQUESTS_QUERY responses where fake_github.RecordedFixtures reads them.
+    query = load_service(FakeDynamoDB()).PULL_REQUESTS_QUERY
+    scheduler = GitHubScheduler(token, GITHUB_URL)
+    repository_directory = os.path.join(directory, owner, name)
+    os.makedirs(repository_directory, exist_ok=True)
+    cursor = None
+    page = 0
+    while max_pages is None or page < max_pages:
+        body = scheduler.execute(query, {'owner': owner, 'name': name, 'pullRequestCount': page_size,
+                                         'cursor': cursor})
+        repository = (body.get('data') or {}).get('repository')
+        if not repository:
+            raise RuntimeError(f"Unable to record {owner}/{name}: {body.get('errors')}")
+        with open(os.path.join(repository_directory, f'{page:05d}.json'), 'w') as page_file:
+            json.dump(body, page_file)
+        page += 1
+        page_info = repository['pullRequests']['pageInfo']
+        if not page_info['hasNextPage']:
+            break
+        cursor = page_info['endCursor']
+    return page
+
+
+if __name__ == '__main__':
+    # GITHUB_TOKEN=... python replay.py record <owner>/<name> <directory> [max pages]
+    if sys.argv[1:2] != ['record'] or len(sys.argv) < 4:
+        sys.exit('usage: replay.py record <owner>/<name> <directory> [max pages]')
+    owner, name = sys.argv[2].split('/')
+    pages = record_repository(owner, name, sys.argv[3], os.environ['GITHUB_TOKEN'],
+                              int(os.environ.get('PULL_REQUEST_PAGE_SIZE', 25)),
+                              int(sys.argv[4]) if len(sys.argv) > 4 else None)
+    print(f'Recorded {pages} pages of {owner}/{name}')
@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+import numpy as np
+
+from sketches import LOG_GAMMA, ZERO_BUCKET
+
+STATE_CODES = {'OPEN': 0, 'CLOSED': 1, 'MERGED': 2}
+MERGEABLE_CODES = {'MERGEABLE': 0, 'CONFLICTING': 1, 'UNKNOWN': 2}
+OTHER_CODE = 3
+ZERO_KEY = -1
+
+
+def seconds_column(pull_requests, attribute):
+    # Missing durations become NaN so they drop out of the masks below.
+    return np.fromiter(((pull_request.get(attribute) or {}).get('total_seconds', np.nan)
+                        for pull_request in pull_requests), dtype=np.float64, count=len(pull_requests))
+
+
+def load_columns(pull_requests):
+    count = len(pull_requests)
+    return {
+        'state': np.fromiter((STATE_CODES.get(pull_request.get('state'), OTHER_CODE)
+                              for pull_request in pull_requests), dtype=np.int8, count=count),
+        'mergeable': np.fromiter((MERGEABLE_CODES.get(pull_request.get('is_mergeable'), OTHER_CODE)
+                                  for pull_request in pull_requests), dtype=np.int8, count=count),
+        'comments': np.fromiter((pull_request.get('total_comments_count', 0) for pull_request in pull_requests),
+                                dtype=np.int64, count=count),
+        'closure': seconds_column(pull_requests, 'closureTime'),
+        'reply': seconds_column(pull_requests, 'avg_comment_reply_time')
+    }
+
+
+def add_to_sketch(sketch, values):
+    sketch.add_bucket(ZERO_BUCKET, int(np.count_nonzero(values < 1)))
+    keys, counts = np.unique(np.ceil(np.log(values[values >= 1]) / LOG_GAMMA).astype(np.int64), return_counts=True)
+    for key, count in zip(keys, counts):
+        sketch.add_bucket(str(key), int(count))
+
+
+def accumulate_pull_request_columns(metrics, pull_requests):
+    # Vectorized equivalent of accumulate_pull_request_metrics over one batch of pull request items. Sums of
+    # whole seconds are exact in float64, and are turned back into Decimal so the response is identical.
+    if not pull_requests:
+        return
+    columns = load_columns(pull_requests)
+
+    states = np.bincount(columns['state'], minlength=OTHER_CODE + 1)
+    metrics.pr_status.open_state += int(states[STATE_CODES['OPEN']])
+    metrics.pr_status.closed += int(states[STATE_CODES['CLOSED']])
+    metrics.pr_status.merged += int(states[STATE_CODES['MERGED']])
+
+    mergeable = np.bincount(columns['mergeable'], minlength=OTHER_CODE + 1)
+    metrics.mergeable_state.mergeable += int(mergeable[MERGEABLE_CODES['MERGEABLE']])
+    metrics.mergeable_state.conflicting += int(mergeable[MERGEABLE_CODES['CONFLICTING']])
+    metrics.mergeable_state.unknown += int(mergeable[MERGEABLE_CODES['UNKNOWN']])
+
+    metrics.total_comments += Decimal(int(columns['comments'].sum()))
+    metrics.pull_request_count += len(pull_requests)
+
+    closure = columns['closure'][~np.isnan(columns['closure'])]
+    if closure.size:
+        metrics.closure_seconds += Decimal(str(float(closure.sum())))
+        metrics.closure_count += int(closure.size)
+        add_to_sketch(metrics.closure_sketch, closure)
+
+    reply = columns['reply'][~np.isnan(columns['reply'])]
+    if reply.size:
+        metrics.reply_seconds += Decimal(str(float(reply.sum())))
+        metrics.reply_count += int(reply.size)
+
+    # Per pull request reply sketches are flattened into (bucket, count) columns and merged with one bincount.
+    sketches = [pull_request['reply_sketch'] for pull_request in pull_requests if pull_request.get('reply_sketch')]
+    if sketches:
+        keys = np.fromiter((ZERO_KEY if key == ZERO_BUCKET else int(key) for sketch in sketches for key in sketch),
+                           dtype=np.int64)
+        counts = np.fromiter((int(count) for sketch in sketches for count in sketch.values()), dtype=np.int64)
+        unique_keys, positions = np.unique(keys, return_inverse=True)
+        for key, count in zip(unique_keys, np.bincount(positions, weights=counts)):
+            metrics.reply_sketch.add_bucket(ZERO_BUCKET if key == ZERO_KEY else str(key), int(count))
@@ -1,14 +1,99 @@
 
+import json
 import logging
+import random
+import time
+from decimal import Decimal
+from botocore.exceptions import ClientError
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_pull_request(pull_request,client):
-    table = client.Table('pull-requests')
-    item = pull_request.to_dict()
+def serialize_attribute(value):
+    # Python value to DynamoDB attribute value in one recursive pass. The resource API does the same through
+    # TypeSerializer and then walks the request against the service model again, for every item it writes.
+    kind = type(value)
+    if kind is str:
+        return {'S': value}
+    if kind is bool:
+        return {'BOOL': value}
+    if kind is int or kind is Decimal:
+        return {'N': str(value)}
+    if value is None:
+        return {'NULL': True}
+    if kind is dict:
+        return {'M': {name: serialize_attribute(member) for name, member in value.items()}}
+    if kind is list or kind is tuple:
+        return {'L': [serialize_attribute(member) for member in value]}
+    if isinstance(value, str):
+        return {'S': str(value)}
+    if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+        return {'N': str(value)}
+    raise TypeError(f"Unsupported type {kind.__name__} for a DynamoDB attribute")
+
+
+def serialize_item(item):
+    return {name: serialize_attribute(value) for name, value in item.items()}
+
+
+class UnprocessedItemsError(Exception):
+    pass
+
+
+class BufferedWriter:
+    # Collects items, serialized as they are put, and writes them with BatchWriteItem requests of up to 25 across
+    # tables, resubmitting unprocessed items. Items are keyed by id so repeated puts within a batch are deduplicated.
+    def __init__(self, client, max_attempts=8, base_delay=0.05, max_delay=5, sleep=time.sleep):
+        self.client = client
+        self.items = {}
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    def put(self, table_name, item):
+        self.items.setdefault(table_name, {})[item['id']] = serialize_item(item)
+
+    def take(self, table_name):
+        # The serialized items of table_name put so far, taken out of the buffer for the caller to write itself.
+        return self.items.pop(table_name, {})
+
+    def pending(self):
+        return sum(len(items) for items in self.items.values())
+
+    def flush(self):
+        requests = [(table_name, item) for table_name, items in self.items.items() for item in items.values()]
+        for start in range(0, len(requests), 25):
+            request_items = {}
+            for table_name, item in requests[start:start + 25]:
+                request_items.setdefault(table_name, []).append({'PutRequest': {'Item': item}})
+            attempts = 0
+            while request_items:
+                results = self.client.meta.client.batch_write_item(RequestItems=request_items)
+                request_items = results.get('UnprocessedItems')
+                attempts += 1
+                if request_items and attempts == self.max_attempts:
+                    raise UnprocessedItemsError(f"{sum(len(items) for items in request_items.values())} items "
+                                                f"still unprocessed after {attempts} attempts")
+                if request_items:
+                    # Unprocessed items mean the table is throttled, so they are resubmitted after a full jitter
+                    # backoff, the way the AWS SDKs retry.
+                    self.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1))))
+        self.items = {}
+
+
+def write_item(item,client,table_name,writer=None):
+    if writer is not None:
+        writer.put(table_name, item)
+    else:
+        client.Table(table_name).put_item(Item=item)
+
+
+def create_pull_request(pull_request,client,writer=None):
+    # Attributes without a value are left out: author and createdAt are index keys, which can't be NULL.
+    item = {name: value for name, value in pull_request.to_dict().items() if value is not None}
     item['id'] = pull_request.pr_id
 
-    table.put_item(Item=item)
+    write_item(item, client, 'pull-requests', writer)
     #document = client.collection('pull-requests').document(pull_request.pr_id)
     #document.set(pull_request.to_dict())
 
@@ -23,24 +108,340 @@ def create_project(project,client):
     #document.set(project.to_dict())
 
 
-def create_repository(repository,client):
-
-    table = client.Table('repositories')
+def create_repository(repository,repository_id,client):
+    # Keyed by '<project>/<repo>' like sync-state, so repositories of the same name under different owners are
+    # kept apart. Only ever written once, with zeroed totals; from then on the totals are changed by the
+    # transactions of write_pull_request_changes alone.
     item = repository.to_dict()
+    item['id'] = repository_id
+    try:
+        client.Table('repositories').put_item(Item=item, ConditionExpression='attribute_not_exists(id)')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
 
 
-    item['id'] = repository.name
-    table.put_item(Item=item)
-    # logger.info(repository.name)
-    #document = client.collection('repositories').document(repository.name)
-    #document.set(repository.to_dict())
+# The raw sums of a repository row, which the averages are derived from when it is read.
+REPOSITORY_SUMS = ('total_comments_count', 'pr_status.open', 'pr_status.closed', 'pr_status.merged',
+                   'mergeable_state.mergeable', 'mergeable_state.conflicting', 'mergeable_state.unknown',
+                   'total_open_time', 'concluded_pr_count', 'total_reply_time', 'comment_reply_count')
 
 
-def create_comment(comment,client):
-    table = client.Table('comments')
+def repository_update(repository_totals,repository_id,pull_requests_count=None):
+    # ADDs the change in every raw sum to the row; None when nothing changed.
+    names = {}
+    values = {}
+    additions = []
+    totals = repository_totals.to_dict()
+    for index, path in enumerate(REPOSITORY_SUMS):
+        value = totals
+        for name in path.split('.'):
+            value = (value or {}).get(name)
+        if not value:
+            continue
+        placeholders = []
+        for name in path.split('.'):
+            placeholder = f'#n{len(names)}'
+            names[placeholder] = name
+            placeholders.append(placeholder)
+        values[f':s{index}'] = value
+        additions.append(f"{'.'.join(placeholders)} :s{index}")
+    expression = 'ADD ' + ', '.join(additions) if additions else ''
+    if pull_requests_count is not None:
+        names['#pull_requests_count'] = 'pull_requests_count'
+        values[':pull_requests_count'] = pull_requests_count
+        expression = f'SET #pull_requests_count = :pull_requests_count {expression}'
+    if not expression:
+        return None
+    return {'TableName': 'repositories', 'Key': {'id': repository_id}, 'UpdateExpression': expression.strip(),
+            'ExpressionAttributeNames': names, 'ExpressionAttributeValues': values}
+
+
+def write_pull_request_changes(pull_requests,counted_revisions,rollups,repository_totals,repository_id,client,
+                               pull_requests_count=None):
+    # One transaction puts the pull requests, each only if the revision of it counted so far is still the stored
+    # one, together with the change replacing them makes to the rollups and the repository totals. So a retried
+    # page counts every pull request exactly once, and of two writers that read the same revision only one counts
+    # its change. Returns False when a pull request was written by someone else since its revision was read.
+    actions = []
+    for pull_request_id, item in pull_requests.items():
+        put = {'TableName': 'pull-requests', 'Item': item}
+        if counted_revisions.get(pull_request_id):
+            put['ConditionExpression'] = 'revision = :revision'
+            put['ExpressionAttributeValues'] = {':revision': counted_revisions[pull_request_id]}
+        else:
+            # Never written, or written before revisions were, when it wasn't counted either.
+            put['ConditionExpression'] = 'attribute_not_exists(revision)'
+        actions.append({'Put': put})
+    for rollup_id, rollup in rollups.items():
+        update = rollup_update(rollup_id, rollup)
+        if update is not None:
+            actions.append({'Update': dict(update, TableName='pull-request-rollups')})
+    update = repository_update(repository_totals, repository_id, pull_requests_count)
+    if update is not None:
+        actions.append({'Update': update})
+    for action in actions:
+        (request,) = action.values()
+        if 'Key' in request:
+            request['Key'] = serialize_item(request['Key'])
+        if 'ExpressionAttributeValues' in request:
+            request['ExpressionAttributeValues'] = serialize_item(request['ExpressionAttributeValues'])
+    try:
+        client.meta.client.transact_write_items(TransactItems=actions)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+        if 'ConditionalCheckFailed' in reasons or 'TransactionConflict' in reasons:
+            return False
+        raise
+    return True
+
+
+def create_comment(comment,client,writer=None):
     item = comment.to_dict()
     item['id'] = comment.comment_id
-    table.put_item(Item=item)
+    write_item(item, client, 'comments', writer)
+
+
+def create_sync_state(sync_state,client,writer=None):
+    item = sync_state.to_dict()
+    item['id'] = sync_state.sync_id
+    write_item(item, client, 'sync-state', writer)
+
+
+def retrieve_record(key,client,table_name):
+    table = client.Table(table_name)
+    results = table.get_item(Key={'id': key})
+    return results.get('Item')
+
+
+def retrieve_records(keys,client,table_name,projection=None):
+    records = {}
+    keys = list(dict.fromkeys(key for key in keys if key is not None))
+    for start in range(0, len(keys), 100):
+        request = {'Keys': [{'id': key} for key in keys[start:start + 100]]}
+        if projection:
+            request.update(projection_arguments(projection))
+        request_items = {table_name: request}
+        while request_items:
+            results = client.batch_get_item(RequestItems=request_items)
+            for item in results.get('Responses', {}).get(table_name, []):
+                records[item['id']] = item
+            request_items = results.get('UnprocessedKeys')
+    return records
+
+
+def rollup_update(rollup_id,rollup):
+    # ADDs a rollup's non-zero counters; None when there are none.
+    counters = {name: value for name, value in rollup['counters'].items() if value != 0}
+    if not counters:
+        return None
+    names = {'#project': 'project', '#repository': 'repository', '#author': 'author', '#day': 'day'}
+    values = {':project': rollup['project'], ':repository': rollup['repository'], ':author': rollup['author'],
+              ':day': rollup['day']}
+    additions = []
+    for index, (name, value) in enumerate(counters.items()):
+        names[f'#c{index}'] = name
+        values[f':c{index}'] = value
+        additions.append(f'#c{index} :c{index}')
+    return {'Key': {'id': rollup_id},
+            'UpdateExpression': 'SET #project = :project, #repository = :repository, '
+                                '#author = :author, #day = :day ADD ' + ', '.join(additions),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values}
+
+
+def update_rollups(rollups,client):
+    table = client.Table('pull-request-rollups')
+    for rollup_id, rollup in rollups.items():
+        update = rollup_update(rollup_id, rollup)
+        if update is not None:
+            table.update_item(**update)
+
+
+def retrieve_data_generation(client):
+    item = retrieve_record('data-generation', client, 'metadata')
+    return int(item.get('generation', 0)) if item else 0
+
+
+def bump_data_generation(client):
+    table = client.Table('metadata')
+    results = table.update_item(Key={'id': 'data-generation'},
+                                UpdateExpression='ADD generation :one',
+                                ExpressionAttributeValues={':one': 1},
+                                ReturnValues='UPDATED_NEW')
+    return int(results['Attributes']['generation'])
+
+
+def retrieve_tracked_repositories(client):
+    return list(iterate_filtered_records(None, client, 'tracked-repositories'))
+
+
+def create_tracked_repository(project,repository,client):
+    item = {'id': f'{project}/{repository}', 'project': project, 'repository': repository}
+    write_item(item, client, 'tracked-repositories')
+
+
+def seed_tracked_repositories(project_repositories,client):
+    # Writes the default repositories into the table the first time it is used, so tracking another repository adds
+    # to them instead of replacing them. The puts are idempotent, so callers seeding at the same time don't conflict.
+    if retrieve_record('tracked-repositories-seeded', client, 'metadata') is not None:
+        return
+    for project, repositories in project_repositories.items():
+        for repository in repositories:
+            create_tracked_repository(project, repository, client)
+    write_item({'id': 'tracked-repositories-seeded'}, client, 'metadata')
+
+
+def create_ingestion_run(run_status,client):
+    # Kept as JSON, since the status holds float timestamps, which DynamoDB numbers can't be written from.
+    write_item({'id': run_status['job_id'], 'run_status': json.dumps(run_status)}, client, 'ingestion-runs')
+
+
+def retrieve_ingestion_run(run_id,client):
+    item = retrieve_record(run_id, client, 'ingestion-runs')
+    return json.loads(item['run_status']) if item else None
+
+
+def create_pending_update(project,repository,number,delivery,client):
+    # Deliveries for the same pull request collapse into one pending refetch; delivery tells a drain whether the
+    # row it applied has been replaced by a later delivery since.
+    write_item({'id': f'{project}/{repository}#{number}', 'project': project, 'repository': repository,
+                'number': number, 'delivery': delivery}, client, 'pending-pull-request-updates')
+
+
+def delete_pending_update(update,client):
+    try:
+        client.Table('pending-pull-request-updates').delete_item(Key={'id': update['id']},
+                                                                 ConditionExpression='delivery = :delivery',
+                                                                 ExpressionAttributeValues={':delivery':
+                                                                                            update['delivery']})
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def schedule_webhook_drain(now,stale_before,client):
+    # True only for the caller that schedules the drain; while one is scheduled, later deliveries just wait for it.
+    # A drain scheduled before stale_before is assumed lost and replaced.
+    try:
+        client.Table('metadata').update_item(Key={'id': 'webhook-drain'},
+                                             UpdateExpression='SET scheduled_at = :now',
+                                             ConditionExpression='attribute_not_exists(scheduled_at) '
+                                                                 'OR scheduled_at < :stale_before',
+                                             ExpressionAttributeValues={':now': now, ':stale_before': stale_before})
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def clear_webhook_drain(client):
+    client.Table('metadata').update_item(Key={'id': 'webhook-drain'}, UpdateExpression='REMOVE scheduled_at')
+
+
+def acquire_shard_lease(shard_id,worker_id,now,lease_seconds,due_before,client):
+    # Taken only when nobody holds an unexpired lease on the shard and its last completed sync is due again.
+    table = client.Table('shard-leases')
+    try:
+        table.update_item(Key={'id': shard_id},
+                          UpdateExpression='SET #owner = :owner, lease_expires_at = :expires_at, '
+                                           'started_at = :now, pages_synced = :zero, repositories_synced = :zero',
+                          ConditionExpression='(attribute_not_exists(lease_expires_at) OR lease_expires_at < :now) '
+                                              'AND (attribute_not_exists(last_completed_at) '
+                                              'OR last_completed_at < :due_before)',
+                          ExpressionAttributeNames={'#owner': 'owner'},
+                          ExpressionAttributeValues={':owner': worker_id, ':expires_at': now + lease_seconds,
+                                                     ':now': now, ':zero': 0, ':due_before': due_before})
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def renew_shard_lease(shard_id,worker_id,now,lease_seconds,progress,client):
+    # Returns False once the lease has passed to another worker.
+    table = client.Table('shard-leases')
+    values = {':owner': worker_id, ':expires_at': now + lease_seconds}
+    assignments = ['lease_expires_at = :expires_at']
+    for name, value in progress.items():
+        values[f':{name}'] = value
+        assignments.append(f'{name} = :{name}')
+    try:
+        table.update_item(Key={'id': shard_id},
+                          UpdateExpression='SET ' + ', '.join(assignments),
+                          ConditionExpression='#owner = :owner',
+                          ExpressionAttributeNames={'#owner': 'owner'},
+                          ExpressionAttributeValues=values)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def release_shard_lease(shard_id,worker_id,completed_at,client):
+    table = client.Table('shard-leases')
+    try:
+        table.update_item(Key={'id': shard_id},
+                          UpdateExpression='SET last_completed_at = :completed_at REMOVE #owner, lease_expires_at',
+                          ConditionExpression='#owner = :owner',
+                          ExpressionAttributeNames={'#owner': 'owner'},
+                          ExpressionAttributeValues={':owner': worker_id, ':completed_at': completed_at})
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.warning(f"Lease on {shard_id} was lost before it could be released")
+
+
+def acquire_repository_lease(repository_id,owner,now,lease_seconds,client):
+    # Taken by whichever ingestion job, shard worker or webhook drain writes the repository, so only one does at a
+    # time. A lease that has expired belonged to a worker that died and is taken over.
+    try:
+        client.Table('repository-leases').update_item(Key={'id': repository_id},
+                                                      UpdateExpression='SET #owner = :owner, '
+                                                                       'lease_expires_at = :expires_at',
+                                                      ConditionExpression='attribute_not_exists(lease_expires_at) '
+                                                                          'OR lease_expires_at < :now',
+                                                      ExpressionAttributeNames={'#owner': 'owner'},
+                                                      ExpressionAttributeValues={':owner': owner,
+                                                                                 ':expires_at': now + lease_seconds,
+                                                                                 ':now': now})
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def renew_repository_lease(repository_id,owner,now,lease_seconds,client):
+    # Returns False once the lease has passed to another worker.
+    try:
+        client.Table('repository-leases').update_item(Key={'id': repository_id},
+                                                      UpdateExpression='SET lease_expires_at = :expires_at',
+                                                      ConditionExpression='#owner = :owner',
+                                                      ExpressionAttributeNames={'#owner': 'owner'},
+                                                      ExpressionAttributeValues={':owner': owner,
+                                                                                 ':expires_at': now + lease_seconds})
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def release_repository_lease(repository_id,owner,client):
+    try:
+        client.Table('repository-leases').delete_item(Key={'id': repository_id}, ConditionExpression='#owner = :owner',
+                                                      ExpressionAttributeNames={'#owner': 'owner'},
+                                                      ExpressionAttributeValues={':owner': owner})
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.warning(f"Lease on {repository_id} was lost before it could be released")
 
 
 def create_user(item,client):
@@ -54,18 +455,52 @@ def create_user(item,client):
         logger.error("Unable to create user due to exception")
         return False
 
-def retrieve_filtered_records(query,client,table_name):
-    table = client.Table(table_name)
-    results = table.scan(FilterExpression= query)
-    data = results.get('Items',[])
+def update_password_hash(username,password_hash,client):
+    table = client.Table('users')
+    table.update_item(Key={'id': username},
+                      UpdateExpression='SET password_hash = :password_hash REMOVE password',
+                      ExpressionAttributeValues={':password_hash': password_hash})
+
+
+def projection_arguments(attributes):
+    # Attribute paths such as 'closureTime.total_seconds' as a ProjectionExpression; every name goes through a
+    # placeholder because several of them ('state', for one) are DynamoDB reserved words.
+    names = {}
+    paths = []
+    for attribute in attributes:
+        placeholders = []
+        for name in attribute.split('.'):
+            placeholder = f'#p{len(names)}'
+            names[placeholder] = name
+            placeholders.append(placeholder)
+        paths.append('.'.join(placeholders))
+    return {'ProjectionExpression': ', '.join(paths), 'ExpressionAttributeNames': names}
+
+
+def paginate(operation, arguments):
+    results = operation(**arguments)
+    yield from results.get('Items',[])
     while 'LastEvaluatedKey' in results:
-        results = table.scan(
-            FilterExpression=query,
-            ExclusiveStartKey=results['LastEvaluatedKey']
-        )
-        data.extend(results.get('Items',[]))
-    print(data)
-    return data
+        results = operation(ExclusiveStartKey=results['LastEvaluatedKey'], **arguments)
+        yield from results.get('Items',[])
+
+
+def iterate_filtered_records(query,client,table_name,projection=None):
+    # Yields items page by page as DynamoDB returns them, so only one page is held in memory at a time.
+    arguments = {'FilterExpression': query} if query is not None else {}
+    if projection:
+        arguments.update(projection_arguments(projection))
+    return paginate(client.Table(table_name).scan, arguments)
 
 
+def iterate_query_records(index_name,key_condition,query,client,table_name,projection=None):
+    arguments = {'IndexName': index_name, 'KeyConditionExpression': key_condition}
+    if query is not None:
+        arguments['FilterExpression'] = query
+    if projection:
+        arguments.update(projection_arguments(projection))
+    return paginate(client.Table(table_name).query, arguments)
 
+
+def retrieve_filtered_records(query,client,table_name):
+    return list(iterate_filtered_records(query, client, table_name))
@@ -0,0 +1,76 @@
+import json
+import logging
+import threading
+
+from cachetools import TTLCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_filter_criteria(applied_filters):
+    timeframe = applied_filters.timeframe
+    return (applied_filters.status.value if applied_filters.status else None,
+            applied_filters.mergeable.value if applied_filters.mergeable else None,
+            applied_filters.author or None,
+            applied_filters.project or None,
+            applied_filters.repository or None,
+            (timeframe.from_date or None) if timeframe else None,
+            (timeframe.to_date or None) if timeframe else None)
+
+
+class FilterResultCache:
+    # Entries are keyed on the data generation as well as the filters, so a completed ingestion run makes every
+    # older entry unreachable; the TTL only bounds how long unreachable entries occupy memory.
+    def __init__(self, maxsize=256, ttl=3600, shared_table=None):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.shared_table = shared_table
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(applied_filters, generation):
+        return '|'.join(str(value) for value in (generation,) + normalize_filter_criteria(applied_filters))
+
+    def get(self, key, client):
+        with self.lock:
+            value = self.cache.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+        if self.shared_table is not None:
+            item = client.Table(self.shared_table).get_item(Key={'id': key}).get('Item')
+            if item is not None:
+                value = json.loads(item['result'])
+                with self.lock:
+                    self.shared_hits += 1
+                    self.cache[key] = value
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value, client):
+        with self.lock:
+            self.cache[key] = value
+        if self.shared_table is not None:
+            try:
+                # Stored as JSON so numbers come back with the types they were computed with; Decimals are
+                # rendered as strings, the same way the response serializes them.
+                client.Table(self.shared_table).put_item(Item={'id': key, 'result': json.dumps(value, default=str)})
+            except Exception:
+                logger.exception("Unable to store filter result in the shared cache")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else None,
+                'size': len(self.cache),
+                'maxsize': self.cache.maxsize
+            }
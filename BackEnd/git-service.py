@@ -1,24 +1,87 @@
-import requests
+import time
+# Taken before any other import so the cold start profile covers the whole module import.
+MODULE_IMPORT_STARTED = time.perf_counter()
+import copy
+import hmac
 import json
+import os
+import random
+import socket
+import sys
+import threading
+import uuid
 from flask import Flask, request, jsonify
 import logging
-from db_client import create_project, create_user, retrieve_filtered_records
+from db_client import (
+    BufferedWriter,
+    create_project,
+    create_repository,
+    create_sync_state,
+    create_user,
+    iterate_filtered_records,
+    retrieve_record,
+    retrieve_records,
+    iterate_query_records,
+    write_pull_request_changes,
+    retrieve_data_generation,
+    bump_data_generation,
+    retrieve_tracked_repositories,
+    create_tracked_repository,
+    seed_tracked_repositories,
+    create_ingestion_run,
+    retrieve_ingestion_run,
+    create_pending_update,
+    delete_pending_update,
+    schedule_webhook_drain,
+    clear_webhook_drain,
+    acquire_shard_lease,
+    renew_shard_lease,
+    release_shard_lease,
+    acquire_repository_lease,
+    renew_repository_lease,
+    release_repository_lease,
+    retrieve_filtered_records,
+    update_password_hash
+)
 from utils import (
-    map_github_response_to_repository,
     updatePullRequestStatusForProject,
     updateMergeableStateTrackerForProject,
     compute_average_closure_time,
     constructFilterCriteria,
-    updatePRStatustracker,
-    updateMergeableStateTracker
+    restore_repository_data,
+    map_pull_request,
+    start_repository_totals,
+    finish_repository_totals,
+    repository_from_item,
+    accumulate_pull_request_metrics,
+    accumulate_rollup_metrics,
+    pull_request_metrics_response,
+    split_timeframe_by_day,
+    batched,
+    shard_for,
+    matches_filter_criteria,
+    union_filter_criteria,
+    bucket_start,
+    TIMESERIES_INTERVALS,
+    METRIC_ATTRIBUTES,
+    REPLACEMENT_ATTRIBUTES,
+    hash_password,
+    verify_password,
+    verify_webhook_signature
 )
 from models import (
     MergeableState,
     Project,
-    PullRequestStatus
+    PullRequestMetrics,
+    PullRequestStatus,
+    SyncState,
+    TimeFrame
 )
+from github_client import GitHubScheduler, RateLimitExceeded
+from filter_cache import FilterResultCache
+from jobs import JobQueue, RUNNING
 from flask_cors import CORS
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
 app = Flask(__name__)
 import boto3
 from botocore.exceptions import ClientError
@@ -44,8 +107,20 @@ def get_secret():
     secret = json.loads(get_secret_value_response['SecretString'])
     return secret['github_token']
 
-github_token = get_secret()
-print(github_token)
+
+# The token is fetched on first use rather than at import, so routes that never call GitHub never pay for
+# Secrets Manager, and is kept across warm invocations until it expires.
+GITHUB_TOKEN_TTL = int(os.environ.get('GITHUB_TOKEN_TTL', 3600))
+github_token_cache = {'token': None, 'expires_at': 0}
+github_token_lock = threading.Lock()
+
+
+def get_github_token(force_refresh=False):
+    with github_token_lock:
+        if force_refresh or github_token_cache['token'] is None or time.time() >= github_token_cache['expires_at']:
+            github_token_cache['token'] = get_secret()
+            github_token_cache['expires_at'] = time.time() + GITHUB_TOKEN_TTL
+        return github_token_cache['token']
 
 # os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "datastore-access-key.json"
 # client = firestore.Client()
@@ -54,130 +129,404 @@ print(github_token)
 #aws_secret_access_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
 aws_region = 'us-east-1'
 
-client = boto3.resource('dynamodb',
-                        #aws_access_key_id=aws_access_key_id,
-                        #aws_secret_access_key=aws_secret_access_key,
-                        region_name=aws_region)
+thread_local = threading.local()
+
+
+def get_client():
+    # Created on first use and cached per thread, since boto3 resources are not thread safe.
+    if not hasattr(thread_local, 'client'):
+        thread_local.client = boto3.session.Session().resource('dynamodb',
+                                                               #aws_access_key_id=aws_access_key_id,
+                                                               #aws_secret_access_key=aws_secret_access_key,
+                                                               region_name=aws_region)
+    return thread_local.client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-CORS(app, resources={r"/filterData": {"origins": "http://ac7cf593349294ea2a773107664787f1-221083915.us-east-1.elb.amazonaws.com"},
+CORS(app, resources={r"/shards": {"origins": "http://ac7cf593349294ea2a773107664787f1-221083915.us-east-1.elb.amazonaws.com"},
+                     r"/jobs/*": {"origins": "http://ac7cf593349294ea2a773107664787f1-221083915.us-east-1.elb.amazonaws.com"},
+                     r"/filterData": {"origins": "http://ac7cf593349294ea2a773107664787f1-221083915.us-east-1.elb.amazonaws.com"},
+                     r"/filterDataBatch": {"origins": "http://ac7cf593349294ea2a773107664787f1-221083915.us-east-1.elb.amazonaws.com"},
+                     r"/timeseries": {"origins": "http://ac7cf593349294ea2a773107664787f1-221083915.us-east-1.elb.amazonaws.com"},
                      r"/createUser": {"origins": "http://ac7cf593349294ea2a773107664787f1-221083915.us-east-1.elb.amazonaws.com"},
                      r"/validUser": {"origins": "http://ac7cf593349294ea2a773107664787f1-221083915.us-east-1.elb.amazonaws.com"}})
 
 PROJECT_REPO_MAPPINGS = {'apache': ['kafka', 'jmeter'], 'bhuvaneshshukla1': ['mp2']}
+GITHUB_GRAPHQL_URL = os.environ.get('GITHUB_GRAPHQL_URL', 'https://api.github.com/graphql')
+# Pages are bounded so a large repository is backfilled over several cron runs instead of hitting the Lambda timeout.
+PULL_REQUEST_PAGE_SIZE = int(os.environ.get('PULL_REQUEST_PAGE_SIZE', 25))
+# A pull request takes at most three of a transaction's 100 actions, its own put and the rollups of its counted and
+# its new version, and the repository row takes one more.
+PULL_REQUESTS_PER_TRANSACTION = 33
+MAX_PAGES_PER_RUN = int(os.environ.get('MAX_PAGES_PER_RUN', 20))
+# Pull requests are parsed out of the streamed response one edge at a time.
+PULL_REQUEST_EDGES_PATH = 'data.repository.pullRequests.edges.item'
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', 8))
+# ':memory:' keeps the ingestion queue in this process; a file path lets separate worker processes share it.
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', ':memory:')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', FETCH_CONCURRENCY))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+# 'threads' works runs off on daemon threads of this process. On Lambda the container is frozen once the response
+# is sent and its in-memory queue is lost when it is recycled, so there a run is handed to an asynchronous
+# invocation of its own ('async', through Zappa) or synced inside the request ('sync').
+INGESTION_DISPATCH = os.environ.get('INGESTION_DISPATCH',
+                                    'async' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else 'threads')
+# A run synced inside one invocation stops starting pages after this many seconds and is finalized with what it has,
+# so its status is published before Lambda's 900 second timeout. A page in flight may still wait out the GitHub
+# scheduler's max_wait on the rate limit.
+INGESTION_TIME_LIMIT = int(os.environ.get('INGESTION_TIME_LIMIT', 540))
+# Standalone shard workers ('python git-service.py worker') split the tracked repositories into SHARD_COUNT shards.
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 64))
+SHARD_LEASE_SECONDS = int(os.environ.get('SHARD_LEASE_SECONDS', 900))
+SHARD_SYNC_INTERVAL = int(os.environ.get('SHARD_SYNC_INTERVAL', 3600))
+SHARD_POLL_INTERVAL = float(os.environ.get('SHARD_POLL_INTERVAL', 30))
+REPOSITORY_LEASE_SECONDS = int(os.environ.get('REPOSITORY_LEASE_SECONDS', 900))
+GITHUB_RESERVED_POINTS = int(os.environ.get('GITHUB_RESERVED_POINTS', 50))
+# 'columnar' aggregates raw pull requests in NumPy batches, 'rows' one item at a time; both return the same result.
+ANALYTICS_ENGINE = os.environ.get('ANALYTICS_ENGINE', 'columnar')
+COLUMNAR_BATCH_SIZE = int(os.environ.get('COLUMNAR_BATCH_SIZE', 1000))
+MAX_BATCH_FILTERS = int(os.environ.get('MAX_BATCH_FILTERS', 50))
+# Attributes a raw pull request is routed to the slices of a /filterDataBatch request by.
+BATCH_ROUTING_ATTRIBUTES = ('author', 'repository', 'project', 'createdAt')
+
+GITHUB_WEBHOOK_SECRET = os.environ.get('GITHUB_WEBHOOK_SECRET')
+WEBHOOK_EVENTS = ('pull_request', 'pull_request_review', 'issue_comment')
+# Deliveries are applied in batches, by one drain WEBHOOK_BATCH_SECONDS after the first delivery it covers. A drain
+# that hasn't started WEBHOOK_DRAIN_TIMEOUT seconds after its window is assumed lost, and the next delivery
+# schedules another.
+WEBHOOK_BATCH_SECONDS = int(os.environ.get('WEBHOOK_BATCH_SECONDS', 30))
+WEBHOOK_DRAIN_TIMEOUT = int(os.environ.get('WEBHOOK_DRAIN_TIMEOUT', 300))
+# Attempts at writing pull requests that other writers keep changing in between.
+PULL_REQUEST_WRITE_ATTEMPTS = int(os.environ.get('PULL_REQUEST_WRITE_ATTEMPTS', 5))
+# Enough keep-alive connections for every ingestion worker to have a request in flight.
+GITHUB_POOL_SIZE = int(os.environ.get('GITHUB_POOL_SIZE', max(JOB_WORKERS, FETCH_CONCURRENCY)))
+# How long a request waits for a free pooled connection before it is retried.
+GITHUB_POOL_TIMEOUT = float(os.environ.get('GITHUB_POOL_TIMEOUT', 60))
+
+github_scheduler = GitHubScheduler(get_github_token, GITHUB_GRAPHQL_URL, reserved_points=GITHUB_RESERVED_POINTS,
+                                   pool_size=GITHUB_POOL_SIZE, pool_timeout=GITHUB_POOL_TIMEOUT)
+job_queue = JobQueue(JOB_QUEUE_PATH,
+                     lease_seconds=int(os.environ.get('JOB_LEASE_SECONDS', 900)),
+                     max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 3)),
+                     retry_delay=int(os.environ.get('JOB_RETRY_DELAY', 30)))
+ingestion_workers = []
+ingestion_workers_lock = threading.Lock()
+filter_cache = FilterResultCache(maxsize=int(os.environ.get('FILTER_CACHE_SIZE', 256)),
+                                 ttl=int(os.environ.get('FILTER_CACHE_TTL', 3600)),
+                                 shared_table=os.environ.get('FILTER_CACHE_TABLE'))
+
+
 @app.route('/')
 def home():
     return jsonify({'message': 'API is working'}), 200
 
 
-@app.route('/runCronJob', methods=['POST'])
-def fetch():
-    for project, repositories in PROJECT_REPO_MAPPINGS.items():
-        project_object = Project(project, pr_status=PullRequestStatus(), mergeable_state=MergeableState())
-        avg_comment_reply_time = 0
-        repo_counter = 0
-        for repo in repositories:
-            query = """
-            query($owner: String!, $name: String!, $pullRequestCount: Int!) {
-              repository(owner: $owner, name: $name) {
-                primaryLanguage {
-                  name
-                }
-                description
-                name
-                watchers {
-                  totalCount
-                }
-                pullRequests(last: $pullRequestCount) {
-                  pageInfo {
-                    endCursor
-                    hasNextPage
-                    hasPreviousPage
-                  }
-                  totalCount
-                  edges {
-                    cursor
-                    node {
-                      ... on PullRequest {
-                        id
-                        reviewDecision
-                        state
-                        number
-                        title
-                        author {
-                          login
-                        }
-                        createdAt
-                        mergedAt
-                        closedAt
-                        closed
-                        url
-                        changedFiles
-                        additions
-                        deletions
-                        mergeable
-                        totalCommentsCount
-                        comments(last: 20) {
-                          edges {
-                            node {
-                              createdAt
-                              body
-                              author {
-                                login
-                              }
-                              id
-                            }
-                          }
-                        }
-                        reviews(last: 20) {
-                          edges {
-                            node {
-                              state
-                              author {
-                                login
-                              }
-                              comments(last: 20) {
-                                edges {
-                                  node {
-                                    id
-                                    createdAt
-                                    body
-                                    author {
-                                      login
-                                    }
-                                    replyTo {
-                                      id
-                                    }
-                                  }
-                                }
-                              }
-                            }
-                          }
-                        }
-                      }
-                    }
-                  }
-                }
+PULL_REQUEST_FIELDS = """
+fragment PullRequestFields on PullRequest {
+  id
+  reviewDecision
+  state
+  number
+  title
+  author {
+    login
+  }
+  createdAt
+  updatedAt
+  mergedAt
+  closedAt
+  closed
+  url
+  changedFiles
+  additions
+  deletions
+  mergeable
+  totalCommentsCount
+  comments(last: 20) {
+    edges {
+      node {
+        createdAt
+        body
+        author {
+          login
+        }
+        id
+      }
+    }
+  }
+  reviews(last: 20) {
+    edges {
+      node {
+        state
+        author {
+          login
+        }
+        comments(last: 20) {
+          edges {
+            node {
+              id
+              createdAt
+              body
+              author {
+                login
+              }
+              replyTo {
+                id
               }
             }
-            """
+          }
+        }
+      }
+    }
+  }
+}
+"""
 
-            variables = {
-                "owner": project,
-                "name": repo,
-                "pullRequestCount": 10
-            }
-            headers = {
-                'Authorization': f'Bearer {github_token}',
-                'Content-Type': 'application/json'
-            }
-            response = requests.post('https://api.github.com/graphql', headers=headers,
-                                     json={'query': query, 'variables': variables}).json()
+PULL_REQUESTS_QUERY = """
+query($owner: String!, $name: String!, $pullRequestCount: Int!, $cursor: String) {
+  rateLimit {
+    cost
+    remaining
+    resetAt
+  }
+  repository(owner: $owner, name: $name) {
+    primaryLanguage {
+      name
+    }
+    description
+    name
+    watchers {
+      totalCount
+    }
+    pullRequests(first: $pullRequestCount, after: $cursor, orderBy: {field: UPDATED_AT, direction: DESC}) {
+      pageInfo {
+        endCursor
+        hasNextPage
+        hasPreviousPage
+      }
+      totalCount
+      edges {
+        cursor
+        node {
+          ...PullRequestFields
+        }
+      }
+    }
+  }
+}
+""" + PULL_REQUEST_FIELDS
+
+# A single pull request, for webhook deliveries, with the repository's pull request count alongside it.
+PULL_REQUEST_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  rateLimit {
+    cost
+    remaining
+    resetAt
+  }
+  repository(owner: $owner, name: $name) {
+    name
+    pullRequests {
+      totalCount
+    }
+    pullRequest(number: $number) {
+      ...PullRequestFields
+    }
+  }
+}
+""" + PULL_REQUEST_FIELDS
+
+
+def load_sync_state(project, repo):
+    sync_id = f'{project}/{repo}'
+    sync_state_item = retrieve_record(sync_id, get_client(), 'sync-state')
+    return SyncState.from_dict(sync_state_item) if sync_state_item else SyncState(sync_id, project, repo)
+
+
+def load_tracked_repositories(client):
+    # The tracked-repositories table is the configuration, seeded with PROJECT_REPO_MAPPINGS the first time it is used.
+    seed_tracked_repositories(PROJECT_REPO_MAPPINGS, client)
+    return sorted((item['project'], item['repository']) for item in retrieve_tracked_repositories(client))
+
+
+def order_repositories(repositories):
+    # Cheap incremental syncs go first and unfinished backfills last, so when the point budget runs out
+    # every repository has at least been brought up to date and only backfills are deferred.
+    sync_state_items = retrieve_records([f'{project}/{repo}' for project, repo in repositories], get_client(),
+                                        'sync-state')
+    sync_states = [SyncState.from_dict(sync_state_items[f'{project}/{repo}'])
+                   if f'{project}/{repo}' in sync_state_items else SyncState(f'{project}/{repo}', project, repo)
+                   for project, repo in repositories]
+    return sorted(sync_states, key=lambda state: (state.last_updated_at is None, state.end_cursor is not None))
+
+
+def start_pull_request_chunk(repo):
+    return {'pull_request_ids': [], 'rollups': {}, 'totals': start_repository_totals(None, repo)}
+
+
+def fetch_repository(project, repo, sync_state, progress=None):
+    client = get_client()
+    writer = BufferedWriter(client)
+    sync_id = sync_state.sync_id
+    # Resume an unfinished walk from the checkpointed cursor, or sync incrementally on top of a completed one.
+    cursor = sync_state.end_cursor
+    restored = retrieve_record(sync_id, client, 'repositories') is not None
+    if cursor is None:
+        sync_state.pages_synced = 0
+        sync_state.pending_updated_at = None
+
+    for _ in range(MAX_PAGES_PER_RUN):
+        variables = {
+            "owner": project,
+            "name": repo,
+            "pullRequestCount": PULL_REQUEST_PAGE_SIZE,
+            "cursor": cursor
+        }
+        page = {'chunks': [], 'reached_synced': False}
+
+        def map_edge(edge):
+            # Called for each pull request as the response is parsed, so the page is never held in memory whole.
+            pull_request_node = edge.get('node', {})
+            updated_at = pull_request_node.get('updatedAt')
+            if updated_at and (sync_state.pending_updated_at is None or updated_at > sync_state.pending_updated_at):
+                sync_state.pending_updated_at = updated_at
+            # Pull requests arrive ordered by updatedAt descending, so everything after the first already-synced
+            # pull request has been synced as well.
+            if page['reached_synced'] or (updated_at is not None and sync_state.last_updated_at is not None
+                                          and updated_at <= sync_state.last_updated_at):
+                page['reached_synced'] = True
+                return
+            if not page['chunks'] or len(page['chunks'][-1]['pull_request_ids']) == PULL_REQUESTS_PER_TRANSACTION:
+                page['chunks'].append(start_pull_request_chunk(repo))
+            chunk = page['chunks'][-1]
+            chunk['pull_request_ids'].append(pull_request_node.get('id'))
+            map_pull_request(pull_request_node, project, repo, client, chunk['totals'], writer, chunk['rollups'])
+
+        try:
+            response = github_scheduler.execute(PULL_REQUESTS_QUERY, variables, PULL_REQUEST_EDGES_PATH, map_edge)
+        except RateLimitExceeded as e:
+            logger.warning(f"Deferring the rest of {sync_id} to the next run: {e}")
+            break
+        repository_data = (response.get('data') or {}).get('repository')
+        if not repository_data:
+            logger.error(f"Unable to fetch pull requests for {sync_id}: {response.get('errors')}")
+            break
 
-            mapped_response = map_github_response_to_repository(response, project, repo, client)
+        reached_synced = page['reached_synced']
+        if not page['chunks'] and restored and sync_state.pages_synced == 0:
+            logger.info(f"No pull requests updated in {sync_id} since {sync_state.last_updated_at}")
+            break
 
-            project_object.pull_requests_count += mapped_response.pull_requests_count
+        # Comments and reviews are plain puts that a retried page simply repeats; the pull requests are written
+        # with the counts.
+        pull_requests = writer.take('pull-requests')
+        writer.flush()
+        if not restored:
+            create_repository(start_repository_totals(None, repository_data.get('name', repo)), sync_id, client)
+            restored = True
+        record_pull_requests(sync_id, page['chunks'], pull_requests,
+                             repository_data.get('pullRequests', {}).get('totalCount'), client)
+
+        page_info = repository_data.get('pullRequests', {}).get('pageInfo', {})
+        cursor = page_info.get('endCursor') if page_info.get('hasNextPage') and not reached_synced else None
+        sync_state.end_cursor = cursor
+        sync_state.pages_synced += 1
+        if cursor is None:
+            sync_state.backfill_complete = True
+            sync_state.last_updated_at = sync_state.pending_updated_at or sync_state.last_updated_at
+            sync_state.pending_updated_at = None
+        # The checkpoint is written last so it never lands without the page it covers.
+        create_sync_state(sync_state, client)
+        if progress is not None:
+            progress(sync_state.pages_synced)
+        if cursor is None:
+            break
+
+
+class RepositoryWriteConflict(Exception):
+    pass
+
+
+def record_pull_requests(repository_id, chunks, pull_requests, pull_requests_count, client):
+    # Writes each chunk's pull requests in one transaction with the change they make to the rollups and the
+    # repository totals, taking out the revision of each that was counted before. When another writer got to one of
+    # them first, the change is worked out again against what it left.
+    for chunk in chunks:
+        pull_request_ids = [pull_request_id for pull_request_id in chunk['pull_request_ids']
+                            if pull_request_id in pull_requests]
+        for attempt in range(PULL_REQUEST_WRITE_ATTEMPTS):
+            previous_pull_requests = retrieve_records(pull_request_ids, client, 'pull-requests',
+                                                      REPLACEMENT_ATTRIBUTES)
+            # Pull requests stored before revisions were written weren't counted anywhere, so nothing of them is
+            # taken out.
+            counted_pull_requests = {pull_request_id: item for pull_request_id, item in previous_pull_requests.items()
+                                     if item.get('revision')}
+            rollups = copy.deepcopy(chunk['rollups'])
+            totals = copy.deepcopy(chunk['totals'])
+            finish_repository_totals(totals, {}, counted_pull_requests, rollups)
+            items = {pull_request_id: dict(pull_requests[pull_request_id], revision={'S': uuid.uuid4().hex})
+                     for pull_request_id in pull_request_ids}
+            if write_pull_request_changes(items, {pull_request_id: item['revision']
+                                                  for pull_request_id, item in counted_pull_requests.items()},
+                                          rollups, totals, repository_id, client, pull_requests_count):
+                break
+            time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        else:
+            raise RepositoryWriteConflict(repository_id)
+
+
+class RepositoryLeaseLost(Exception):
+    pass
+
+
+def sync_repository(project, repo, owner, progress=None):
+    # Ingestion jobs and shard workers sync a repository only under its lease, and webhook drains apply updates
+    # under it as well, so two of them never write the same repository at once. False when another one holds it.
+    client = get_client()
+    repository_id = f'{project}/{repo}'
+    if not acquire_repository_lease(repository_id, owner, int(time.time()), REPOSITORY_LEASE_SECONDS, client):
+        return False
+
+    def heartbeat(pages_synced):
+        if not renew_repository_lease(repository_id, owner, int(time.time()), REPOSITORY_LEASE_SECONDS, client):
+            raise RepositoryLeaseLost(repository_id)
+        if progress is not None:
+            progress(pages_synced)
+
+    try:
+        # Loaded under the lease, so it is the checkpoint the previous holder left.
+        fetch_repository(project, repo, load_sync_state(project, repo), heartbeat)
+    finally:
+        release_repository_lease(repository_id, owner, client)
+    return True
+
+
+def assemble_projects(client, projects=None):
+    # Projects are built from the stored repository rows rather than from the workers' results, so they come out
+    # the same whichever worker or shard synced which repository and however many attempts it took. Repositories
+    # another shard hasn't synced yet simply contribute their previous totals.
+    project_repositories = {}
+    for project, repo in load_tracked_repositories(client):
+        if projects is None or project in projects:
+            project_repositories.setdefault(project, []).append(repo)
+    repository_ids = [f'{project}/{repo}' for project, repositories in project_repositories.items()
+                      for repo in repositories]
+    repository_items = retrieve_records(repository_ids, client, 'repositories')
+    # Repositories not synced since rows were keyed by project as well still sit under their bare name.
+    legacy_items = retrieve_records([repository_id.split('/', 1)[1] for repository_id in repository_ids
+                                     if repository_id not in repository_items], client, 'repositories')
+    for project, repositories in project_repositories.items():
+        project_object = Project(project, repositories=[], pr_status=PullRequestStatus(),
+                                 mergeable_state=MergeableState())
+        avg_comment_reply_time = 0
+        repo_counter = 0
+        for repo in repositories:
+            repository_item = repository_items.get(f'{project}/{repo}') or legacy_items.get(repo)
+            if repository_item is None:
+                continue
+            mapped_response = repository_from_item(repository_item)
+
+            project_object.pull_requests_count += mapped_response.pull_requests_count or 0
             project_object.repositories.append(repo)
             project_object.total_comments_count += mapped_response.total_comments_count
 
@@ -191,112 +540,637 @@ def fetch():
         project_object.avg_comment_reply_time = compute_average_closure_time(avg_comment_reply_time, repo_counter)
         create_project(project_object, client)
 
-    return jsonify({"result": "success"}), 200
+
+def publish_run_status(run_id):
+    # The queue only lives in the process that holds it, so every change of a run is also written to DynamoDB for
+    # /jobs/<job_id> to read from any container.
+    try:
+        create_ingestion_run(job_queue.run_status(run_id), get_client())
+    except Exception:
+        logger.exception(f"Unable to publish the status of ingestion run {run_id}")
+
+
+def finalize_run(run_id):
+    client = get_client()
+    try:
+        assemble_projects(client)
+        # Cached /filterData results of earlier generations are no longer served.
+        generation = bump_data_generation(client)
+    except Exception:
+        logger.exception(f"Unable to finalize ingestion run {run_id}")
+        return
+    job_queue.finish_run(run_id, generation)
+    publish_run_status(run_id)
+    logger.info(f"Ingestion run {run_id} finished, GitHub budget: {github_scheduler.budget()}, "
+                f"connections: {github_scheduler.connection_stats()}")
+
+
+class IngestionTimeLimitReached(Exception):
+    pass
+
+
+def run_job(job, deadline=None):
+    def progress(pages_synced):
+        job_queue.record_progress(job, pages_synced)
+        if deadline is not None and time.time() > deadline:
+            raise IngestionTimeLimitReached(job['run_id'])
+
+    try:
+        if sync_repository(job['project'], job['repository'], job['worker_id'], progress):
+            job_queue.complete(job)
+        else:
+            # Another run, shard worker or webhook drain is writing the repository; retried after the retry delay.
+            logger.info(f"{job['project']}/{job['repository']} is held by another worker (attempt {job['attempts']})")
+            job_queue.fail(job, 'held by another worker')
+    except IngestionTimeLimitReached:
+        logger.warning(f"Stopped syncing {job['project']}/{job['repository']} at the ingestion time limit")
+        job_queue.fail(job, 'stopped at the ingestion time limit')
+    except Exception as e:
+        # The sync state checkpoints every page, so a retry resumes where this attempt stopped.
+        logger.exception(f"Unable to sync {job['project']}/{job['repository']} (attempt {job['attempts']})")
+        job_queue.fail(job, str(e))
+    publish_run_status(job['run_id'])
+
+
+def process_job(job, deadline=None):
+    if job['status'] == RUNNING:
+        run_job(job, deadline)
+    if job_queue.claim_finalization(job['run_id']):
+        finalize_run(job['run_id'])
+
+
+def ingestion_worker(worker_id):
+    while True:
+        job = job_queue.claim(worker_id)
+        if job is None:
+            for run_id in job_queue.unfinished_runs():
+                if job_queue.claim_finalization(run_id):
+                    finalize_run(run_id)
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        process_job(job)
+
+
+def start_ingestion_workers():
+    with ingestion_workers_lock:
+        for _ in range(JOB_WORKERS - len(ingestion_workers)):
+            worker = threading.Thread(target=ingestion_worker, args=(f'worker-{uuid.uuid4().hex}',), daemon=True)
+            worker.start()
+            ingestion_workers.append(worker)
+
+
+def drain_run(run_id, worker_id, deadline=None):
+    # Stops once none of the run's jobs is queued or running, including retries still waiting out their delay, or
+    # at the deadline.
+    while job_queue.outstanding_jobs(run_id) and (deadline is None or time.time() < deadline):
+        job = job_queue.claim(worker_id, run_id)
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        process_job(job, deadline)
 
 
-def build_query(applied_filters):
+def ingest_run(run_id, repositories):
+    # Syncs a whole run within the current invocation, on JOB_WORKERS threads that are joined before it returns.
+    # Called by Zappa in the asynchronous invocation, so its arguments are plain JSON.
+    deadline = time.time() + INGESTION_TIME_LIMIT
+    if job_queue.run_status(run_id) is None:
+        job_queue.create_run([tuple(repository) for repository in repositories], run_id)
+    workers = [threading.Thread(target=drain_run, args=(run_id, f'worker-{uuid.uuid4().hex}', deadline))
+               for _ in range(JOB_WORKERS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # Nothing runs the jobs left once this invocation ends, so they are failed here and the run still finalized;
+    # the next run resumes them from their checkpoints.
+    job_queue.fail_outstanding(run_id, 'not reached before the ingestion time limit')
+    # The last job may have been failed by an expired lease rather than finished by a worker.
+    if job_queue.claim_finalization(run_id):
+        finalize_run(run_id)
+    return job_queue.run_status(run_id)
+
+
+@app.route('/runCronJob', methods=['POST'])
+def fetch():
+    # Only enqueues one job per repository; the workers sync them and the last one to finish assembles the projects.
+    repositories = [(state.project, state.repository)
+                    for state in order_repositories(load_tracked_repositories(get_client()))]
+    run_id = job_queue.create_run(repositories)
+    publish_run_status(run_id)
+    if INGESTION_DISPATCH == 'sync':
+        drain_webhook_updates()
+        return jsonify(ingest_run(run_id, repositories)), 200
+    if INGESTION_DISPATCH == 'async':
+        # Imported here since zappa is only needed, and only configured, on Lambda.
+        from zappa.asynchronous import run as run_asynchronously
+        run_asynchronously(ingest_run, args=[run_id, repositories])
+    else:
+        start_ingestion_workers()
+    return jsonify({"result": "queued", "job_id": run_id}), 202
+
+
+class ShardLeaseLost(Exception):
+    pass
+
+
+def sync_shard(shard_id, worker_id, repositories):
+    client = get_client()
+    progress = {'repositories_total': len(repositories), 'repositories_synced': 0, 'pages_synced': 0}
+
+    def renew():
+        # Losing the lease means another worker has taken the shard over, and since every page is checkpointed
+        # this one can stop without leaving anything half written.
+        if not renew_shard_lease(shard_id, worker_id, int(time.time()), SHARD_LEASE_SECONDS, progress, client):
+            raise ShardLeaseLost(shard_id)
+
+    def heartbeat(pages_synced):
+        progress['pages_synced'] += 1
+        renew()
+
+    for sync_state in order_repositories(repositories):
+        try:
+            if not sync_repository(sync_state.project, sync_state.repository, worker_id, heartbeat):
+                logger.info(f"{sync_state.sync_id} is held by another worker and left to it")
+        except ShardLeaseLost:
+            logger.warning(f"{worker_id} lost the lease on {shard_id}")
+            return
+        except Exception:
+            # Left for the next pass over the shard, which resumes from the checkpointed cursor.
+            logger.exception(f"Unable to sync {sync_state.sync_id}")
+        progress['repositories_synced'] += 1
+        try:
+            renew()
+        except ShardLeaseLost:
+            logger.warning(f"{worker_id} lost the lease on {shard_id}")
+            return
+
+    assemble_projects(client, {project for project, _ in repositories})
+    bump_data_generation(client)
+    release_shard_lease(shard_id, worker_id, int(time.time()), client)
+    logger.info(f"{worker_id} finished {shard_id}: {progress}, connections: {github_scheduler.connection_stats()}")
+
+
+def shard_worker(worker_id):
+    # Repositories are hashed onto a fixed number of shards, independent of how many workers run, and a worker
+    # syncs whichever shard it can lease. A worker that dies stops renewing, and its shard is picked up by the
+    # next worker to find the lease expired.
+    while True:
+        shards = {}
+        for project, repo in load_tracked_repositories(get_client()):
+            shards.setdefault(f'shard-{shard_for(f"{project}/{repo}", SHARD_COUNT)}', []).append((project, repo))
+        leased = False
+        for shard_id in random.sample(sorted(shards), len(shards)):
+            now = int(time.time())
+            if acquire_shard_lease(shard_id, worker_id, now, SHARD_LEASE_SECONDS, now - SHARD_SYNC_INTERVAL,
+                                   get_client()):
+                leased = True
+                sync_shard(shard_id, worker_id, shards[shard_id])
+        if not leased:
+            time.sleep(SHARD_POLL_INTERVAL)
+
+
+@app.route('/shards', methods=['GET'])
+def shardStatus():
+    return jsonify(sorted(retrieve_filtered_records(None, get_client(), 'shard-leases'),
+                          key=lambda shard: shard['id'])), 200
+
+
+@app.route('/trackedRepositories', methods=['POST'])
+def trackRepository():
+    requested_data = request.get_json()
+    if not requested_data.get('project') or not requested_data.get('repository'):
+        return {"result": "failure"}, 400
+    client = get_client()
+    seed_tracked_repositories(PROJECT_REPO_MAPPINGS, client)
+    create_tracked_repository(requested_data['project'], requested_data['repository'], client)
+    return {"result": "success", "shard": shard_for(f"{requested_data['project']}/{requested_data['repository']}",
+                                                     SHARD_COUNT)}, 200
+
+
+def apply_pull_request_update(project, repo, number):
+    # Refetches the one pull request a webhook delivery is about and writes it the way a sync page is written: its
+    # counted revision comes out of the repository totals and rollups and the new one goes in.
+    client = get_client()
+    if restore_repository_data(project, repo, client) is None:
+        # Never synced yet, so there are no totals to update; the next ingestion run picks it up in full.
+        return False
+    response = github_scheduler.execute(PULL_REQUEST_QUERY, {"owner": project, "name": repo, "number": number})
+    repository_data = (response.get('data') or {}).get('repository') or {}
+    pull_request_node = repository_data.get('pullRequest')
+    if not pull_request_node:
+        logger.error(f"Unable to fetch {project}/{repo}#{number}: {response.get('errors')}")
+        return False
+
+    writer = BufferedWriter(client)
+    chunk = start_pull_request_chunk(repo)
+    chunk['pull_request_ids'].append(pull_request_node.get('id'))
+    map_pull_request(pull_request_node, project, repo, client, chunk['totals'], writer, chunk['rollups'])
+    pull_requests = writer.take('pull-requests')
+    writer.flush()
+    repository_id = f'{project}/{repo}'
+    create_repository(start_repository_totals(None, repository_data.get('name', repo)), repository_id, client)
+    record_pull_requests(repository_id, [chunk], pull_requests,
+                         repository_data.get('pullRequests', {}).get('totalCount'), client)
+    return True
+
+
+def drain_webhook_updates(scheduled_at=None):
+    # Applies every pending update at once, so a burst of deliveries assembles each project and invalidates the
+    # filter cache once rather than once per delivery. Called by Zappa in the asynchronous invocation as well.
+    if scheduled_at is not None:
+        time.sleep(max(0, scheduled_at + WEBHOOK_BATCH_SECONDS - time.time()))
+    client = get_client()
+    # Cleared before the pending updates are read, so a delivery from here on schedules a drain of its own.
+    clear_webhook_drain(client)
+    owner = f'drain-{uuid.uuid4().hex}'
+    updates = {}
+    for update in retrieve_filtered_records(None, client, 'pending-pull-request-updates'):
+        updates.setdefault(f"{update['project']}/{update['repository']}", []).append(update)
+    projects = set()
+    deferred = False
+    for repository_id, repository_updates in updates.items():
+        # Applied under the repository's lease, like a sync. A repository that is being synced or drained elsewhere
+        # keeps its updates pending for a drain scheduled after this one.
+        if not acquire_repository_lease(repository_id, owner, int(time.time()), REPOSITORY_LEASE_SECONDS, client):
+            deferred = True
+            continue
+        try:
+            for update in repository_updates:
+                try:
+                    if apply_pull_request_update(update['project'], update['repository'], int(update['number'])):
+                        projects.add(update['project'])
+                except Exception:
+                    # Left pending for the next drain; the next ingestion run syncs the pull request regardless.
+                    logger.exception(f"Unable to apply the update of {update['id']}")
+                    continue
+                delete_pending_update(update, client)
+                if not renew_repository_lease(repository_id, owner, int(time.time()), REPOSITORY_LEASE_SECONDS,
+                                              client):
+                    deferred = True
+                    break
+        finally:
+            release_repository_lease(repository_id, owner, client)
+    if projects:
+        assemble_projects(client, projects)
+        bump_data_generation(client)
+    if deferred:
+        now = int(time.time())
+        if schedule_webhook_drain(now, now - WEBHOOK_BATCH_SECONDS - WEBHOOK_DRAIN_TIMEOUT, client):
+            dispatch_webhook_drain(now)
+    return len(projects)
+
+
+def dispatch_webhook_drain(scheduled_at):
+    if INGESTION_DISPATCH == 'async':
+        from zappa.asynchronous import run as run_asynchronously
+        run_asynchronously(drain_webhook_updates, args=[scheduled_at])
+    elif INGESTION_DISPATCH == 'threads':
+        threading.Thread(target=drain_webhook_updates, args=(scheduled_at,), daemon=True).start()
+    # With 'sync' nothing runs after the response, and the next /runCronJob applies the pending updates.
+
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    if not GITHUB_WEBHOOK_SECRET or not verify_webhook_signature(GITHUB_WEBHOOK_SECRET, request.get_data(),
+                                                                 request.headers.get('X-Hub-Signature-256')):
+        return jsonify({"result": "invalid signature"}), 401
+    event = request.headers.get('X-GitHub-Event')
+    payload = request.get_json(silent=True) or {}
+    if event == 'ping':
+        return jsonify({"result": "pong"}), 200
+    if event not in WEBHOOK_EVENTS:
+        return jsonify({"result": "ignored"}), 202
+
+    # issue_comment is delivered for issues as well; only the ones on pull requests matter.
+    pull_request = payload.get('pull_request') or (payload.get('issue') or {})
+    if event == 'issue_comment' and not pull_request.get('pull_request'):
+        return jsonify({"result": "ignored"}), 202
+    repository = payload.get('repository') or {}
+    project = (repository.get('owner') or {}).get('login')
+    repo = repository.get('name')
+    client = get_client()
+    if retrieve_record(f'{project}/{repo}', client, 'tracked-repositories') is None \
+            or pull_request.get('number') is None:
+        return jsonify({"result": "ignored"}), 202
+
+    # GitHub gives up on a delivery after 10 seconds and a refetch can wait minutes on the rate limit, so the
+    # delivery is only recorded here and applied by a drain after the batch window.
+    create_pending_update(project, repo, pull_request['number'], uuid.uuid4().hex, client)
+    now = int(time.time())
+    if schedule_webhook_drain(now, now - WEBHOOK_BATCH_SECONDS - WEBHOOK_DRAIN_TIMEOUT, client):
+        dispatch_webhook_drain(now)
+    return jsonify({"result": "queued"}), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def jobStatus(job_id):
+    # The published status first: with asynchronous dispatch this container's queue may hold a stale copy of the run.
+    status = retrieve_ingestion_run(job_id, get_client()) or job_queue.run_status(job_id)
+    if status is None:
+        return jsonify({"result": "unknown job"}), 404
+    return jsonify(status), 200
+
+
+# Global secondary indexes on the pull-requests table, each with createdAt as sort key and an ALL projection,
+# from the most to the least selective partition attribute.
+PULL_REQUEST_INDEXES = [('author', 'author-createdAt-index'),
+                        ('repository', 'repository-createdAt-index'),
+                        ('project', 'project-createdAt-index')]
+
+
+# Same indexes on the rollups table, with day as sort key.
+ROLLUP_INDEXES = [('author', 'author-day-index'),
+                  ('repository', 'repository-day-index'),
+                  ('project', 'project-day-index')]
+
+
+def plan_query(applied_filters, indexes=PULL_REQUEST_INDEXES, sort_key='createdAt'):
+    for attribute, index_name in indexes:
+        value = getattr(applied_filters, attribute)
+        if not value:
+            continue
+        key_condition = Key(attribute).eq(value)
+        timeframe = applied_filters.timeframe
+        if timeframe and timeframe.from_date and timeframe.to_date:
+            key_condition = key_condition & Key(sort_key).between(timeframe.from_date, timeframe.to_date)
+        elif timeframe and timeframe.from_date:
+            key_condition = key_condition & Key(sort_key).gte(timeframe.from_date)
+        elif timeframe and timeframe.to_date:
+            key_condition = key_condition & Key(sort_key).lte(timeframe.to_date)
+        return index_name, attribute, key_condition
+    return None, None, None
+
+
+def build_query(applied_filters, key_attribute=None, sort_key='createdAt'):
     filter_expression = None
-    if applied_filters.author:
+    if applied_filters.author and key_attribute != 'author':
         expr = Attr('author').eq(applied_filters.author)
         filter_expression = expr if not filter_expression else filter_expression & expr
-    if applied_filters.repository:
+    if applied_filters.repository and key_attribute != 'repository':
         expr = Attr('repository').eq(applied_filters.repository)
         filter_expression = expr if not filter_expression else filter_expression & expr
 
-    if applied_filters.project:
+    if applied_filters.project and key_attribute != 'project':
         expr = Attr('project').eq(applied_filters.project)
         filter_expression = expr if not filter_expression else filter_expression & expr
 
+    # Pull request items store their status as 'state'.
     if applied_filters.status:
-        expr = Attr('status').eq(applied_filters.status.value)
+        expr = Attr('state').eq(applied_filters.status.value)
         filter_expression = expr if not filter_expression else filter_expression & expr
 
     if applied_filters.mergeable:
         expr = Attr('is_mergeable').eq(applied_filters.mergeable.value)
         filter_expression = expr if not filter_expression else filter_expression & expr
 
-    if applied_filters.timeframe:
-        if applied_filters.timeframe.to_date:
-            expr = Attr('createdAt').gte(applied_filters.timeframe.from_date)
-            filter_expression = expr if not filter_expression else filter_expression & expr
-            expr = Attr('createdAt').lte(applied_filters.timeframe.to_date)
+    # With an index the timeframe is part of the key condition.
+    if applied_filters.timeframe and key_attribute is None:
+        if applied_filters.timeframe.from_date:
+            expr = Attr(sort_key).gte(applied_filters.timeframe.from_date)
             filter_expression = expr if not filter_expression else filter_expression & expr
-        else:
-            expr = Attr('createdAt').gte(applied_filters.timeframe.from_date)
+        if applied_filters.timeframe.to_date:
+            expr = Attr(sort_key).lte(applied_filters.timeframe.to_date)
             filter_expression = expr if not filter_expression else filter_expression & expr
 
     return filter_expression
 
 
+def retrieve_pull_requests(applied_filters, dynamodb_client, projection=METRIC_ATTRIBUTES):
+    index_name, key_attribute, key_condition = plan_query(applied_filters)
+    query = build_query(applied_filters, key_attribute)
+    if index_name is None:
+        return iterate_filtered_records(query, dynamodb_client, 'pull-requests', projection)
+    return iterate_query_records(index_name, key_condition, query, dynamodb_client, 'pull-requests', projection)
+
+
+def retrieve_rollups(applied_filters, dynamodb_client):
+    index_name, key_attribute, key_condition = plan_query(applied_filters, ROLLUP_INDEXES, 'day')
+    query = build_query(applied_filters, key_attribute, 'day')
+    if index_name is None:
+        return iterate_filtered_records(query, dynamodb_client, 'pull-request-rollups')
+    return iterate_query_records(index_name, key_condition, query, dynamodb_client, 'pull-request-rollups')
+
+
+def accumulate_pull_requests(metrics, pull_requests):
+    if ANALYTICS_ENGINE == 'columnar':
+        # Imported here, so NumPy is only loaded by the first request that reads raw pull requests rather than on
+        # every cold start.
+        from columnar import accumulate_pull_request_columns
+        for batch in batched(pull_requests, COLUMNAR_BATCH_SIZE):
+            accumulate_pull_request_columns(metrics, batch)
+    else:
+        for pull_request in pull_requests:
+            accumulate_pull_request_metrics(metrics, pull_request)
+
+
+def retrieve_metrics_from_rollups(applied_filters, metrics, dynamodb_client):
+    # Rollups are keyed by project, repository, author and day only, so status and mergeable filters need the
+    # raw pull requests, as does a timeframe that doesn't cover a single whole day.
+    if applied_filters.status or applied_filters.mergeable:
+        return False
+    split = split_timeframe_by_day(applied_filters.timeframe)
+    if split is None:
+        return False
+    days, partial_timeframes = split
+
+    rollup_filters = copy.copy(applied_filters)
+    rollup_filters.timeframe = days if days.from_date or days.to_date else None
+    for rollup in retrieve_rollups(rollup_filters, dynamodb_client):
+        accumulate_rollup_metrics(metrics, rollup)
+
+    for timeframe in partial_timeframes:
+        partial_filters = copy.copy(applied_filters)
+        partial_filters.timeframe = timeframe
+        accumulate_pull_requests(metrics, retrieve_pull_requests(partial_filters, dynamodb_client))
+    return True
+
+
 @app.route('/filterData', methods=['POST'])
 def filterData():
+    dynamodb_client = get_client()
+    requested_data = request.get_json()
+    applied_filters = constructFilterCriteria(requested_data)
+    cache_key = FilterResultCache.cache_key(applied_filters, retrieve_data_generation(dynamodb_client))
+    response = filter_cache.get(cache_key, dynamodb_client)
+    if response is None:
+        metrics = PullRequestMetrics()
+        if not retrieve_metrics_from_rollups(applied_filters, metrics, dynamodb_client):
+            accumulate_pull_requests(metrics, retrieve_pull_requests(applied_filters, dynamodb_client))
+        response = pull_request_metrics_response(metrics)
+        filter_cache.put(cache_key, response, dynamodb_client)
+    logger.info(response)
+    return jsonify(response), 200
+
+
+def accumulate_slices(slices, items, sort_key, accumulate):
+    # Routes every item of a single pass to each slice it matches. Matches are buffered per slice so the columnar
+    # engine still sees whole batches.
+    buffers = [[] for _ in slices]
+    for item in items:
+        for index, (applied_filters, metrics) in enumerate(slices):
+            if matches_filter_criteria(applied_filters, item, sort_key):
+                buffers[index].append(item)
+                if len(buffers[index]) >= COLUMNAR_BATCH_SIZE:
+                    accumulate(metrics, buffers[index])
+                    buffers[index] = []
+    for (applied_filters, metrics), buffer in zip(slices, buffers):
+        accumulate(metrics, buffer)
+
+
+def accumulate_rollups(metrics, rollups):
+    for rollup in rollups:
+        accumulate_rollup_metrics(metrics, rollup)
+
+
+@app.route('/filterDataBatch', methods=['POST'])
+def filterDataBatch():
+    dynamodb_client = get_client()
     requested_data = request.get_json()
+    criteria = requested_data.get('filters') or []
+    if not isinstance(criteria, list) or len(criteria) > MAX_BATCH_FILTERS:
+        return jsonify({"result": f"filters must be a list of at most {MAX_BATCH_FILTERS} criteria"}), 400
+    generation = retrieve_data_generation(dynamodb_client)
+
+    responses = [None] * len(criteria)
+    rollup_slices, raw_slices, pending = [], [], []
+    for index, requested_filters in enumerate(criteria):
+        applied_filters = constructFilterCriteria(requested_filters)
+        cache_key = FilterResultCache.cache_key(applied_filters, generation)
+        responses[index] = filter_cache.get(cache_key, dynamodb_client)
+        if responses[index] is not None:
+            continue
+        metrics = PullRequestMetrics()
+        pending.append((index, cache_key, metrics))
+        # Slices a rollup can answer on its own share one pass over the rollups, everything else one pass over the
+        # raw pull requests.
+        split = None
+        if not applied_filters.status and not applied_filters.mergeable:
+            split = split_timeframe_by_day(applied_filters.timeframe)
+        if split is not None and not split[1]:
+            rollup_filters = copy.copy(applied_filters)
+            rollup_filters.timeframe = split[0] if split[0].from_date or split[0].to_date else None
+            rollup_slices.append((rollup_filters, metrics))
+        else:
+            raw_slices.append((applied_filters, metrics))
+
+    if rollup_slices:
+        union = union_filter_criteria([applied_filters for applied_filters, _ in rollup_slices])
+        accumulate_slices(rollup_slices, retrieve_rollups(union, dynamodb_client), 'day', accumulate_rollups)
+    if raw_slices:
+        union = union_filter_criteria([applied_filters for applied_filters, _ in raw_slices])
+        pull_requests = retrieve_pull_requests(union, dynamodb_client, METRIC_ATTRIBUTES + BATCH_ROUTING_ATTRIBUTES)
+        accumulate_slices(raw_slices, pull_requests, 'createdAt', accumulate_pull_requests)
+
+    for index, cache_key, metrics in pending:
+        responses[index] = pull_request_metrics_response(metrics)
+        filter_cache.put(cache_key, responses[index], dynamodb_client)
+    return jsonify({"results": responses}), 200
+
+
+@app.route('/timeseries', methods=['POST'])
+def timeseries():
+    dynamodb_client = get_client()
+    requested_data = request.get_json()
+    interval = requested_data.get('interval', 'day')
+    if interval not in TIMESERIES_INTERVALS:
+        return jsonify({"result": f"interval must be one of {', '.join(TIMESERIES_INTERVALS)}"}), 400
     applied_filters = constructFilterCriteria(requested_data)
-    query = build_query(applied_filters)
-    pull_requests = retrieve_filtered_records(query, client, 'pull-requests')
-    average_turnaround_time_per_comment = 0
-    pull_requests_status = PullRequestStatus()
-    pull_requests_mergeable = MergeableState()
-    avg_time_from_create_to_conclude = 0
-    concluded_pr_count = 0
-    pr_with_replies_count = 0
-    total_comments = 0
-    pull_request_count = 0
-    for pull_request in pull_requests:
-        total_comments += pull_request.get('total_comments_count', 0)
-        if pull_request.get('avg_comment_reply_time') is not None and pull_request.get('avg_comment_reply_time',
-                                                                                       {}).get('total_seconds',
-                                                                                               None) is not None:
-            average_turnaround_time_per_comment += pull_request.get('avg_comment_reply_time', {}).get('total_seconds',
-                                                                                                      None)
-            pr_with_replies_count += 1
-        if pull_request.get('state') is not None:
-            updatePRStatustracker(pull_requests_status, pull_request.get('state'))
-        if pull_request.get('is_mergeable') is not None:
-            updateMergeableStateTracker(pull_requests_mergeable, pull_request.get('is_mergeable'))
-        if pull_request.get('closureTime') is not None and pull_request.get('closureTime', {}).get('total_seconds',
-                                                                                                   None) is not None:
-            avg_time_from_create_to_conclude += pull_request.get('closureTime', {}).get('total_seconds', None)
-            concluded_pr_count += 1
-        pull_request_count += 1
-    comment_turnaround_metric = compute_average_closure_time(average_turnaround_time_per_comment, pr_with_replies_count)
-    pr_conclusion_time_metric = compute_average_closure_time(avg_time_from_create_to_conclude, concluded_pr_count)
-    logger.info(comment_turnaround_metric)
-    logger.info(pr_conclusion_time_metric)
-    logger.info(pull_requests_status.to_dict())
-    logger.info(total_comments)
-    logger.info(pull_requests_mergeable.to_dict())
-    return jsonify({"avg_comment_turnaround_time": comment_turnaround_metric,
-                    "avg_pull_request_closure_time": pr_conclusion_time_metric,
-                    "pull_request_status": pull_requests_status.to_dict(),
-                    "total_comments": total_comments,
-                    "pull_request_merge_status": pull_requests_mergeable.to_dict(),
-                    "pull_request_count": pull_request_count}), 200
+    # Buckets always span whole days, so the timeframe is widened to the days it touches.
+    timeframe = applied_filters.timeframe
+    if timeframe and (timeframe.from_date or timeframe.to_date):
+        applied_filters.timeframe = TimeFrame((timeframe.from_date or '')[:10] or None,
+                                              (timeframe.to_date or '')[:10] or None)
+    else:
+        applied_filters.timeframe = None
+
+    cache_key = f"{FilterResultCache.cache_key(applied_filters, retrieve_data_generation(dynamodb_client))}" \
+                f"|timeseries|{interval}"
+    response = filter_cache.get(cache_key, dynamodb_client)
+    if response is None:
+        buckets = {}
+        if applied_filters.status or applied_filters.mergeable:
+            raw_filters = copy.copy(applied_filters)
+            if raw_filters.timeframe and raw_filters.timeframe.to_date:
+                raw_filters.timeframe = TimeFrame(raw_filters.timeframe.from_date,
+                                                  f'{raw_filters.timeframe.to_date}T23:59:59Z')
+            for pull_request in retrieve_pull_requests(raw_filters, dynamodb_client,
+                                                       METRIC_ATTRIBUTES + ('createdAt',)):
+                bucket = bucket_start(pull_request.get('createdAt', '')[:10], interval)
+                accumulate_pull_request_metrics(buckets.setdefault(bucket, PullRequestMetrics()), pull_request)
+        else:
+            for rollup in retrieve_rollups(applied_filters, dynamodb_client):
+                bucket = bucket_start(rollup['day'], interval)
+                accumulate_rollup_metrics(buckets.setdefault(bucket, PullRequestMetrics()), rollup)
+        response = {"interval": interval,
+                    "buckets": [dict(bucket=bucket, **pull_request_metrics_response(buckets[bucket]))
+                                for bucket in sorted(buckets)]}
+        filter_cache.put(cache_key, response, dynamodb_client)
+    return jsonify(response), 200
+
+
+@app.route('/cacheStats', methods=['GET'])
+def cacheStats():
+    return jsonify(filter_cache.stats()), 200
 
 
 @app.route('/createUser', methods=['POST'])
 def createUser():
+    dynamodb_client = get_client()
     requested_data = request.get_json()
     logger.info(requested_data.get('username'))
+    if not isinstance(requested_data.get('username'), str) or not isinstance(requested_data.get('password'), str) \
+            or not requested_data['username'] or not requested_data['password']:
+        return {"result": "failure"}, 400
     item = {
         'username': requested_data.get('username'),
-        'password': requested_data.get('password')
+        'password_hash': hash_password(requested_data.get('password'))
     }
-    if create_user(item, client):
+    if create_user(item, dynamodb_client):
         return {"result": "success"}, 200
     return {"result": "failure"}, 500
 
 
 @app.route('/validUser', methods=['POST'])
 def validUser():
+    dynamodb_client = get_client()
     requested_data = request.get_json()
     logger.info(requested_data.get('username'))
-    query = Attr('username').eq(requested_data.get('username')) & Attr('password').eq(requested_data.get('password'))
-    results = retrieve_filtered_records(query, client, 'users')
-    if len(results) >= 1:
+    username = requested_data.get('username')
+    password = requested_data.get('password')
+    if not isinstance(username, str) or not isinstance(password, str):
+        return {"result": "invalid credentials"}, 200
+    # Users are keyed by username, so this is a single point lookup whatever the size of the table.
+    user = retrieve_record(username, dynamodb_client, 'users') if username else None
+    if user is not None and user.get('password_hash'):
+        if verify_password(password, user['password_hash']):
+            return {"result": "success"}, 200
+    # Compared as bytes, since compare_digest only takes ASCII strings. A password that isn't valid UTF-8 can't match
+    # a stored one, and surrogatepass lets it fail the comparison instead of the encoding.
+    elif user is not None and password and hmac.compare_digest(
+            str(user.get('password', '')).encode('utf-8', 'surrogatepass'), password.encode('utf-8', 'surrogatepass')):
+        # Accounts created before passwords were hashed are upgraded on their first successful login.
+        update_password_hash(username, hash_password(password), dynamodb_client)
         return {"result": "success"}, 200
     return {"result": "invalid credentials"}, 200
 
 
+IMPORT_SECONDS = time.perf_counter() - MODULE_IMPORT_STARTED
+logger.info(f"git-service imported in {IMPORT_SECONDS * 1000:.1f} ms")
+first_response = {'logged': False}
+
+
+@app.after_request
+def log_time_to_first_response(response):
+    if not first_response['logged']:
+        first_response['logged'] = True
+        logger.info(f"Time to first response: {(time.perf_counter() - MODULE_IMPORT_STARTED) * 1000:.1f} ms "
+                    f"({request.path})")
+    return response
+
+
 if __name__ == '__main__':
-    app.run(debug=True, use_reloader=False)
+    if sys.argv[1:] == ['worker']:
+        shard_worker(f'worker-{socket.gethostname()}-{os.getpid()}')
+    else:
+        app.run(debug=True, use_reloader=False)
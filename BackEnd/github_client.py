@@ -0,0 +1,318 @@
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import ijson
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = (500, 502, 503, 504)
+THROTTLED_STATUS_CODES = (403, 429)
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class GitHubRequestError(Exception):
+    pass
+
+
+def parse_reset_time(reset_at):
+    # GraphQL reports resetAt as an ISO timestamp, the REST headers as epoch seconds.
+    if reset_at is None:
+        return None
+    if isinstance(reset_at, (int, float)) or str(reset_at).isdigit():
+        return float(reset_at)
+    return datetime.strptime(reset_at, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+
+
+class ValueBuilder:
+    # Assembles a value from parser events. Unlike ijson.ObjectBuilder it keeps no closures over itself, so a
+    # finished value is freed by reference counting straight away instead of waiting for the cycle collector.
+    def __init__(self):
+        self.containers = []
+        self.keys = []
+        self.value = None
+
+    def add(self, value):
+        if not self.containers:
+            self.value = value
+        elif self.keys[-1] is None:
+            self.containers[-1].append(value)
+        else:
+            self.containers[-1][self.keys[-1]] = value
+
+    def event(self, event, value):
+        if event == 'map_key':
+            self.keys[-1] = value
+        elif event in ('start_map', 'start_array'):
+            container = {} if event == 'start_map' else []
+            self.add(container)
+            self.containers.append(container)
+            self.keys.append(None)
+        elif event in ('end_map', 'end_array'):
+            self.containers.pop()
+            self.keys.pop()
+        else:
+            self.add(value)
+
+
+def parse_streamed_body(stream, item_path, on_item):
+    # Builds the response body from parser events, except that every value at item_path is handed to on_item as
+    # soon as its closing bracket is parsed and is never attached to the body, so only one of them is in memory
+    # at a time. Returns the body with those values left out and the number of values handed over.
+    body = ValueBuilder()
+    item = None
+    delivered = 0
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if item is None and prefix == item_path and event in ('start_map', 'start_array'):
+            item = ValueBuilder()
+        if item is None:
+            body.event(event, value)
+            continue
+        item.event(event, value)
+        if prefix == item_path and event in ('end_map', 'end_array'):
+            on_item(item.value)
+            delivered += 1
+            item = None
+    return body.value or {}, delivered
+
+
+def timed_pool_class(base, pool_timeout):
+    # requests never passes a pool timeout to urllib3, so without one a blocking pool waits forever for a free
+    # connection; with it urlopen raises EmptyPoolError instead.
+    class TimedPool(base):
+        def urlopen(self, method, url, *args, **kwargs):
+            kwargs.setdefault('pool_timeout', pool_timeout)
+            return super().urlopen(method, url, *args, **kwargs)
+    return TimedPool
+
+
+class PoolTimeoutAdapter(HTTPAdapter):
+    def __init__(self, pool_timeout, **kwargs):
+        self.pool_timeout = pool_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': timed_pool_class(HTTPConnectionPool, self.pool_timeout),
+            'https': timed_pool_class(HTTPSConnectionPool, self.pool_timeout)
+        }
+
+
+class GitHubScheduler:
+    # token is either the token itself or a provider called as token(force_refresh=False) before every request.
+    def __init__(self, token, url, max_retries=5, base_delay=1.0, max_delay=60.0, reserved_points=50,
+                 max_wait=300, timeout=30, pool_size=10, pool_timeout=60, sleep=time.sleep, clock=time.time):
+        self.token = token
+        self.url = url
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.reserved_points = reserved_points
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.sleep = sleep
+        self.clock = clock
+        self.remaining = None
+        self.reset_at = None
+        self.points_spent = 0
+        self.requests_made = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+        # One keep-alive pool shared by every thread. Sessions hold cookies and other state that isn't thread
+        # safe, so each thread has its own, but they all send through the same adapter and its connections.
+        self.adapter = PoolTimeoutAdapter(pool_timeout, pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+                                          max_retries=0)
+        self.sessions = threading.local()
+        self.latency = {'requests': 0, 'server_seconds': 0.0, 'transfer_seconds': 0.0, 'decode_seconds': 0.0}
+
+    def budget(self):
+        with self.lock:
+            return {
+                'remaining': self.remaining,
+                'reset_at': self.reset_at,
+                'points_spent': self.points_spent,
+                'requests_made': self.requests_made,
+                'retries': self.retries
+            }
+
+    def session(self):
+        if not hasattr(self.sessions, 'session'):
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            session.headers['Accept-Encoding'] = 'gzip'
+            self.sessions.session = session
+        return self.sessions.session
+
+    def stream_body(self, response, item_path, on_item):
+        response.raw.decode_content = True
+        try:
+            result = parse_streamed_body(response.raw, item_path, on_item)
+        except (ijson.JSONError, requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            # The connection is dropped rather than handed back to the pool with part of a body still on it.
+            response.close()
+            raise GitHubRequestError(f"GitHub response could not be read: {e}")
+        # Parsed to the end of the body, so the connection can go back to the pool for the next request.
+        response.raw.release_conn()
+        return result
+
+    def connection_stats(self):
+        # urllib3 counts the connections each pool opened and the requests it sent; every request beyond the
+        # connections opened went over a reused keep-alive connection.
+        connections = requests_sent = 0
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+        with self.lock:
+            latency = dict(self.latency)
+        count = latency.pop('requests')
+        return {
+            'requests': requests_sent,
+            'connections_opened': connections,
+            'connection_reuse_rate': 1 - connections / requests_sent if requests_sent else None,
+            # Time to the response headers, to the end of the (gzipped) body, and to parse the JSON.
+            'avg_latency_seconds': {name[:-len('_seconds')]: total / count if count else None
+                                    for name, total in latency.items()}
+        }
+
+    def record_latency(self, server_seconds, transfer_seconds, decode_seconds):
+        with self.lock:
+            self.latency['requests'] += 1
+            self.latency['server_seconds'] += server_seconds
+            self.latency['transfer_seconds'] += transfer_seconds
+            self.latency['decode_seconds'] += decode_seconds
+
+    def backoff(self, attempt):
+        # Full jitter keeps concurrent workers from retrying in lock step.
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def wait_for_budget(self):
+        with self.lock:
+            if self.remaining is None or self.remaining > self.reserved_points or self.reset_at is None:
+                return
+            wait = self.reset_at - self.clock()
+            if wait <= 0:
+                self.remaining = None
+                return
+            if wait > self.max_wait:
+                raise RateLimitExceeded(f"GitHub point budget exhausted until {self.reset_at}")
+        logger.warning(f"GitHub point budget low, waiting {wait:.0f}s for the reset")
+        self.sleep(wait)
+        with self.lock:
+            self.remaining = None
+
+    def record_rate_limit(self, remaining=None, reset_at=None, cost=None):
+        with self.lock:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset_at is not None:
+                self.reset_at = parse_reset_time(reset_at)
+            if cost is not None:
+                self.points_spent += int(cost)
+
+    def throttle_delay(self, response, attempt):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None and str(retry_after).isdigit():
+            return float(retry_after)
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            reset_at = parse_reset_time(response.headers.get('X-RateLimit-Reset'))
+            if reset_at is not None:
+                wait = reset_at - self.clock()
+                if wait > self.max_wait:
+                    raise RateLimitExceeded(f"GitHub rate limit exhausted until {reset_at}")
+                return max(wait, 0) + random.uniform(0, self.base_delay)
+        # Secondary rate limits come without a reset time.
+        return self.backoff(attempt)
+
+    def is_throttled(self, response):
+        if response.status_code == 429:
+            return True
+        if response.headers.get('Retry-After') is not None or response.headers.get('X-RateLimit-Remaining') == '0':
+            return True
+        return 'rate limit' in response.text.lower()
+
+    def current_token(self, force_refresh=False):
+        if callable(self.token):
+            return self.token(force_refresh=force_refresh)
+        return self.token
+
+    def execute(self, query, variables, item_path=None, on_item=None):
+        # With item_path, the body is streamed and each value at that path is passed to on_item while it is
+        # parsed instead of being returned. Once a value has been passed on, the request is no longer retried,
+        # since the caller would see it twice; a failure from then on is raised and the caller's checkpoint
+        # decides what is redone.
+        token_refreshed = False
+        for attempt in range(self.max_retries + 1):
+            headers = {
+                'Authorization': f'Bearer {self.current_token()}',
+                'Content-Type': 'application/json'
+            }
+            self.wait_for_budget()
+            if attempt > 0:
+                with self.lock:
+                    self.retries += 1
+            with self.lock:
+                self.requests_made += 1
+            started = time.perf_counter()
+            try:
+                response = self.session().post(self.url, headers=headers, stream=item_path is not None,
+                                               json={'query': query, 'variables': variables}, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout, urllib3.exceptions.EmptyPoolError) as e:
+                logger.warning(f"GitHub request failed ({e}), attempt {attempt + 1}")
+                self.sleep(self.backoff(attempt))
+                continue
+
+            self.record_rate_limit(response.headers.get('X-RateLimit-Remaining'),
+                                   response.headers.get('X-RateLimit-Reset'))
+            if response.status_code == 401 and callable(self.token) and not token_refreshed:
+                # The cached token may have been rotated since it was fetched.
+                token_refreshed = True
+                # A streamed response still holds its pooled connection until it is closed.
+                response.close()
+                self.current_token(force_refresh=True)
+                continue
+            if response.status_code in THROTTLED_STATUS_CODES and self.is_throttled(response):
+                response.close()
+                delay = self.throttle_delay(response, attempt)
+                logger.warning(f"GitHub throttled the request, retrying in {delay:.1f}s")
+                self.sleep(delay)
+                continue
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                logger.warning(f"GitHub returned {response.status_code}, attempt {attempt + 1}")
+                response.close()
+                self.sleep(self.backoff(attempt))
+                continue
+
+            server_seconds = response.elapsed.total_seconds()
+            if item_path is not None:
+                body, delivered = self.stream_body(response, item_path, on_item)
+                # The body is read while it is parsed, so the time after the headers is reported as transfer.
+                self.record_latency(server_seconds, max(time.perf_counter() - started - server_seconds, 0), 0)
+            else:
+                received = time.perf_counter()
+                body = response.json()
+                delivered = 0
+                self.record_latency(server_seconds, max(received - started - server_seconds, 0),
+                                    time.perf_counter() - received)
+            if any(error.get('type') == 'RATE_LIMITED' for error in body.get('errors') or []) and not delivered:
+                self.record_rate_limit(remaining=0)
+                self.sleep(self.backoff(attempt))
+                continue
+            rate_limit = (body.get('data') or {}).get('rateLimit') or {}
+            self.record_rate_limit(rate_limit.get('remaining'), rate_limit.get('resetAt'), rate_limit.get('cost'))
+            return body
+
+        raise GitHubRequestError(f"GitHub request failed after {self.max_retries + 1} attempts")
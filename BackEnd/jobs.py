@@ -0,0 +1,222 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# A run whose jobs have all finished and whose projects are being assembled.
+FINALIZING = 'finalizing'
+# A run whose jobs have all finished but not all succeeded.
+PARTIAL = 'partial'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    job_count INTEGER NOT NULL,
+    generation INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    project TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    pages_synced INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_index ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_run_index ON jobs (run_id, position);
+"""
+
+
+class JobQueue:
+    # Ingestion runs and their per-repository jobs in SQLite. ':memory:' keeps the queue inside the process, a file
+    # path lets several worker processes share it. Every state change is a single transaction guarded by the job's
+    # current status, so a job is only ever claimed, completed or failed once per attempt.
+    def __init__(self, path=':memory:', lease_seconds=900, max_attempts=3, retry_delay=30, clock=time.time):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def transaction(self, statements):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(self.connection)
+                self.connection.execute('COMMIT')
+                return result
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def create_run(self, repositories, run_id=None):
+        run_id = run_id or uuid.uuid4().hex
+        now = self.clock()
+
+        def insert(connection):
+            connection.execute('INSERT INTO runs (id, status, job_count, created_at, updated_at) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (run_id, QUEUED if repositories else SUCCEEDED, len(repositories), now, now))
+            for position, (project, repository) in enumerate(repositories):
+                connection.execute('INSERT INTO jobs (id, run_id, position, project, repository, status, '
+                                   'max_attempts, available_at, created_at, updated_at) '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (f'{run_id}/{project}/{repository}', run_id, position, project, repository,
+                                    QUEUED, self.max_attempts, now, now, now))
+        self.transaction(insert)
+        return run_id
+
+    def claim(self, worker_id, run_id=None):
+        # Queued jobs are taken in run and position order; a running job whose lease has lapsed belonged to a
+        # worker that died and is taken over as its next attempt. With run_id, only that run's jobs are taken.
+        now = self.clock()
+
+        def take(connection):
+            row = connection.execute('SELECT * FROM jobs WHERE ((status = ? AND available_at <= ?) '
+                                     'OR (status = ? AND lease_expires_at < ?)) AND (? IS NULL OR run_id = ?) '
+                                     'ORDER BY created_at, position LIMIT 1',
+                                     (QUEUED, now, RUNNING, now, run_id, run_id)).fetchone()
+            if row is None:
+                return None
+            if row['status'] == RUNNING and row['attempts'] >= row['max_attempts']:
+                self.finish_job(connection, row['id'], FAILED, 'lease expired on the final attempt')
+                return dict(row, status=FAILED)
+            connection.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, worker_id = ?, '
+                               'lease_expires_at = ?, updated_at = ? WHERE id = ?',
+                               (RUNNING, worker_id, now + self.lease_seconds, now, row['id']))
+            connection.execute('UPDATE runs SET status = ?, updated_at = ? WHERE id = ? AND status = ?',
+                               (RUNNING, now, row['run_id'], QUEUED))
+            return dict(row, status=RUNNING, attempts=row['attempts'] + 1, worker_id=worker_id)
+        return self.transaction(take)
+
+    def record_progress(self, job, pages_synced):
+        # Progress doubles as the heartbeat that keeps the lease alive.
+        now = self.clock()
+        self.transaction(lambda connection: connection.execute(
+            'UPDATE jobs SET pages_synced = ?, lease_expires_at = ?, updated_at = ? '
+            'WHERE id = ? AND status = ? AND worker_id = ?',
+            (pages_synced, now + self.lease_seconds, now, job['id'], RUNNING, job['worker_id'])))
+
+    def complete(self, job):
+        return self.transaction(lambda connection: self.finish_job(connection, job['id'], SUCCEEDED, None,
+                                                                   job['worker_id']))
+
+    def fail(self, job, error):
+        now = self.clock()
+
+        def retry_or_fail(connection):
+            row = connection.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = ? '
+                                     'AND worker_id = ?', (job['id'], RUNNING, job['worker_id'])).fetchone()
+            if row is None:
+                return False
+            if row['attempts'] < row['max_attempts']:
+                connection.execute('UPDATE jobs SET status = ?, error = ?, worker_id = NULL, '
+                                   'lease_expires_at = NULL, available_at = ?, updated_at = ? WHERE id = ?',
+                                   (QUEUED, error, now + self.retry_delay * 2 ** (row['attempts'] - 1), now,
+                                    job['id']))
+                return False
+            return self.finish_job(connection, job['id'], FAILED, error, job['worker_id'])
+        return self.transaction(retry_or_fail)
+
+    def finish_job(self, connection, job_id, status, error, worker_id=None):
+        now = self.clock()
+        updated = connection.execute('UPDATE jobs SET status = ?, error = ?, lease_expires_at = NULL, updated_at = ? '
+                                     'WHERE id = ? AND status = ? AND (? IS NULL OR worker_id = ?)',
+                                     (status, error, now, job_id, RUNNING, worker_id, worker_id)).rowcount
+        return updated == 1
+
+    def fail_outstanding(self, run_id, error):
+        # Fails every queued or running job of a run that nothing is going to work on any more.
+        now = self.clock()
+        return self.transaction(lambda connection: connection.execute(
+            'UPDATE jobs SET status = ?, error = ?, lease_expires_at = NULL, updated_at = ? '
+            'WHERE run_id = ? AND status IN (?, ?)', (FAILED, error, now, run_id, QUEUED, RUNNING)).rowcount)
+
+    def claim_finalization(self, run_id):
+        # Only the caller that moves the run to FINALIZING assembles its projects. A finalization that hasn't
+        # finished within a lease is assumed dead and may be claimed again, which is safe because it is idempotent.
+        now = self.clock()
+
+        def take(connection):
+            outstanding = connection.execute('SELECT COUNT(*) FROM jobs WHERE run_id = ? AND status IN (?, ?)',
+                                             (run_id, QUEUED, RUNNING)).fetchone()[0]
+            if outstanding:
+                return False
+            return connection.execute('UPDATE runs SET status = ?, updated_at = ? WHERE id = ? '
+                                      'AND (status IN (?, ?) OR (status = ? AND updated_at < ?))',
+                                      (FINALIZING, now, run_id, QUEUED, RUNNING, FINALIZING,
+                                       now - self.lease_seconds)).rowcount == 1
+        return self.transaction(take)
+
+    def outstanding_jobs(self, run_id):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM jobs WHERE run_id = ? AND status IN (?, ?)',
+                                           (run_id, QUEUED, RUNNING)).fetchone()[0]
+
+    def unfinished_runs(self):
+        # Runs with no outstanding jobs that were never finalized, because their last job was failed by an expired
+        # lease or their finalization died.
+        with self.lock:
+            rows = self.connection.execute('SELECT id FROM runs WHERE status IN (?, ?, ?) AND NOT EXISTS '
+                                           '(SELECT 1 FROM jobs WHERE jobs.run_id = runs.id AND status IN (?, ?))',
+                                           (QUEUED, RUNNING, FINALIZING, QUEUED, RUNNING)).fetchall()
+        return [row['id'] for row in rows]
+
+    def finish_run(self, run_id, generation):
+        now = self.clock()
+
+        def finish(connection):
+            failed = connection.execute('SELECT COUNT(*) FROM jobs WHERE run_id = ? AND status = ?',
+                                        (run_id, FAILED)).fetchone()[0]
+            connection.execute('UPDATE runs SET status = ?, generation = ?, updated_at = ? WHERE id = ?',
+                               (PARTIAL if failed else SUCCEEDED, generation, now, run_id))
+        self.transaction(finish)
+
+    def run_status(self, run_id):
+        with self.lock:
+            run = self.connection.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+            if run is None:
+                return None
+            jobs = self.connection.execute('SELECT * FROM jobs WHERE run_id = ? ORDER BY position',
+                                           (run_id,)).fetchall()
+        counts = {status: 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        for job in jobs:
+            counts[job['status']] += 1
+        return {
+            'job_id': run['id'],
+            'status': run['status'],
+            'generation': run['generation'],
+            'created_at': run['created_at'],
+            'updated_at': run['updated_at'],
+            'progress': dict(counts, total=run['job_count']),
+            'jobs': [{
+                'repository': f"{job['project']}/{job['repository']}",
+                'status': job['status'],
+                'attempts': job['attempts'],
+                'pages_synced': job['pages_synced'],
+                'error': job['error']
+            } for job in jobs]
+        }
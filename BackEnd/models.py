@@ -2,8 +2,12 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional
 
+from sketches import QuantileSketch
+
 
 class MergeableState:
+    __slots__ = ('mergeable', 'conflicting', 'unknown')
+
     def __init__(self, mergeable=0, conflicting=0, unknown=0):
         self.mergeable = mergeable
         self.conflicting = conflicting
@@ -16,12 +20,20 @@ class MergeableState:
             'unknown': self.unknown
         }
 
+    @staticmethod
+    def from_dict(item):
+        item = item or {}
+        return MergeableState(item.get('mergeable', 0), item.get('conflicting', 0), item.get('unknown', 0))
+
 
 class Project:
-    def __init__(self, name=None, repositories=[], pr_status=None, total_comments_count=0, pull_requests_count=0,
+    __slots__ = ('name', 'repositories', 'pr_status', 'total_comments_count', 'pull_requests_count', 'mergeable_state',
+                 'avg_comment_reply_time')
+
+    def __init__(self, name=None, repositories=None, pr_status=None, total_comments_count=0, pull_requests_count=0,
                  mergeable_state=None, avg_comment_reply_time=None):
         self.name = name
-        self.repositories = repositories
+        self.repositories = repositories if repositories is not None else []
         self.pr_status = pr_status
         self.total_comments_count = total_comments_count
         self.pull_requests_count = pull_requests_count
@@ -41,20 +53,26 @@ class Project:
 
 
 class PullRequestReview:
-    def __init__(self, comments=[], review_author=None, state=None):
-        self.comments = comments
+    __slots__ = ('comments', 'review_author', 'state')
+
+    def __init__(self, comments=None, review_author=None, state=None):
+        self.comments = comments if comments is not None else []
         self.review_author = review_author
         self.state = state
 
     def to_dict(self):
+        # Comments are stored once, in the comments table, and only referenced here.
         return {
-            'comments': [comment.to_dict() for comment in self.comments],
+            'comment_ids': [comment.comment_id for comment in self.comments],
             'review_author': self.review_author,
             'state': self.state
         }
 
 
 class Comment:
+    __slots__ = ('comment_id', 'comment_text', 'created_date_time', 'comment_author', 'reply_to_comment_id',
+                 'pull_request_id', 'repository', 'project')
+
     def __init__(self, comment_id=None, comment_text=None, created_date_time=None, comment_author=None,
                  reply_to_comment_id=None, pull_request_id=None, repository=None, project=None):
         self.comment_id = comment_id
@@ -81,17 +99,22 @@ class Comment:
 
 
 class PullRequest:
+    __slots__ = ('pr_id', 'state', 'pull_request_number', 'title', 'is_mergeable', 'total_comments_count', 'comments',
+                 'reviews', 'author', 'project', 'repository', 'createdAt', 'mergedAt', 'closedAt', 'closureTime',
+                 'avg_comment_reply_time', 'updatedAt', 'total_reply_time', 'comment_reply_count', 'reply_sketch')
+
     def __init__(self, pr_id=None, state=None, pull_request_number=None, title=None, is_mergeable=None,
-                 total_comments_count=None, comments=[], reviews=[], author=None, project=None, repository=None,
-                 createdAt=None, mergedAt=None, closedAt=None, closureTime=None, avg_comment_reply_time=None):
+                 total_comments_count=None, comments=None, reviews=None, author=None, project=None, repository=None,
+                 createdAt=None, mergedAt=None, closedAt=None, closureTime=None, avg_comment_reply_time=None,
+                 updatedAt=None, total_reply_time=0, comment_reply_count=0, reply_sketch=None):
         self.pr_id = pr_id
         self.state = state
         self.pull_request_number = pull_request_number
         self.title = title
         self.is_mergeable = is_mergeable
         self.total_comments_count = total_comments_count
-        self.comments = comments
-        self.reviews = reviews
+        self.comments = comments if comments is not None else []
+        self.reviews = reviews if reviews is not None else []
         self.author = author
         self.project = project
         self.repository = repository
@@ -100,6 +123,10 @@ class PullRequest:
         self.closedAt = closedAt
         self.closureTime = closureTime
         self.avg_comment_reply_time = avg_comment_reply_time
+        self.updatedAt = updatedAt
+        self.total_reply_time = total_reply_time
+        self.comment_reply_count = comment_reply_count
+        self.reply_sketch = reply_sketch
 
     def to_dict(self):
         return {
@@ -109,7 +136,7 @@ class PullRequest:
             'title': self.title,
             'is_mergeable': self.is_mergeable,
             'total_comments_count': self.total_comments_count,
-            'comments': [comment.to_dict() for comment in self.comments],
+            'comment_ids': [comment.comment_id for comment in self.comments],
             'reviews': [review.to_dict() for review in self.reviews],
             'author': self.author,
             'project': self.project,
@@ -118,11 +145,18 @@ class PullRequest:
             'mergedAt': self.mergedAt,
             'closedAt': self.closedAt,
             'closureTime': self.closureTime,
-            'avg_comment_reply_time': self.avg_comment_reply_time
+            'avg_comment_reply_time': self.avg_comment_reply_time,
+            'updatedAt': self.updatedAt,
+            'total_reply_time': self.total_reply_time,
+            'comment_reply_count': self.comment_reply_count,
+            'reply_sketch': self.reply_sketch.to_dict() if self.reply_sketch else None
         }
 
 
 class PullRequestsPageInfo:
+    __slots__ = ('end_cursor', 'has_next_page', 'has_previous_page', 'created_date_time', 'merged_date_time',
+                 'closed_date_time')
+
     def __init__(self, end_cursor=None, has_next_page=None, has_previous_page=None, created_date_time=None,
                  merged_date_time=None, closed_date_time=None):
         self.end_cursor = end_cursor
@@ -144,6 +178,8 @@ class PullRequestsPageInfo:
 
 
 class PullRequestStatus:
+    __slots__ = ('open_state', 'closed', 'merged')
+
     def __init__(self, open_state=0, closed=0, merged=0):
         self.open_state = open_state
         self.closed = closed
@@ -156,6 +192,11 @@ class PullRequestStatus:
             'merged': self.merged
         }
 
+    @staticmethod
+    def from_dict(item):
+        item = item or {}
+        return PullRequestStatus(item.get('open', 0), item.get('closed', 0), item.get('merged', 0))
+
 
 class PullRequestStatusEnum(Enum):
     OPEN = "OPEN"
@@ -170,12 +211,16 @@ class PullRequestMergeableEnum(Enum):
 
 
 class TimeFrame:
+    __slots__ = ('from_date', 'to_date')
+
     def __init__(self, from_date: Optional[datetime] = None, to_date: Optional[datetime] = None):
         self.from_date = from_date
         self.to_date = to_date
 
 
 class FilterCriteria:
+    __slots__ = ('status', 'author', 'timeframe', 'project', 'repository', 'mergeable')
+
     def __init__(self, status: Optional[PullRequestStatus] = None,
                  author: Optional[str] = None, timeframe: Optional[TimeFrame] = None, project: Optional[str] = None,
                  repository: Optional[str] = None, mergeable: Optional[PullRequestMergeableEnum] = None):
@@ -188,8 +233,13 @@ class FilterCriteria:
 
 
 class RepositoryData:
+    __slots__ = ('name', 'pull_requests_count', 'total_comments_count', 'pr_status', 'average_closure_time',
+                 'mergeable_state', 'avg_comment_reply_time', 'total_open_time', 'concluded_pr_count',
+                 'total_reply_time', 'comment_reply_count', 'page_info')
+
     def __init__(self, name=None, pull_requests_count=None, total_comments_count=None, pr_status=None,
-                 average_closure_time=None, mergeable_state=None, avg_comment_reply_time=None):
+                 average_closure_time=None, mergeable_state=None, avg_comment_reply_time=None, total_open_time=0,
+                 concluded_pr_count=0, total_reply_time=0, comment_reply_count=0, page_info=None):
         self.name = name
         self.pull_requests_count = pull_requests_count
         self.total_comments_count = total_comments_count
@@ -197,6 +247,12 @@ class RepositoryData:
         self.average_closure_time = average_closure_time
         self.mergeable_state = mergeable_state
         self.avg_comment_reply_time = avg_comment_reply_time
+        # Raw sums behind the averages so that pages fetched across several runs can be merged.
+        self.total_open_time = total_open_time
+        self.concluded_pr_count = concluded_pr_count
+        self.total_reply_time = total_reply_time
+        self.comment_reply_count = comment_reply_count
+        self.page_info = page_info
 
     def to_dict(self):
         return {
@@ -206,5 +262,79 @@ class RepositoryData:
             'pr_status': self.pr_status.to_dict() if self.pr_status else None,
             'average_closure_time': self.average_closure_time,
             'mergeable_state': self.mergeable_state.to_dict() if self.mergeable_state else None,
-            'avg_comment_reply_time': self.avg_comment_reply_time
+            'avg_comment_reply_time': self.avg_comment_reply_time,
+            'total_open_time': self.total_open_time,
+            'concluded_pr_count': self.concluded_pr_count,
+            'total_reply_time': self.total_reply_time,
+            'comment_reply_count': self.comment_reply_count
         }
+
+    @staticmethod
+    def from_dict(item):
+        return RepositoryData(item.get('name'),
+                              item.get('pull_requests_count'),
+                              item.get('total_comments_count', 0),
+                              PullRequestStatus.from_dict(item.get('pr_status')),
+                              item.get('average_closure_time'),
+                              MergeableState.from_dict(item.get('mergeable_state')),
+                              item.get('avg_comment_reply_time'),
+                              item.get('total_open_time', 0),
+                              item.get('concluded_pr_count', 0),
+                              item.get('total_reply_time', 0),
+                              item.get('comment_reply_count', 0))
+
+
+class SyncState:
+    __slots__ = ('sync_id', 'project', 'repository', 'end_cursor', 'pages_synced', 'backfill_complete',
+                 'last_updated_at', 'pending_updated_at')
+
+    def __init__(self, sync_id=None, project=None, repository=None, end_cursor=None, pages_synced=0,
+                 backfill_complete=False, last_updated_at=None, pending_updated_at=None):
+        self.sync_id = sync_id
+        self.project = project
+        self.repository = repository
+        self.end_cursor = end_cursor
+        self.pages_synced = pages_synced
+        self.backfill_complete = backfill_complete
+        # High-water mark of the last completed walk and of the walk currently in progress.
+        self.last_updated_at = last_updated_at
+        self.pending_updated_at = pending_updated_at
+
+    def to_dict(self):
+        return {
+            'project': self.project,
+            'repository': self.repository,
+            'end_cursor': self.end_cursor,
+            'pages_synced': self.pages_synced,
+            'backfill_complete': self.backfill_complete,
+            'last_updated_at': self.last_updated_at,
+            'pending_updated_at': self.pending_updated_at
+        }
+
+    @staticmethod
+    def from_dict(item):
+        return SyncState(item.get('id'),
+                         item.get('project'),
+                         item.get('repository'),
+                         item.get('end_cursor'),
+                         int(item.get('pages_synced', 0)),
+                         item.get('backfill_complete', False),
+                         item.get('last_updated_at'),
+                         item.get('pending_updated_at'))
+
+
+class PullRequestMetrics:
+    __slots__ = ('pull_request_count', 'total_comments', 'pr_status', 'mergeable_state', 'closure_seconds',
+                 'closure_count', 'reply_seconds', 'reply_count', 'closure_sketch', 'reply_sketch')
+
+    def __init__(self):
+        self.pull_request_count = 0
+        self.total_comments = 0
+        self.pr_status = PullRequestStatus()
+        self.mergeable_state = MergeableState()
+        self.closure_seconds = 0
+        self.closure_count = 0
+        self.reply_seconds = 0
+        self.reply_count = 0
+        self.closure_sketch = QuantileSketch()
+        self.reply_sketch = QuantileSketch()
@@ -0,0 +1,61 @@
+import math
+
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+ZERO_BUCKET = 'zero'
+
+
+def bucket_key(value):
+    # Durations below a second share one bucket; above that, bucket k holds (gamma^(k-1), gamma^k].
+    if value < 1:
+        return ZERO_BUCKET
+    return str(math.ceil(math.log(value) / LOG_GAMMA))
+
+
+def bucket_value(key):
+    if key == ZERO_BUCKET:
+        return 0
+    return 2 * GAMMA ** int(key) / (GAMMA + 1)
+
+
+class QuantileSketch:
+    # A DDSketch-style log-bucketed histogram: every quantile is within RELATIVE_ACCURACY of the true value, and
+    # two sketches merge by adding their bucket counts, so they can be summed like the other rollup counters.
+    __slots__ = ('buckets',)
+
+    def __init__(self, buckets=None):
+        self.buckets = {}
+        for key, count in (buckets or {}).items():
+            self.add_bucket(key, count)
+
+    def add(self, value, count=1):
+        self.add_bucket(bucket_key(value), count)
+
+    def add_bucket(self, key, count):
+        self.buckets[key] = self.buckets.get(key, 0) + int(count)
+        if self.buckets[key] == 0:
+            del self.buckets[key]
+
+    def merge(self, other):
+        for key, count in other.buckets.items():
+            self.add_bucket(key, count)
+
+    def count(self):
+        return sum(self.buckets.values())
+
+    def quantile(self, quantile):
+        total = self.count()
+        if total <= 0:
+            return None
+        rank = quantile * (total - 1)
+        seen = 0
+        keys = sorted(self.buckets, key=lambda key: -1 if key == ZERO_BUCKET else int(key))
+        for key in keys:
+            seen += self.buckets[key]
+            if seen > rank:
+                return bucket_value(key)
+        return bucket_value(keys[-1])
+
+    def to_dict(self):
+        return dict(self.buckets)
@@ -0,0 +1,140 @@
+import logging
+import os
+import sys
+import threading
+import unittest
+
+# The fake GitHub server and DynamoDB live with the benchmarks, which put BackEnd on the path as well.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_dynamodb import FakeDynamoDB  # noqa: E402
+from fake_github import FakeGitHubServer, SyntheticFixtures  # noqa: E402
+from models import PullRequestMetrics, TimeFrame  # noqa: E402
+from replay import load_service, run_cron_job, track_repositories  # noqa: E402
+from utils import constructFilterCriteria, end_of_day_bound, pull_request_metrics_response, \
+    split_timeframe_by_day  # noqa: E402
+
+REPOSITORIES = [('apache', 'kafka'), ('apache', 'jmeter')]
+
+
+def bounds(timeframe):
+    return timeframe.from_date, timeframe.to_date
+
+
+class SplitTimeframeByDayTest(unittest.TestCase):
+    def test_date_only_end_covers_its_whole_day(self):
+        self.assertEqual(end_of_day_bound('2024-01-03'), '2024-01-03T23:59:59Z')
+        self.assertEqual(end_of_day_bound('2024-01-03T12:00:00Z'), '2024-01-03T12:00:00Z')
+        self.assertIsNone(end_of_day_bound(None))
+        self.assertEqual(constructFilterCriteria({'to_date': '2024-01-03'}).timeframe.to_date, '2024-01-03T23:59:59Z')
+        days, partial_timeframes = split_timeframe_by_day(TimeFrame('2024-01-01', '2024-01-03'))
+        self.assertEqual(bounds(days), ('2024-01-01', '2024-01-03'))
+        self.assertEqual(partial_timeframes, [])
+
+    def test_midnight_end_leaves_no_empty_partial_day(self):
+        # '...T00:00' sorts before every timestamp of its day, so the day before is the last one covered.
+        days, partial_timeframes = split_timeframe_by_day(TimeFrame('2024-01-01', '2024-01-03T00:00'))
+        self.assertEqual(bounds(days), ('2024-01-01', '2024-01-02'))
+        self.assertEqual(partial_timeframes, [])
+
+    def test_midnight_timestamp_end_reads_its_first_second(self):
+        days, partial_timeframes = split_timeframe_by_day(TimeFrame('2024-01-01', '2024-01-03T00:00:00Z'))
+        self.assertEqual(bounds(days), ('2024-01-01', '2024-01-02'))
+        self.assertEqual([bounds(timeframe) for timeframe in partial_timeframes],
+                         [('2024-01-03T00:00:00Z', '2024-01-03T00:00:00Z')])
+
+    def test_partial_days_at_both_ends(self):
+        days, partial_timeframes = split_timeframe_by_day(TimeFrame('2024-01-01T12:00:00Z', '2024-01-04T06:00:00Z'))
+        self.assertEqual(bounds(days), ('2024-01-02', '2024-01-03'))
+        self.assertEqual([bounds(timeframe) for timeframe in partial_timeframes],
+                         [('2024-01-01T12:00:00Z', '2024-01-01T23:59:59Z'),
+                          ('2024-01-04T00:00:00Z', '2024-01-04T06:00:00Z')])
+
+    def test_single_whole_day(self):
+        days, partial_timeframes = split_timeframe_by_day(TimeFrame('2024-01-02', '2024-01-02'))
+        self.assertEqual(bounds(days), ('2024-01-02', '2024-01-02'))
+        self.assertEqual(partial_timeframes, [])
+
+    def test_range_within_a_single_day_covers_no_whole_day(self):
+        self.assertIsNone(split_timeframe_by_day(TimeFrame('2024-01-02T08:00:00Z', '2024-01-02T17:00:00Z')))
+
+    def test_open_ends(self):
+        days, partial_timeframes = split_timeframe_by_day(TimeFrame('2024-01-02T08:00:00Z', None))
+        self.assertEqual(bounds(days), ('2024-01-03', None))
+        self.assertEqual(len(partial_timeframes), 1)
+        days, partial_timeframes = split_timeframe_by_day(None)
+        self.assertEqual(bounds(days), (None, None))
+        self.assertEqual(partial_timeframes, [])
+
+
+class FilterDataTest(unittest.TestCase):
+    # A small synthetic backfill, after which answers from the rollups have to match the raw pull requests.
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeGitHubServer(SyntheticFixtures(60, comment_count=2, review_count=1))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.dynamodb = FakeDynamoDB()
+        cls.service = load_service(cls.dynamodb, f'http://127.0.0.1:{cls.server.server_address[1]}/graphql',
+                                   MAX_PAGES_PER_RUN=100, JOB_POLL_INTERVAL=0.05, INGESTION_DISPATCH='threads')
+        logging.getLogger().setLevel(logging.WARNING)
+        track_repositories(cls.dynamodb, REPOSITORIES)
+        cls.status = run_cron_job(cls.service)
+        cls.pull_requests = list(cls.dynamodb.Table('pull-requests').items.values())
+        cls.days = sorted({pull_request['createdAt'][:10] for pull_request in cls.pull_requests})
+        cls.client = cls.service.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def raw_response(self, criteria):
+        metrics = PullRequestMetrics()
+        self.service.accumulate_pull_requests(metrics, self.service.retrieve_pull_requests(
+            constructFilterCriteria(criteria), self.dynamodb))
+        return pull_request_metrics_response(metrics)
+
+    def test_backfill_succeeded(self):
+        self.assertEqual(self.status['status'], 'succeeded')
+        self.assertEqual(len(self.pull_requests), 120)
+        self.assertEqual(len(self.days), 3)
+
+    def test_rollup_results_match_raw_results(self):
+        author = self.pull_requests[0]['author']
+        for criteria in ({'project': 'apache'},
+                         {'project': 'apache', 'from_date': self.days[0], 'to_date': self.days[2]},
+                         {'repository': 'kafka', 'from_date': f'{self.days[0]}T06:00:00Z', 'to_date': self.days[2]},
+                         {'author': author, 'to_date': f'{self.days[2]}T00:00'}):
+            with self.subTest(criteria=criteria):
+                metrics = PullRequestMetrics()
+                self.assertTrue(self.service.retrieve_metrics_from_rollups(constructFilterCriteria(criteria),
+                                                                           metrics, self.dynamodb))
+                self.assertEqual(pull_request_metrics_response(metrics), self.raw_response(criteria))
+                # Through the same encoding /filterData answers with.
+                with self.service.app.app_context():
+                    expected = self.service.jsonify(self.raw_response(criteria)).get_json()
+                self.assertEqual(self.client.post('/filterData', json=criteria).get_json(), expected)
+
+    def test_date_only_end_includes_its_whole_day(self):
+        criteria = {'from_date': self.days[0], 'to_date': self.days[1]}
+        expected = sum(1 for pull_request in self.pull_requests
+                       if pull_request['createdAt'] <= f'{self.days[1]}T23:59:59Z')
+        self.assertGreater(expected, 0)
+        self.assertEqual(self.client.post('/filterData', json=criteria).get_json()['pull_request_count'], expected)
+
+    def test_status_filter_matches_the_state_attribute(self):
+        for status in ('OPEN', 'CLOSED', 'MERGED'):
+            with self.subTest(status=status):
+                criteria = {'project': 'apache', 'status': status}
+                expected = sum(1 for pull_request in self.pull_requests if pull_request['state'] == status)
+                self.assertGreater(expected, 0)
+                self.assertEqual(self.client.post('/filterData', json=criteria).get_json()['pull_request_count'],
+                                 expected)
+                batch = self.client.post('/filterDataBatch', json={'filters': [criteria]}).get_json()
+                self.assertEqual(batch['results'][0]['pull_request_count'], expected)
+                buckets = self.client.post('/timeseries', json=criteria).get_json()['buckets']
+                self.assertEqual(sum(bucket['pull_request_count'] for bucket in buckets), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import sys
+import threading
+import unittest
+from datetime import datetime, timezone
+
+# The fake GitHub server and its fixtures live with the benchmarks, which put BackEnd on the path as well.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_github import FakeGitHubServer, SyntheticFixtures  # noqa: E402
+from github_client import GitHubRequestError, GitHubScheduler, RateLimitExceeded  # noqa: E402
+
+PAGE_QUERY = 'query { repository { pullRequests } }'
+SINGLE_QUERY = 'query { repository { pullRequest(number: $number) } }'
+PAGE_VARIABLES = {'owner': 'octo', 'name': 'repo', 'pullRequestCount': 5, 'cursor': None}
+SINGLE_VARIABLES = {'owner': 'octo', 'name': 'repo', 'number': 1}
+EDGES_PATH = 'data.repository.pullRequests.edges.item'
+# Whole seconds, since resetAt is reported to the second.
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+def reset_at(seconds_from_now):
+    return datetime.fromtimestamp(NOW + seconds_from_now, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class GitHubSchedulerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeGitHubServer(SyntheticFixtures(5, comment_count=1, review_count=1))
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/graphql'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.failures = []
+        self.server.requests = 0
+        self.server.rate_limit = {'cost': 1, 'remaining': 5000, 'resetAt': reset_at(3600)}
+        self.sleeps = []
+        self.now = NOW
+
+    def sleep(self, seconds):
+        # Recorded instead of taken; the clock moves on as if it had been.
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def scheduler(self, **kwargs):
+        kwargs.setdefault('max_retries', 3)
+        return GitHubScheduler('token', self.url, sleep=self.sleep, clock=lambda: self.now, **kwargs)
+
+    def test_server_errors_are_retried_with_capped_backoff(self):
+        scheduler = self.scheduler(base_delay=2, max_delay=5)
+        for status in (500, 502, 503):
+            self.server.fail_next(status)
+        body = scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(body['data']['repository']['pullRequest']['number'], 1)
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(scheduler.budget()['retries'], 3)
+        # Full jitter below base_delay * 2 ** attempt, capped at max_delay.
+        for attempt, delay in enumerate(self.sleeps):
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(5, 2 * 2 ** attempt))
+
+    def test_server_errors_give_up_after_max_retries(self):
+        scheduler = self.scheduler(max_retries=2)
+        for _ in range(3):
+            self.server.fail_next(502)
+        with self.assertRaises(GitHubRequestError):
+            scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.sleeps), 3)
+
+    def test_retry_after_is_waited_out(self):
+        scheduler = self.scheduler()
+        self.server.fail_next(429, {'Retry-After': 7})
+        self.server.fail_next(403, {'Retry-After': 3}, 'You have exceeded a secondary rate limit')
+        scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(self.sleeps, [7.0, 3.0])
+
+    def test_exhausted_rate_limit_waits_for_the_reset(self):
+        scheduler = self.scheduler(base_delay=1)
+        self.server.fail_next(403, {'X-RateLimit-Remaining': 0, 'X-RateLimit-Reset': int(NOW + 30)})
+        scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertGreaterEqual(self.sleeps[0], 30)
+        self.assertLessEqual(self.sleeps[0], 31)
+
+    def test_rate_limit_reset_beyond_max_wait_is_raised(self):
+        scheduler = self.scheduler(max_wait=300)
+        self.server.fail_next(403, {'X-RateLimit-Remaining': 0, 'X-RateLimit-Reset': int(NOW + 3600)})
+        with self.assertRaises(RateLimitExceeded):
+            scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(self.sleeps, [])
+
+    def test_secondary_rate_limit_without_headers_backs_off(self):
+        scheduler = self.scheduler(base_delay=4)
+        self.server.fail_next(403, body='You have exceeded a secondary rate limit')
+        scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertLessEqual(self.sleeps[0], 4)
+
+    def test_forbidden_without_throttling_is_not_retried(self):
+        scheduler = self.scheduler()
+        self.server.fail_next(403, body='{"message": "Resource not accessible by integration"}')
+        body = scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(body, {'message': 'Resource not accessible by integration'})
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_low_budget_waits_for_the_reset_before_the_next_request(self):
+        scheduler = self.scheduler(reserved_points=50)
+        self.server.rate_limit = {'cost': 1, 'remaining': 10, 'resetAt': reset_at(120)}
+        scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(scheduler.budget()['remaining'], 10)
+        scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(self.sleeps, [120])
+        self.assertEqual(scheduler.budget()['points_spent'], 2)
+
+    def test_low_budget_reset_beyond_max_wait_is_raised_without_a_request(self):
+        scheduler = self.scheduler(reserved_points=50, max_wait=300)
+        self.server.rate_limit = {'cost': 1, 'remaining': 10, 'resetAt': reset_at(3600)}
+        scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        with self.assertRaises(RateLimitExceeded):
+            scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_graphql_rate_limited_error_is_retried(self):
+        scheduler = self.scheduler()
+        self.server.fail_next(200, {'Content-Type': 'application/json'},
+                              '{"errors": [{"type": "RATE_LIMITED", "message": "API rate limit exceeded"}]}')
+        body = scheduler.execute(SINGLE_QUERY, SINGLE_VARIABLES)
+        self.assertIn('repository', body['data'])
+        self.assertEqual(len(self.sleeps), 1)
+
+    def test_retried_streamed_response_returns_its_connection(self):
+        # With one pooled connection, a retried response that kept its connection would leave the retry waiting
+        # for the pool until pool_timeout and then failing.
+        scheduler = self.scheduler(pool_size=1, pool_timeout=2, max_retries=1)
+        self.server.fail_next(502)
+        edges = []
+        body = scheduler.execute(PAGE_QUERY, PAGE_VARIABLES, EDGES_PATH, edges.append)
+        self.assertEqual(len(edges), 5)
+        self.assertEqual(body['data']['repository']['pullRequests']['totalCount'], 5)
+        for status, headers in ((429, {'Retry-After': 1}), (503, {})):
+            self.server.fail_next(status, headers)
+            edges = []
+            scheduler.execute(PAGE_QUERY, PAGE_VARIABLES, EDGES_PATH, edges.append)
+            self.assertEqual(len(edges), 5)
+        self.assertEqual(self.server.requests, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
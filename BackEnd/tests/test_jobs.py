@@ -0,0 +1,154 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import FAILED, FINALIZING, JobQueue, PARTIAL, QUEUED, RUNNING, SUCCEEDED  # noqa: E402
+
+REPOSITORIES = [('apache', 'kafka'), ('apache', 'jmeter')]
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.queue = JobQueue(lease_seconds=60, max_attempts=3, retry_delay=10, clock=lambda: self.now)
+
+    def job_statuses(self, run_id):
+        return [(job['repository'], job['status'], job['attempts']) for job in self.queue.run_status(run_id)['jobs']]
+
+    def test_jobs_are_claimed_once_in_order(self):
+        run_id = self.queue.create_run(REPOSITORIES)
+        self.assertEqual(self.queue.run_status(run_id)['status'], QUEUED)
+        first = self.queue.claim('worker-1')
+        second = self.queue.claim('worker-2')
+        self.assertEqual((first['repository'], first['status'], first['attempts']), ('kafka', RUNNING, 1))
+        self.assertEqual((second['repository'], second['worker_id']), ('jmeter', 'worker-2'))
+        self.assertIsNone(self.queue.claim('worker-3'))
+        self.assertEqual(self.queue.run_status(run_id)['status'], RUNNING)
+
+    def test_claim_is_limited_to_the_run_asked_for(self):
+        first_run = self.queue.create_run(REPOSITORIES[:1])
+        self.now += 1
+        second_run = self.queue.create_run(REPOSITORIES[1:])
+        self.assertEqual(self.queue.claim('worker-1', second_run)['run_id'], second_run)
+        self.assertEqual(self.queue.claim('worker-1')['run_id'], first_run)
+
+    def test_expired_lease_is_taken_over(self):
+        run_id = self.queue.create_run(REPOSITORIES[:1])
+        job = self.queue.claim('worker-1')
+        self.now += 30
+        self.queue.record_progress(job, 2)
+        # Progress renewed the lease, so it is still held at the original expiry.
+        self.now += 45
+        self.assertIsNone(self.queue.claim('worker-2'))
+        self.now += 20
+        taken_over = self.queue.claim('worker-2')
+        self.assertEqual((taken_over['worker_id'], taken_over['attempts']), ('worker-2', 2))
+        # The worker that lost the lease can neither complete nor fail the job any more.
+        self.assertFalse(self.queue.complete(job))
+        self.assertFalse(self.queue.fail(job, 'late'))
+        self.assertTrue(self.queue.complete(taken_over))
+        self.assertEqual(self.job_statuses(run_id), [('apache/kafka', SUCCEEDED, 2)])
+
+    def test_failed_attempts_are_retried_after_a_growing_delay(self):
+        run_id = self.queue.create_run(REPOSITORIES[:1])
+        job = self.queue.claim('worker-1')
+        self.assertFalse(self.queue.fail(job, 'first'))
+        self.assertEqual(self.job_statuses(run_id), [('apache/kafka', QUEUED, 1)])
+        self.now += 9
+        self.assertIsNone(self.queue.claim('worker-1'))
+        self.now += 1
+        job = self.queue.claim('worker-1')
+        self.assertEqual(job['attempts'], 2)
+        self.queue.fail(job, 'second')
+        # retry_delay * 2 ** (attempts - 1)
+        self.now += 19
+        self.assertIsNone(self.queue.claim('worker-1'))
+        self.now += 1
+        self.assertEqual(self.queue.claim('worker-1')['attempts'], 3)
+
+    def test_final_attempt_failure_fails_the_job(self):
+        run_id = self.queue.create_run(REPOSITORIES[:1])
+        for attempt in range(3):
+            job = self.queue.claim('worker-1')
+            self.assertEqual(job['attempts'], attempt + 1)
+            finished = self.queue.fail(job, f'attempt {attempt + 1}')
+            self.now += 100
+        self.assertTrue(finished)
+        self.assertIsNone(self.queue.claim('worker-1'))
+        status = self.queue.run_status(run_id)
+        self.assertEqual(status['jobs'][0]['status'], FAILED)
+        self.assertEqual(status['jobs'][0]['error'], 'attempt 3')
+        self.assertEqual(self.queue.outstanding_jobs(run_id), 0)
+
+    def test_lease_expiring_on_the_final_attempt_fails_the_job(self):
+        run_id = self.queue.create_run(REPOSITORIES[:1])
+        for _ in range(3):
+            self.queue.claim('worker-1')
+            self.now += 61
+        # The job comes back failed, so the caller can still finalize its run.
+        job = self.queue.claim('worker-2')
+        self.assertEqual(job['status'], FAILED)
+        self.assertEqual(self.queue.run_status(run_id)['jobs'][0]['error'], 'lease expired on the final attempt')
+        self.assertIsNone(self.queue.claim('worker-2'))
+
+    def test_finalization_is_claimed_exactly_once(self):
+        run_id = self.queue.create_run(REPOSITORIES)
+        first = self.queue.claim('worker-1')
+        second = self.queue.claim('worker-2')
+        self.queue.complete(first)
+        self.assertFalse(self.queue.claim_finalization(run_id))
+        self.queue.complete(second)
+        claims = [self.queue.claim_finalization(run_id) for _ in range(3)]
+        self.assertEqual(claims, [True, False, False])
+        self.assertEqual(self.queue.run_status(run_id)['status'], FINALIZING)
+        self.queue.finish_run(run_id, 7)
+        self.assertFalse(self.queue.claim_finalization(run_id))
+        status = self.queue.run_status(run_id)
+        self.assertEqual((status['status'], status['generation']), (SUCCEEDED, 7))
+
+    def test_dead_finalization_is_claimed_again_after_a_lease(self):
+        run_id = self.queue.create_run(REPOSITORIES[:1])
+        self.queue.complete(self.queue.claim('worker-1'))
+        self.assertTrue(self.queue.claim_finalization(run_id))
+        self.now += 30
+        self.assertFalse(self.queue.claim_finalization(run_id))
+        self.now += 31
+        self.assertTrue(self.queue.claim_finalization(run_id))
+
+    def test_unfinished_runs(self):
+        finished_run = self.queue.create_run(REPOSITORIES[:1])
+        self.queue.complete(self.queue.claim('worker-1', finished_run))
+        self.queue.claim_finalization(finished_run)
+        self.queue.finish_run(finished_run, 1)
+        outstanding_run = self.queue.create_run(REPOSITORIES[:1])
+        self.queue.claim('worker-1', outstanding_run)
+        abandoned_run = self.queue.create_run(REPOSITORIES[:1])
+        self.queue.complete(self.queue.claim('worker-1', abandoned_run))
+        # Finalized by nobody: its last job finished but the worker died before claiming the finalization.
+        self.assertEqual(self.queue.unfinished_runs(), [abandoned_run])
+        self.assertTrue(self.queue.claim_finalization(abandoned_run))
+        # Still unfinished while finalizing, in case the finalization dies as well.
+        self.assertEqual(self.queue.unfinished_runs(), [abandoned_run])
+        self.queue.finish_run(abandoned_run, 2)
+        self.assertEqual(self.queue.unfinished_runs(), [])
+
+    def test_outstanding_jobs_are_failed_for_a_run_nothing_works_on(self):
+        run_id = self.queue.create_run(REPOSITORIES)
+        self.queue.claim('worker-1')
+        self.assertEqual(self.queue.fail_outstanding(run_id, 'time limit'), 2)
+        self.assertEqual(self.queue.outstanding_jobs(run_id), 0)
+        self.assertTrue(self.queue.claim_finalization(run_id))
+        self.queue.finish_run(run_id, 3)
+        self.assertEqual(self.queue.run_status(run_id)['status'], PARTIAL)
+        self.assertEqual([job['error'] for job in self.queue.run_status(run_id)['jobs']], ['time limit'] * 2)
+
+    def test_run_without_repositories_succeeds_at_once(self):
+        run_id = self.queue.create_run([])
+        self.assertEqual(self.queue.run_status(run_id)['status'], SUCCEEDED)
+        self.assertEqual(self.queue.unfinished_runs(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
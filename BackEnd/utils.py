@@ -1,12 +1,20 @@
+import hashlib
+import hmac
+import os
 from datetime import datetime
+from functools import lru_cache
+
+from datetime import timedelta
+from datetime import timezone
 
 from models import Comment, PullRequestReview, PullRequestsPageInfo, PullRequestStatus, MergeableState, \
     PullRequest, RepositoryData, PullRequestStatusEnum, PullRequestMergeableEnum, TimeFrame, FilterCriteria
+from sketches import QuantileSketch, bucket_key
 
 from db_client import (
     create_comment,
-    create_repository,
-    create_pull_request
+    create_pull_request,
+    retrieve_record
 )
 
 from decimal import Decimal
@@ -16,8 +24,50 @@ def convert_float_to_decimal(value):
     return Decimal(str(value))
 
 
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+PASSWORD_HASH_ITERATIONS = 260000
+
+
+def hash_password(password, salt=None, iterations=PASSWORD_HASH_ITERATIONS):
+    salt = salt or os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), iterations).hex()
+    return f'pbkdf2_sha256${iterations}${salt}${digest}'
+
+
+def verify_password(password, password_hash):
+    # Whatever the request or the stored row holds, the answer is a match or not, never an error.
+    if not isinstance(password, str) or not isinstance(password_hash, str) or not password:
+        return False
+    try:
+        algorithm, iterations, salt, _ = password_hash.split('$')
+        if algorithm != 'pbkdf2_sha256':
+            return False
+        # Raises ValueError for a malformed iteration count or salt, and for a password that isn't valid UTF-8.
+        expected = hash_password(password, salt, int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(expected.encode(), password_hash.encode())
+
 
-def map_comments(comments, pr_id, repo, project, client):
+def verify_webhook_signature(secret, body, signature):
+    # GitHub signs every delivery with an HMAC-SHA256 of the raw body, sent as 'sha256=<hex>'.
+    if not signature or not signature.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature[len('sha256='):], expected)
+
+
+def map_comments(comments, pr_id, repo, project, client, writer=None):
     mapped_comments = []
     for comment in comments:
 
@@ -31,40 +81,40 @@ def map_comments(comments, pr_id, repo, project, client):
                                  pr_id,
                                  repo,
                                  project)
-        create_comment(mapped_comment, client)
+        create_comment(mapped_comment, client, writer)
         mapped_comments.append(mapped_comment)
     return mapped_comments
 
 
-def map_reviews(reviews, pr_id, repo, project,client):
+def map_reviews(reviews, pr_id, repo, project, client, writer=None):
     mapped_reviews = []
     for review in reviews:
         review_node = review.get('node', {})
         author = review_node.get('author', {}).get('login', None)
         review_comments = review_node.get('comments', {}).get('edges', [])
-        mapped_review = PullRequestReview(map_comments(review_comments, pr_id, repo, project,client),
+        mapped_review = PullRequestReview(map_comments(review_comments, pr_id, repo, project, client, writer),
                                           author,
                                           review_node.get('state', None))
         mapped_reviews.append(mapped_review)
     return mapped_reviews
 
 
-def updatePRStatustracker(pull_request_status, status):
+def updatePRStatustracker(pull_request_status, status, count=1):
     if status == 'OPEN':
-        pull_request_status.open_state += 1
+        pull_request_status.open_state += count
     elif status == 'CLOSED':
-        pull_request_status.closed += 1
+        pull_request_status.closed += count
     elif status == 'MERGED':
-        pull_request_status.merged += 1
+        pull_request_status.merged += count
 
 
-def updateMergeableStateTracker(mergeable_state, pull_request_mergeable_state):
+def updateMergeableStateTracker(mergeable_state, pull_request_mergeable_state, count=1):
     if pull_request_mergeable_state == 'MERGEABLE':
-        mergeable_state.mergeable += 1
+        mergeable_state.mergeable += count
     elif pull_request_mergeable_state == 'CONFLICTING':
-        mergeable_state.conflicting += 1
+        mergeable_state.conflicting += count
     elif pull_request_mergeable_state == 'UNKNOWN':
-        mergeable_state.unknown += 1
+        mergeable_state.unknown += count
 
 
 def updateMergeableStateTrackerForProject(mergeable_state, response_mergeable_state):
@@ -73,19 +123,32 @@ def updateMergeableStateTrackerForProject(mergeable_state, response_mergeable_st
     mergeable_state.unknown += response_mergeable_state.unknown
 
 
-def computeClosureTime(start_time, end_time):
-    date_format = "%Y-%m-%dT%H:%M:%SZ"
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+TIMESTAMP_CACHE_SIZE = int(os.environ.get('TIMESTAMP_CACHE_SIZE', 65536))
+
 
-    created_at = datetime.strptime(start_time, date_format)
-    concluded_at = datetime.strptime(end_time, date_format)
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_github_timestamp(timestamp):
+    # Whole seconds since the epoch. GitHub's own 'YYYY-MM-DDTHH:MM:SSZ' goes through the C fromisoformat, about
+    # eight times faster than strptime; anything with an offset or a fraction takes the general path.
+    if len(timestamp) == 20 and timestamp[19] == 'Z':
+        return (datetime.fromisoformat(timestamp[:19]) - EPOCH) // ONE_SECOND
+    parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return (parsed - EPOCH) // ONE_SECOND
 
-    time_difference = concluded_at - created_at
+
+def computeClosureTime(start_time, end_time):
+    # Durations stay in integer seconds; only the averages written out are turned into Decimal.
+    total_seconds = parse_github_timestamp(end_time) - parse_github_timestamp(start_time)
 
     return {
-        'days': time_difference.days,
-        'hours': time_difference.seconds // 3600,
-        'minutes': (time_difference.seconds % 3600) // 60,
-        'total_seconds': convert_float_to_decimal(time_difference.total_seconds())
+        'days': total_seconds // (24 * 3600),
+        'hours': total_seconds % (24 * 3600) // 3600,
+        'minutes': total_seconds % 3600 // 60,
+        'total_seconds': total_seconds
     }
 
 
@@ -107,104 +170,196 @@ def compute_average_closure_time(total_seconds, pr_count):
     }
 
 
-def map_github_response_to_repository(github_repository_response, project, repo, client):
-    repository_data = github_repository_response.get('data', {}).get('repository', {})
-
-    page_info_data = repository_data.get('pullRequests', {}).get('pageInfo', {})
-    mapped_page_info = PullRequestsPageInfo(page_info_data.get('endCursor', None),
-                                            page_info_data.get('hasNextPage', None),
-                                            page_info_data.get('hasPreviousPage', None))
-    pull_requests_count = repository_data.get('pullRequests', {}).get('totalCount', None)
-    pull_requests = repository_data.get('pullRequests', {}).get('edges', [])
-
-    mapped_pull_requests = []
-    total_comments_count = 0
-    concluded_pr_count = 0
-    total_open_time = 0
-    pull_request_status = PullRequestStatus()
-    mergeable_state = MergeableState()
-    repo_time_taken_to_reply = 0
-    repo_comment_reply_count = 0
-    for pull_request in pull_requests:
-        pull_request_node = pull_request.get('node', {})
-        author = pull_request_node.get('author', {}).get('login', None)
-        pr_id = pull_request_node.get('id', None)
-
-        comments = pull_request_node.get('comments', {}).get('edges', [])
-        mapped_comments = map_comments(comments, pr_id, repo, project,client)
-
-        reviews = pull_request_node.get('reviews', {}).get('edges', [])
-        mapped_reviews = map_reviews(reviews, pr_id, repo, project,client)
-        closure_time = None
-
-        create_time = pull_request_node.get('createdAt', None)
-        merged_time = pull_request_node.get('mergedAt', None)
-        closed_time = pull_request_node.get('closedAt', None)
-        if pull_request_node.get('closed', False) == True:
-            closure_time = computeClosureTime(create_time, closed_time)
-            concluded_pr_count += 1
-            total_open_time += closure_time['total_seconds']
-        elif pull_request_node.get('merged', False) == True:
-            closure_time = computeClosureTime(create_time, merged_time)
-            concluded_pr_count += 1
-            total_open_time += closure_time['total_seconds']
-
-        all_comments = mapped_comments
-        for review in mapped_reviews:
-            all_comments.extend(review.comments)
-
-        time_taken_to_reply = 0
-        comment_reply_count = 0
-        for comment in all_comments:
-            if comment.reply_to_comment_id is not None and comment.reply_to_comment_id.get('id', None) is not None:
-                comment_reply_count += 1
-                for other_comment in all_comments:
-                    if other_comment.comment_id == comment.reply_to_comment_id.get('id', None):
-                        time_taken_to_reply += \
-                            computeClosureTime(other_comment.created_date_time, comment.created_date_time)[
-                                'total_seconds']
-                        break
-
-        average_turnaround_time = compute_average_closure_time(time_taken_to_reply, comment_reply_count)
-        repo_time_taken_to_reply += time_taken_to_reply
-        repo_comment_reply_count += comment_reply_count
-
-        mapped_pull_request = PullRequest(pr_id,
-                                          pull_request_node.get('state', None),
-                                          pull_request_node.get('number', None),
-                                          pull_request_node.get('title', None),
-                                          pull_request_node.get('mergeable', None),
-                                          pull_request_node.get('totalCommentsCount', None),
-                                          mapped_comments,
-                                          mapped_reviews,
-                                          author,
-                                          project,
-                                          repo,
-                                          create_time,
-                                          merged_time,
-                                          closed_time,
-                                          closure_time,
-                                          average_turnaround_time
-                                          )
-        create_pull_request(mapped_pull_request, client)
-        mapped_pull_requests.append(mapped_pull_request)
-        total_comments_count += int(pull_request_node.get('totalCommentsCount', 0))
-        updatePRStatustracker(pull_request_status, pull_request_node.get('state', None))
-        updateMergeableStateTracker(mergeable_state, pull_request_node.get('mergeable', None))
-
-    average_closure_time = compute_average_closure_time(total_open_time, concluded_pr_count)
-    average_turnaround_time_repo = compute_average_closure_time(repo_time_taken_to_reply, repo_comment_reply_count)
-    mapped_repository = RepositoryData(repository_data.get('name', None),
-                                       pull_requests_count,
-                                       total_comments_count,
-                                       pull_request_status,
-                                       average_closure_time,
-                                       mergeable_state,
-                                       average_turnaround_time_repo)
-    create_repository(mapped_repository, client)
+ROLLUP_COUNTERS = ('pull_request_count', 'open', 'closed', 'merged', 'mergeable', 'conflicting', 'unknown',
+                   'total_comments', 'closure_seconds', 'closure_count', 'reply_seconds', 'reply_count')
+ROLLUP_STATUS_COUNTERS = {'OPEN': 'open', 'CLOSED': 'closed', 'MERGED': 'merged'}
+ROLLUP_MERGEABLE_COUNTERS = {'MERGEABLE': 'mergeable', 'CONFLICTING': 'conflicting', 'UNKNOWN': 'unknown'}
+
+
+def accumulate_rollup(rollups, pull_request, sign=1):
+    # Adds (or with sign=-1 removes) one stored pull request item to its (project, repository, author, day) rollup.
+    project = pull_request.get('project')
+    repository = pull_request.get('repository')
+    author = pull_request.get('author') or 'ghost'
+    day = (pull_request.get('createdAt') or '')[:10]
+    rollup_id = '#'.join([project or '', repository or '', author, day])
+    rollup = rollups.setdefault(rollup_id, {'project': project, 'repository': repository, 'author': author, 'day': day,
+                                            'counters': dict.fromkeys(ROLLUP_COUNTERS, 0)})
+    counters = rollup['counters']
+    counters['pull_request_count'] += sign
+    if pull_request.get('state') in ROLLUP_STATUS_COUNTERS:
+        counters[ROLLUP_STATUS_COUNTERS[pull_request.get('state')]] += sign
+    if pull_request.get('is_mergeable') in ROLLUP_MERGEABLE_COUNTERS:
+        counters[ROLLUP_MERGEABLE_COUNTERS[pull_request.get('is_mergeable')]] += sign
+    counters['total_comments'] += sign * (pull_request.get('total_comments_count') or 0)
+    if (pull_request.get('closureTime') or {}).get('total_seconds') is not None:
+        counters['closure_seconds'] += sign * pull_request['closureTime']['total_seconds']
+        counters['closure_count'] += sign
+        closure_bucket = f"closure_sketch_{bucket_key(pull_request['closureTime']['total_seconds'])}"
+        counters[closure_bucket] = counters.get(closure_bucket, 0) + sign
+    if (pull_request.get('avg_comment_reply_time') or {}).get('total_seconds') is not None:
+        counters['reply_seconds'] += sign * pull_request['avg_comment_reply_time']['total_seconds']
+        counters['reply_count'] += sign
+    # Sketch buckets are plain top-level counters as well, so rollups merge them with the same ADD.
+    for key, count in (pull_request.get('reply_sketch') or {}).items():
+        reply_bucket = f'reply_sketch_{key}'
+        counters[reply_bucket] = counters.get(reply_bucket, 0) + sign * int(count)
+
+
+def compute_reply_time(comments, reply_sketch=None):
+    # One id index per pull request instead of a scan of all comments per reply; timestamps are parsed through the
+    # memoized parse_github_timestamp.
+    comments_by_id = {}
+    for comment in comments:
+        comments_by_id.setdefault(comment.comment_id, comment)
+
+    time_taken_to_reply = 0
+    comment_reply_count = 0
+    for comment in comments:
+        reply_to_id = (comment.reply_to_comment_id or {}).get('id', None)
+        if reply_to_id is None:
+            continue
+        comment_reply_count += 1
+        replied_comment = comments_by_id.get(reply_to_id)
+        if replied_comment is not None:
+            time_difference = (parse_github_timestamp(comment.created_date_time)
+                               - parse_github_timestamp(replied_comment.created_date_time))
+            time_taken_to_reply += time_difference
+            if reply_sketch is not None:
+                reply_sketch.add(time_difference)
+    return time_taken_to_reply, comment_reply_count
+
+
+def accumulate_repository_totals(mapped_repository, pull_request, sign=1):
+    # Adds (or with sign=-1 removes) one stored pull request item to the raw sums behind the repository totals.
+    mapped_repository.total_comments_count += sign * int(pull_request.get('total_comments_count') or 0)
+    updatePRStatustracker(mapped_repository.pr_status, pull_request.get('state'), sign)
+    updateMergeableStateTracker(mapped_repository.mergeable_state, pull_request.get('is_mergeable'), sign)
+    if pull_request.get('closureTime') is not None:
+        mapped_repository.total_open_time += sign * pull_request['closureTime']['total_seconds']
+        mapped_repository.concluded_pr_count += sign
+    mapped_repository.total_reply_time += sign * pull_request.get('total_reply_time', 0)
+    mapped_repository.comment_reply_count += sign * pull_request.get('comment_reply_count', 0)
+
+
+def start_repository_totals(mapped_repository, name):
+    if mapped_repository is None:
+        mapped_repository = RepositoryData(name,
+                                           total_comments_count=0,
+                                           pr_status=PullRequestStatus(),
+                                           mergeable_state=MergeableState())
+    return mapped_repository
+
+
+def map_pull_request(pull_request_node, project, repo, client, mapped_repository, writer=None, rollups=None):
+    # Maps and writes one pull request node and adds it to the repository totals and rollups. Nothing of the node
+    # is kept, so a page can be mapped one pull request at a time as it is parsed.
+    author = pull_request_node.get('author', {}).get('login', None)
+    pr_id = pull_request_node.get('id', None)
+
+    comments = pull_request_node.get('comments', {}).get('edges', [])
+    mapped_comments = map_comments(comments, pr_id, repo, project, client, writer)
+
+    reviews = pull_request_node.get('reviews', {}).get('edges', [])
+    mapped_reviews = map_reviews(reviews, pr_id, repo, project, client, writer)
+    closure_time = None
+
+    create_time = pull_request_node.get('createdAt', None)
+    merged_time = pull_request_node.get('mergedAt', None)
+    closed_time = pull_request_node.get('closedAt', None)
+    if pull_request_node.get('closed', False) == True:
+        closure_time = computeClosureTime(create_time, closed_time)
+    elif pull_request_node.get('merged', False) == True:
+        closure_time = computeClosureTime(create_time, merged_time)
+
+    all_comments = list(mapped_comments)
+    for review in mapped_reviews:
+        all_comments.extend(review.comments)
+
+    reply_sketch = QuantileSketch()
+    time_taken_to_reply, comment_reply_count = compute_reply_time(all_comments, reply_sketch)
+
+    average_turnaround_time = compute_average_closure_time(time_taken_to_reply, comment_reply_count)
+
+    mapped_pull_request = PullRequest(pr_id,
+                                      pull_request_node.get('state', None),
+                                      pull_request_node.get('number', None),
+                                      pull_request_node.get('title', None),
+                                      pull_request_node.get('mergeable', None),
+                                      pull_request_node.get('totalCommentsCount', None),
+                                      mapped_comments,
+                                      mapped_reviews,
+                                      author,
+                                      project,
+                                      repo,
+                                      create_time,
+                                      merged_time,
+                                      closed_time,
+                                      closure_time,
+                                      average_turnaround_time,
+                                      pull_request_node.get('updatedAt', None),
+                                      time_taken_to_reply,
+                                      comment_reply_count,
+                                      reply_sketch
+                                      )
+    create_pull_request(mapped_pull_request, client, writer)
+    pull_request_item = mapped_pull_request.to_dict()
+    if rollups is not None:
+        accumulate_rollup(rollups, pull_request_item)
+    accumulate_repository_totals(mapped_repository, pull_request_item)
+    return mapped_pull_request
+
+
+def finish_repository_totals(mapped_repository, pull_requests_data, previous_pull_requests=None, rollups=None):
+    # An updated pull request was already counted by an earlier run, take its old contribution out.
+    for previous_pull_request in (previous_pull_requests or {}).values():
+        if rollups is not None:
+            accumulate_rollup(rollups, previous_pull_request, -1)
+        accumulate_repository_totals(mapped_repository, previous_pull_request, -1)
+
+    page_info_data = pull_requests_data.get('pageInfo', {})
+    mapped_repository.pull_requests_count = pull_requests_data.get('totalCount', None)
+    mapped_repository.average_closure_time = compute_average_closure_time(mapped_repository.total_open_time,
+                                                                          mapped_repository.concluded_pr_count)
+    mapped_repository.avg_comment_reply_time = compute_average_closure_time(mapped_repository.total_reply_time,
+                                                                            mapped_repository.comment_reply_count)
+    mapped_repository.page_info = PullRequestsPageInfo(page_info_data.get('endCursor', None),
+                                                       page_info_data.get('hasNextPage', None),
+                                                       page_info_data.get('hasPreviousPage', None))
     return mapped_repository
 
 
+def map_github_response_to_repository(github_repository_response, project, repo, client, mapped_repository=None,
+                                      previous_pull_requests=None, writer=None, rollups=None):
+    repository_data = (github_repository_response.get('data') or {}).get('repository') or {}
+    mapped_repository = start_repository_totals(mapped_repository, repository_data.get('name', repo))
+    for pull_request in repository_data.get('pullRequests', {}).get('edges', []):
+        map_pull_request(pull_request.get('node', {}), project, repo, client, mapped_repository, writer, rollups)
+    return finish_repository_totals(mapped_repository, repository_data.get('pullRequests', {}),
+                                    previous_pull_requests, rollups)
+
+
+def repository_from_item(item):
+    # Transactions only keep the raw sums of a row up to date, so its averages are derived from them on every read.
+    # Rows from before the sums were kept have only their stored averages.
+    mapped_repository = RepositoryData.from_dict(item)
+    if 'concluded_pr_count' in item:
+        mapped_repository.average_closure_time = compute_average_closure_time(mapped_repository.total_open_time,
+                                                                              mapped_repository.concluded_pr_count)
+        mapped_repository.avg_comment_reply_time = compute_average_closure_time(
+            mapped_repository.total_reply_time, mapped_repository.comment_reply_count)
+    return mapped_repository
+
+
+def restore_repository_data(project, repo, client):
+    # Rows written before they were keyed by project as well are read under the bare name until the next sync
+    # writes one under the new key.
+    item = retrieve_record(f'{project}/{repo}', client, 'repositories') or retrieve_record(repo, client, 'repositories')
+    if item is None:
+        return None
+    return repository_from_item(item)
+
+
 def updatePullRequestStatusForProject(project_pr_status, response_pr_status):
     project_pr_status.open_state += response_pr_status.open_state
     project_pr_status.closed += response_pr_status.closed
@@ -227,7 +382,168 @@ def constructFilterCriteria(requested_data):
 
     time_frame = None
     if from_date is not None or to_date is not None:
-        time_frame = TimeFrame(from_date, to_date)
+        time_frame = TimeFrame(from_date, end_of_day_bound(to_date))
 
     return FilterCriteria(status=status, author=author, timeframe=time_frame, project=project, repository=repository,
                           mergeable=mergeable)
+
+
+# Pull request attributes needed to take a stored pull request back out of the repository totals and rollups.
+REPLACEMENT_ATTRIBUTES = ('id', 'project', 'repository', 'author', 'createdAt', 'total_comments_count', 'state',
+                          'is_mergeable', 'closureTime', 'avg_comment_reply_time', 'total_reply_time',
+                          'comment_reply_count', 'reply_sketch', 'revision')
+
+# The only pull request attributes the metrics read, used as projection for analytics reads.
+METRIC_ATTRIBUTES = ('total_comments_count', 'avg_comment_reply_time.total_seconds', 'state', 'is_mergeable',
+                     'closureTime.total_seconds', 'reply_sketch')
+PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+
+def accumulate_pull_request_metrics(metrics, pull_request):
+    metrics.total_comments += pull_request.get('total_comments_count', 0)
+    if (pull_request.get('avg_comment_reply_time') or {}).get('total_seconds') is not None:
+        metrics.reply_seconds += pull_request['avg_comment_reply_time']['total_seconds']
+        metrics.reply_count += 1
+    if pull_request.get('state') is not None:
+        updatePRStatustracker(metrics.pr_status, pull_request.get('state'))
+    if pull_request.get('is_mergeable') is not None:
+        updateMergeableStateTracker(metrics.mergeable_state, pull_request.get('is_mergeable'))
+    if (pull_request.get('closureTime') or {}).get('total_seconds') is not None:
+        metrics.closure_seconds += pull_request['closureTime']['total_seconds']
+        metrics.closure_count += 1
+        metrics.closure_sketch.add(pull_request['closureTime']['total_seconds'])
+    metrics.reply_sketch.merge(QuantileSketch(pull_request.get('reply_sketch')))
+    metrics.pull_request_count += 1
+
+
+def accumulate_rollup_metrics(metrics, rollup):
+    metrics.pull_request_count += int(rollup.get('pull_request_count', 0))
+    metrics.total_comments += rollup.get('total_comments', 0)
+    updatePullRequestStatusForProject(metrics.pr_status, PullRequestStatus(int(rollup.get('open', 0)),
+                                                                           int(rollup.get('closed', 0)),
+                                                                           int(rollup.get('merged', 0))))
+    updateMergeableStateTrackerForProject(metrics.mergeable_state, MergeableState(int(rollup.get('mergeable', 0)),
+                                                                                  int(rollup.get('conflicting', 0)),
+                                                                                  int(rollup.get('unknown', 0))))
+    metrics.closure_seconds += rollup.get('closure_seconds', 0)
+    metrics.closure_count += int(rollup.get('closure_count', 0))
+    metrics.reply_seconds += rollup.get('reply_seconds', 0)
+    metrics.reply_count += int(rollup.get('reply_count', 0))
+    for name, count in rollup.items():
+        if name.startswith('closure_sketch_'):
+            metrics.closure_sketch.add_bucket(name[len('closure_sketch_'):], count)
+        elif name.startswith('reply_sketch_'):
+            metrics.reply_sketch.add_bucket(name[len('reply_sketch_'):], count)
+
+
+def compute_percentiles(sketch):
+    percentiles = {}
+    for name, quantile in PERCENTILES:
+        value = sketch.quantile(quantile)
+        percentiles[name] = compute_average_closure_time(int(round(value)), 1) if value is not None else None
+    return percentiles
+
+
+def pull_request_metrics_response(metrics):
+    return {"avg_comment_turnaround_time": compute_average_closure_time(metrics.reply_seconds, metrics.reply_count),
+            "avg_pull_request_closure_time": compute_average_closure_time(metrics.closure_seconds,
+                                                                          metrics.closure_count),
+            "pull_request_status": metrics.pr_status.to_dict(),
+            "total_comments": metrics.total_comments,
+            "pull_request_merge_status": metrics.mergeable_state.to_dict(),
+            "pull_request_count": metrics.pull_request_count,
+            "pull_request_closure_time_percentiles": compute_percentiles(metrics.closure_sketch),
+            "comment_turnaround_time_percentiles": compute_percentiles(metrics.reply_sketch)}
+
+
+def matches_filter_criteria(applied_filters, item, sort_key='createdAt'):
+    for attribute in ('author', 'repository', 'project'):
+        value = getattr(applied_filters, attribute)
+        if value and item.get(attribute) != value:
+            return False
+    if applied_filters.status and item.get('state') != applied_filters.status.value:
+        return False
+    if applied_filters.mergeable and item.get('is_mergeable') != applied_filters.mergeable.value:
+        return False
+    timeframe = applied_filters.timeframe
+    if timeframe and timeframe.from_date and (item.get(sort_key) or '') < timeframe.from_date:
+        return False
+    if timeframe and timeframe.to_date and (item.get(sort_key) or '') > timeframe.to_date:
+        return False
+    return True
+
+
+def union_filter_criteria(filters):
+    # The narrowest criteria every slice still falls within: attributes all slices agree on, and the smallest
+    # timeframe spanning all of theirs. Status and mergeable are left to matches_filter_criteria.
+    union = FilterCriteria()
+    for attribute in ('author', 'repository', 'project'):
+        values = {getattr(applied_filters, attribute) for applied_filters in filters}
+        if len(values) == 1:
+            setattr(union, attribute, values.pop())
+    timeframes = [applied_filters.timeframe for applied_filters in filters]
+    from_dates = [timeframe.from_date if timeframe else None for timeframe in timeframes]
+    to_dates = [timeframe.to_date if timeframe else None for timeframe in timeframes]
+    from_date = min(from_dates) if from_dates and all(from_dates) else None
+    to_date = max(to_dates) if to_dates and all(to_dates) else None
+    if from_date or to_date:
+        union.timeframe = TimeFrame(from_date, to_date)
+    return union
+
+
+def shard_for(sync_id, shard_count):
+    # md5 rather than hash(), which is salted per process, so every worker agrees on the assignment.
+    return int(hashlib.md5(sync_id.encode()).hexdigest(), 16) % shard_count
+
+
+TIMESERIES_INTERVALS = ('day', 'week', 'month')
+
+
+def bucket_start(day, interval):
+    # Weeks start on Monday; the bucket is named after its first day.
+    if not day or interval == 'day':
+        return day
+    if interval == 'month':
+        return f'{day[:7]}-01'
+    start = datetime.strptime(day, "%Y-%m-%d")
+    return (start - timedelta(days=start.weekday())).strftime("%Y-%m-%d")
+
+
+def is_start_of_day(timestamp):
+    return timestamp[11:].strip('0:Z') == ''
+
+
+def end_of_day_bound(to_date):
+    # A date alone as the end of a timeframe covers that whole day, as it does in /timeseries.
+    return f'{to_date}T23:59:59Z' if to_date and len(to_date) == 10 else to_date
+
+
+def split_timeframe_by_day(timeframe):
+    # Splits a timeframe into whole days, answered from rollups, and the partial days at either end, which have
+    # to be read from the raw pull requests. Returns None when no whole day is covered.
+    from_date = timeframe.from_date if timeframe else None
+    to_date = end_of_day_bound(timeframe.to_date) if timeframe else None
+    partial_timeframes = []
+
+    first_day = None
+    if from_date:
+        first_day = from_date[:10]
+        if not is_start_of_day(from_date):
+            first_day = (datetime.strptime(first_day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+            # A bound that sorts outside its own day leaves an empty partial day, and DynamoDB rejects a BETWEEN
+            # whose lower bound is above its upper one.
+            if from_date <= f'{from_date[:10]}T23:59:59Z':
+                partial_timeframes.append(TimeFrame(from_date, f'{from_date[:10]}T23:59:59Z'))
+
+    last_day = None
+    if to_date:
+        last_day = to_date[:10]
+        if to_date[11:] < '23:59:59Z':
+            last_day = (datetime.strptime(last_day, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+            # Such as '...T00:00', which sorts before the day's first timestamp.
+            if to_date >= f'{to_date[:10]}T00:00:00Z':
+                partial_timeframes.append(TimeFrame(f'{to_date[:10]}T00:00:00Z', to_date))
+
+    if first_day and last_day and first_day > last_day:
+        return None
+    return TimeFrame(first_day, last_day), partial_timeframes
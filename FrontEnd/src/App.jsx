@@ -88,6 +88,24 @@ function App() {
                                                data={formatTime(gitResponse.avg_comment_turnaround_time)}/>
                                 </div>
                             </div>
+                            <div className="row mb-4">
+                                <div className="col-md-3">
+                                    <ScoreCard title="Median time to merge pull-requests"
+                                               data={formatTime(gitResponse.pull_request_closure_time_percentiles?.p50)}/>
+                                </div>
+                                <div className="col-md-3">
+                                    <ScoreCard title="90th percentile time to merge pull-requests"
+                                               data={formatTime(gitResponse.pull_request_closure_time_percentiles?.p90)}/>
+                                </div>
+                                <div className="col-md-3">
+                                    <ScoreCard title="Median turnaround time per comment"
+                                               data={formatTime(gitResponse.comment_turnaround_time_percentiles?.p50)}/>
+                                </div>
+                                <div className="col-md-3">
+                                    <ScoreCard title="90th percentile turnaround time per comment"
+                                               data={formatTime(gitResponse.comment_turnaround_time_percentiles?.p90)}/>
+                                </div>
+                            </div>
 
 
                         </>